@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+"""
+This module lets risiparse be used as a library, the chapters of a risitas
+are yielded as the pages are downloaded, nothing is written on disk.
+"""
+
+from typing import AsyncIterator, Iterable, Iterator, Optional
+import asyncio
+
+from risiparse.risiparse import PageDownloader, RisitasPostsDownload
+from risiparse.utils.utils import get_domain, get_parser
+from risiparse.utils.utils_posts import Chapter
+
+
+def iter_chapters(
+        link: str,
+        identifiers: Optional[Iterable[str]] = None,
+        authors: Optional[Iterable[str]] = None,
+        all_posts: bool = False,
+        no_match_author: bool = False,
+        no_resize_images: bool = False,
+        use_database: bool = False,
+) -> Iterator[Chapter]:
+    """
+    Yield the chapters of a risitas, a page is only downloaded
+    when the chapters of the previous one have been consumed.
+    The options are the same as the command line ones.
+    """
+    args = get_parser().parse_args([])
+    if identifiers is not None:
+        args.identifiers = list(identifiers)
+    if authors is not None:
+        args.authors = list(authors)
+    args.all_posts = all_posts
+    args.no_match_author = no_match_author
+    args.no_resize_images = no_resize_images
+    args.no_database = not use_database
+    domain = get_domain(link)
+    page_downloader = PageDownloader(domain)
+    posts_downloader = RisitasPostsDownload(page_downloader, args)
+    posts_downloader.disable_database_webarchive(domain)
+    risitas_info = posts_downloader.get_risitas_info(link, domain)
+    posts = posts_downloader.posts
+    for page_number in range(1, risitas_info.total_pages + 1):
+        # The first page has already been downloaded for the risitas info
+        if page_number == 1:
+            soup = risitas_info.soup
+        else:
+            soup = page_downloader.download_topic_page(link, page_number)
+        if not soup:
+            continue
+        posts.get_posts(soup, posts_downloader.authors, False, 0, page_number)
+        posts.save_chapters()
+        chapters, posts.chapters = posts.chapters, []
+        yield from chapters
+
+
+async def aiter_chapters(
+        link: str,
+        **kwargs,
+) -> AsyncIterator[Chapter]:
+    """
+    Asynchronous version of iter_chapters, the downloads and
+    the parsing are done in a thread to not block the event loop.
+    """
+    chapters = iter_chapters(link, **kwargs)
+    while True:
+        chapter = await asyncio.to_thread(next, chapters, None)
+        if chapter is None:
+            return
+        yield chapter
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+"""
+This module crawls the topic listings of a forum to find new risitas,
+the listing pages are downloaded concurrently, a batch at a time.
+"""
+
+from typing import Dict, List, NamedTuple
+import concurrent.futures
+import logging
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+from risiparse.risiparse import get_page_downloader
+from risiparse.utils.database import read_discovered, update_discovered
+from risiparse.utils.utils import is_risitas_title, normalize_link
+from risiparse.utils.utils_links import get_topic_id
+
+TOPICS_PER_LISTING_PAGE = 25
+POSTS_PER_PAGE = 20
+
+
+class ListedTopic(NamedTuple):
+    """A topic found in a listing page"""
+    topic_id: str
+    link: str
+    title: str
+    risitas: bool
+    replies: int
+    total_pages: int
+
+
+def get_listing_link(site, page: int) -> str:
+    """Get the link of a listing page of a site, the first page is 1"""
+    return site.LISTING_LINK.value.format(
+        offset=(page - 1) * TOPICS_PER_LISTING_PAGE + 1
+    )
+
+
+def parse_listing_page(
+        soup: BeautifulSoup,
+        site,
+        listing_link: str,
+) -> List[ListedTopic]:
+    """Get the topics of a listing page"""
+    topics = []
+    for item in soup.select(site.LISTING_TOPIC_SELECTOR.value):
+        title_link = item.select_one(site.LISTING_TITLE_SELECTOR.value)
+        if not title_link or not title_link.get("href"):
+            continue
+        link = normalize_link(urljoin(listing_link, title_link["href"]))
+        try:
+            topic_id = get_topic_id(link)
+        except IndexError:
+            continue
+        title = title_link.get("title") or title_link.text.strip()
+        count = item.select_one(site.LISTING_COUNT_SELECTOR.value)
+        try:
+            replies = int(count.text.strip())
+        except (AttributeError, ValueError):
+            replies = 0
+        topics.append(
+            ListedTopic(
+                topic_id,
+                link,
+                title,
+                is_risitas_title(title),
+                replies,
+                replies // POSTS_PER_PAGE + 1,
+            )
+        )
+    return topics
+
+
+def download_listing_page(site, page: int) -> List[ListedTopic]:
+    """Download and parse a listing page, nothing if it can't be downloaded"""
+    listing_link = get_listing_link(site, page)
+    soup = get_page_downloader(site.SITE.value).download_listing_page(
+        listing_link
+    )
+    if not soup:
+        return []
+    return parse_listing_page(soup, site, listing_link)
+
+
+def discover_topics(
+        site,
+        max_pages: int,
+        workers: int,
+) -> List[ListedTopic]:
+    """
+    Crawl the listing pages of a site until a batch of pages only has
+    topics already seen with the same number of replies, the listings
+    being sorted by last reply. The topics seen are recorded.
+    Return the risitas that were never seen before.
+    """
+    workers = max(1, workers)
+    new_risitas: List[ListedTopic] = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers
+    ) as executor:
+        for first_page in range(1, max_pages + 1, workers):
+            pages = range(first_page, min(first_page + workers, max_pages + 1))
+            topics: Dict[str, ListedTopic] = {}
+            for page_topics in executor.map(
+                    lambda page: download_listing_page(site, page),
+                    pages
+            ):
+                for topic in page_topics:
+                    topics.setdefault(topic.topic_id, topic)
+            seen = read_discovered(topics)
+            changed = [
+                topic for topic in topics.values()
+                if seen.get(topic.topic_id) != topic.replies
+            ]
+            update_discovered(changed)
+            new_risitas.extend(
+                topic for topic in changed
+                if topic.risitas and topic.topic_id not in seen
+            )
+            if not changed:
+                logging.info(
+                    "The listing pages of %s from page %d were already seen",
+                    site.SITE.value, first_page
+                )
+                break
+    logging.info(
+        "Found %d new risitas on %s", len(new_risitas), site.SITE.value
+    )
+    return new_risitas
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+"""
+This module writes epub files from the chapters html, without Qt.
+The chapters are streamed into the zip container one by one.
+"""
+
+from typing import Iterable, List, Set, Tuple
+import datetime
+import logging
+import mimetypes
+import pathlib
+import re
+import uuid
+import zipfile
+from xml.sax.saxutils import escape
+
+from bs4 import BeautifulSoup
+from risiparse.utils.utils_files import atomic_write
+
+CONTAINER_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<container version="1.0" '
+    'xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+    '  <rootfiles>\n'
+    '    <rootfile full-path="OEBPS/content.opf" '
+    'media-type="application/oebps-package+xml"/>\n'
+    '  </rootfiles>\n'
+    '</container>'
+)
+
+XHTML_TEMPLATE = (
+    """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="fr" lang="fr">
+<head>
+<meta charset="UTF-8"/>
+<title>{title}</title>
+</head>
+<body>
+{body}
+</body>
+</html>"""
+)
+
+# Characters that are not allowed in xml documents
+INVALID_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _get_chapter_label(soup: BeautifulSoup, number: int) -> str:
+    label = soup.text.strip().replace("\n", " ")[0:50]
+    return label or f"Chapitre {number}"
+
+
+class EpubFile():
+    """Write an epub file, chapter after chapter"""
+
+    def __init__(
+            self,
+            epub_path: pathlib.Path,
+            img_folder_path: pathlib.Path,
+    ) -> None:
+        self.epub_path = epub_path
+        self.img_folder_path = img_folder_path
+        self.chapters: List[Tuple[str, str]] = []
+        self.images: Set[str] = set()
+
+    def _add_images(
+            self,
+            epub: zipfile.ZipFile,
+            soup: BeautifulSoup
+    ) -> None:
+        """
+        Embed the images downloaded or cached in the epub, epub 3 doesn't
+        allow remote images so the other ones are replaced by their link.
+        """
+        for img in soup.select("img"):
+            src = img.attrs.get("src", "")
+            file_name = src[src.rfind("/"):][1:]
+            img_path = self.img_folder_path / file_name
+            if not file_name or not img_path.is_file():
+                link = soup.new_tag("a", href=src)
+                link.string = src
+                img.replace_with(link)
+                continue
+            if file_name not in self.images:
+                epub.write(img_path, f"OEBPS/images/{file_name}")
+                self.images.add(file_name)
+            img.attrs["src"] = f"images/{file_name}"
+
+    def write(
+            self,
+            title: str,
+            author: str,
+            chapters: Iterable[str],
+    ) -> None:
+        """Write the chapters and the epub metadata"""
+        with atomic_write(self.epub_path) as epub_file, zipfile.ZipFile(
+                epub_file, "w", zipfile.ZIP_DEFLATED
+        ) as epub:
+            # The mimetype must be the first file and not compressed
+            epub.writestr(
+                "mimetype",
+                "application/epub+zip",
+                compress_type=zipfile.ZIP_STORED
+            )
+            epub.writestr("META-INF/container.xml", CONTAINER_XML)
+            for number, chapter in enumerate(chapters, start=1):
+                soup = BeautifulSoup(
+                    INVALID_XML_CHARS.sub("", chapter),
+                    features="html.parser"
+                )
+                self._add_images(epub, soup)
+                file_name = f"chapter-{number}.xhtml"
+                with epub.open(f"OEBPS/{file_name}", "w") as chapter_file:
+                    chapter_file.write(
+                        XHTML_TEMPLATE.format(
+                            title=escape(title),
+                            body=soup.decode()
+                        ).encode("utf-8")
+                    )
+                self.chapters.append(
+                    (file_name, _get_chapter_label(soup, number))
+                )
+            epub.writestr("OEBPS/nav.xhtml", self._get_nav(title))
+            epub.writestr("OEBPS/content.opf", self._get_opf(title, author))
+        logging.info("Created %s", self.epub_path)
+
+    def _get_nav(self, title: str) -> str:
+        items = "\n".join(
+            f'<li><a href="{file_name}">{escape(label)}</a></li>'
+            for file_name, label in self.chapters
+        )
+        body = f'<nav epub:type="toc" id="toc"><ol>\n{items}\n</ol></nav>'
+        nav = XHTML_TEMPLATE.format(title=escape(title), body=body)
+        return nav.replace(
+            'xmlns="http://www.w3.org/1999/xhtml"',
+            'xmlns="http://www.w3.org/1999/xhtml" '
+            'xmlns:epub="http://www.idpf.org/2007/ops"'
+        )
+
+    def _get_opf(self, title: str, author: str) -> str:
+        modified = datetime.datetime.now(
+            datetime.timezone.utc
+        ).strftime("%Y-%m-%dT%H:%M:%SZ")
+        items = [
+            '<item id="nav" href="nav.xhtml" '
+            'media-type="application/xhtml+xml" properties="nav"/>'
+        ]
+        for number, (file_name, _) in enumerate(self.chapters, start=1):
+            items.append(
+                f'<item id="chapter-{number}" href="{file_name}" '
+                'media-type="application/xhtml+xml"/>'
+            )
+        for number, file_name in enumerate(sorted(self.images), start=1):
+            media_type = (
+                mimetypes.guess_type(file_name)[0] or
+                "application/octet-stream"
+            )
+            items.append(
+                f'<item id="image-{number}" href="images/{escape(file_name)}" '
+                f'media-type="{media_type}"/>'
+            )
+        spine = "\n".join(
+            f'<itemref idref="chapter-{number}"/>'
+            for number in range(1, len(self.chapters) + 1)
+        )
+        manifest = "\n".join(items)
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" '
+            'unique-identifier="book-id">\n'
+        ) + f"""<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:identifier id="book-id">urn:uuid:{uuid.uuid4()}</dc:identifier>
+<dc:title>{escape(title)}</dc:title>
+<dc:creator>{escape(author)}</dc:creator>
+<dc:language>fr</dc:language>
+<meta property="dcterms:modified">{modified}</meta>
+</metadata>
+<manifest>
+{manifest}
+</manifest>
+<spine>
+{spine}
+</spine>
+</package>"""
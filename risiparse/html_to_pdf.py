@@ -2,30 +2,185 @@
 
 """This module takes care of the html to pdf conversion using QWebEngine"""
 
-from typing import List, Iterator
+from typing import Dict, List, Iterator, Optional
+import gzip
 import logging
+import mimetypes
+import os
 import pathlib
 
-from PySide6.QtCore import QUrl
+from PySide6.QtCore import QUrl, QBuffer, QIODevice, QTimer
 from PySide6.QtGui import QPageLayout, QPageSize
 from PySide6 import QtWidgets
-from PySide6.QtWebEngineCore import QWebEnginePage, QWebEngineSettings
+from PySide6.QtWebEngineCore import (
+    QWebEnginePage,
+    QWebEngineProfile,
+    QWebEngineSettings,
+    QWebEngineUrlScheme,
+    QWebEngineUrlSchemeHandler,
+    QWebEngineUrlRequestJob,
+    QWebEngineUrlRequestInterceptor,
+)
+from risiparse.utils.utils_page_downloader import get_image_file_name
+from risiparse.utils.log import FMT, ColorFormatter, set_file_logging
+
+SCHEME = b"risiparse"
+
+
+def register_url_scheme() -> None:
+    """
+    Register the risiparse:// scheme used to load local files,
+    this must be done before the QApplication is created.
+    """
+    if QWebEngineUrlScheme.schemeByName(SCHEME).name():
+        return
+    scheme = QWebEngineUrlScheme(SCHEME)
+    scheme.setSyntax(QWebEngineUrlScheme.Syntax.Path)
+    scheme.setFlags(
+        QWebEngineUrlScheme.Flag.LocalScheme |
+        QWebEngineUrlScheme.Flag.LocalAccessAllowed
+    )
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+
+def get_scheme_url(file_path: pathlib.Path) -> QUrl:
+    """Get the risiparse:// url of a local file"""
+    url = QUrl.fromLocalFile(file_path.as_posix())
+    url.setScheme(SCHEME.decode())
+    return url
+
+
+class LocalFileSchemeHandler(QWebEngineUrlSchemeHandler):
+    """
+    Serve local files on the risiparse:// scheme,
+    gzip compressed html files are decompressed in memory.
+    """
+    def requestStarted(self, job) -> None:  # pylint: disable=invalid-name
+        """Reply with the content of the requested file"""
+        url = QUrl(job.requestUrl())
+        url.setScheme("file")
+        file_path = pathlib.Path(url.toLocalFile())
+        if not file_path.is_file():
+            logging.error("Can't find %s", file_path)
+            job.fail(QWebEngineUrlRequestJob.Error.UrlNotFound)
+            return
+        if file_path.suffix == ".gz":
+            data = gzip.decompress(file_path.read_bytes())
+            mime_type = "text/html"
+        else:
+            data = file_path.read_bytes()
+            mime_type = (
+                mimetypes.guess_type(file_path.name)[0] or
+                "application/octet-stream"
+            )
+        buffer = QBuffer(job)
+        buffer.setData(data)
+        buffer.open(QIODevice.ReadOnly)
+        job.reply(mime_type.encode(), buffer)
+
+
+class ImageCacheInterceptor(QWebEngineUrlRequestInterceptor):
+    """
+    Redirect the remote images found in the image folder to the
+    risiparse:// scheme, optionally block every other remote request.
+    """
+    def __init__(
+            self,
+            img_folder_path: Optional[pathlib.Path],
+            block_remote: bool = False,
+            parent=None,
+    ) -> None:
+        super().__init__(parent)
+        self.img_folder_path = img_folder_path
+        self.block_remote = block_remote
+
+    def interceptRequest(self, info) -> None:  # pylint: disable=invalid-name
+        """Called by QWebEngine for every request, on the io thread"""
+        url = info.requestUrl()
+        if url.scheme() not in ("http", "https"):
+            return
+        if self.img_folder_path:
+            file_name = get_image_file_name(url.path())
+            img_path = self.img_folder_path / file_name
+            if file_name and img_path.is_file():
+                info.redirect(get_scheme_url(img_path))
+                return
+        if self.block_remote:
+            logging.debug("Blocked %s", url.toString())
+            info.block(True)
+
+
+def install_image_interceptor(
+        img_folder_path: Optional[pathlib.Path],
+        block_remote: bool = False,
+) -> None:
+    """Intercept the requests of the pages using the default profile"""
+    profile = QWebEngineProfile.defaultProfile()
+    # The profile doesn't take ownership of the interceptor
+    profile.setUrlRequestInterceptor(
+        ImageCacheInterceptor(img_folder_path, block_remote, profile)
+    )
+
+
+def get_renderer_memory(page: QWebEnginePage) -> int:
+    """
+    Get the resident memory in bytes of the render process of a page,
+    0 if it is unknown.
+    """
+    status_path = pathlib.Path(f"/proc/{page.renderProcessPid()}/status")
+    try:
+        for line in status_path.read_text(encoding="utf-8").splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
 
 
 class PdfPage(QWebEnginePage):
-    """Produce a pdf from an html file"""
-    def __init__(self, output_dir: pathlib.Path) -> None:
+    """
+    Produce a pdf from an html file, a file that isn't converted
+    within timeout seconds is reported as failed.
+    """
+    def __init__(
+            self,
+            output_dir: pathlib.Path,
+            pool: Optional['PdfRendererPool'] = None,
+            timeout: int = 0,
+    ) -> None:
         super().__init__()
         self._htmls: Iterator[pathlib.Path] = iter([pathlib.Path()])
         self.output_dir = output_dir
+        self.pool = pool
         self.current_file: pathlib.Path = pathlib.Path()
+        self._pdf_file = ""
+        self._output_file = pathlib.Path()
+        self._rendering = False
+        self.files_rendered = 0
 
         self.pdf_folder_path: pathlib.Path = output_dir / "risitas-pdf"
         self.pdf_files: List[pathlib.Path] = []
+        # The pages of a pool share their results
+        self.converted: Dict[pathlib.Path, pathlib.Path] = (
+            pool.converted if pool else {}
+        )
+        self.failed: List[pathlib.Path] = pool.failed if pool else []
+
+        self.timeout = timeout
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(  # pylint: disable=no-member
+            self._handle_timeout
+        )
 
         self.settings().setAttribute(
             QWebEngineSettings.JavascriptEnabled, False
         )
+        if not self.profile().urlSchemeHandler(SCHEME):
+            self.profile().installUrlSchemeHandler(
+                SCHEME,
+                LocalFileSchemeHandler(self.profile())
+            )
 
         self.setZoomFactor(1)
         self.layout = QPageLayout()
@@ -49,22 +204,224 @@ class PdfPage(QWebEnginePage):
         return self.pdf_files
 
     def _fetch_next(self) -> bool:
+        # The pages of a pool share the same queue of html files
+        htmls = self.pool.htmls if self.pool else self._htmls
         try:
-            self.current_file = next(self._htmls)
-            self.load(QUrl.fromLocalFile(self.current_file.as_posix()))
+            self.current_file = next(htmls)
         except StopIteration:
             return False
+        self._rendering = True
+        self._pdf_file = ""
+        if self.timeout:
+            self.timer.start(self.timeout * 1000)
+        if self.current_file.suffix == ".gz":
+            self.load(get_scheme_url(self.current_file))
+        else:
+            self.load(QUrl.fromLocalFile(self.current_file.as_posix()))
         return True
 
-    def _handle_load_finished(self) -> None:
-        pdf_file = self.current_file.with_suffix(".pdf").name
-        output_file: pathlib.Path = self.pdf_folder_path / pdf_file
-        self.printToPdf(str(output_file), layout=self.layout)
+    def _handle_load_finished(self, ok: bool) -> None:
+        if not self._rendering or self._pdf_file:
+            return
+        if not ok:
+            self._fail("couldn't be loaded")
+            return
+        html_file = self.current_file
+        if html_file.suffix == ".gz":
+            html_file = html_file.with_suffix("")
+        pdf_file = html_file.with_suffix(".pdf").name
+        # Sharded html files get their pdf in the same subdirectory
+        try:
+            shard = html_file.parent.relative_to(
+                self.output_dir / "risitas-html"
+            )
+        except ValueError:
+            shard = pathlib.Path()
+        output_file: pathlib.Path = self.pdf_folder_path / shard / pdf_file
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        # Printed under a temporary name, renamed once complete
+        self._output_file = output_file
+        self._pdf_file = str(
+            output_file.with_name(f".{output_file.name}.{os.getpid()}.tmp")
+        )
+        self.printToPdf(self._pdf_file, layout=self.layout)
         logging.info("Creating %s", output_file)
 
-    def _handle_printing_finished(self, html_file: str) -> None:
-        file_path = pathlib.Path(html_file)
-        logging.info("Created %s", html_file)
+    def _handle_printing_finished(self, html_file: str, success: bool) -> None:
+        # A late pdf of a file that timed out is removed
+        if not self._rendering or html_file != self._pdf_file:
+            pathlib.Path(html_file).unlink(missing_ok=True)
+            return
+        if not success:
+            pathlib.Path(html_file).unlink(missing_ok=True)
+            self._fail("couldn't be printed")
+            return
+        file_path = self._output_file
+        os.replace(html_file, file_path)
+        logging.info("Created %s", file_path)
+        self.timer.stop()
+        self._rendering = False
         self.pdf_files.append(file_path)
-        if not self._fetch_next():
+        self.converted[self.current_file] = file_path
+        self._done()
+
+    def _handle_timeout(self) -> None:
+        if not self._rendering:
+            return
+        self.triggerAction(QWebEnginePage.WebAction.Stop)
+        self._fail(f"timed out after {self.timeout}s")
+
+    def _fail(self, reason: str) -> None:
+        logging.error("The pdf of %s %s", self.current_file, reason)
+        self.timer.stop()
+        self._rendering = False
+        if self._pdf_file:
+            pathlib.Path(self._pdf_file).unlink(missing_ok=True)
+        self.failed.append(self.current_file)
+        # The render process of a page that timed out may be stuck
+        self._done(recycle=reason.startswith("timed out"))
+
+    def _done(self, recycle: bool = False) -> None:
+        self.files_rendered += 1
+        if self.pool:
+            self.pool.page_done(self, recycle)
+        elif not self._fetch_next():
+            QtWidgets.QApplication.quit()
+
+
+class PdfRendererPool():
+    """
+    Keep several pages rendering at once on the same event loop,
+    each page takes the next html file from a shared queue when it is done.
+    QWebEngine renders the pages in separate processes, a page is
+    replaced after recycle_after files or once its render process uses
+    more than max_memory bytes.
+    """
+    def __init__(
+            self,
+            output_dir: pathlib.Path,
+            size: int = 1,
+            timeout: int = 0,
+            recycle_after: int = 0,
+            max_memory: int = 0,
+    ) -> None:
+        self.output_dir = output_dir
+        self.timeout = timeout
+        self.recycle_after = recycle_after
+        self.max_memory = max_memory
+        self.htmls: Iterator[pathlib.Path] = iter([])
+        self.converted: Dict[pathlib.Path, pathlib.Path] = {}
+        self.failed: List[pathlib.Path] = []
+        self.pages = [
+            PdfPage(output_dir, self, timeout) for _ in range(max(1, size))
+        ]
+        self._htmls_order: List[pathlib.Path] = []
+        self._busy_pages = 0
+
+    def convert(self, htmls: List[pathlib.Path]) -> bool:
+        """
+        Start the conversion on every page, return False if there
+        is nothing to convert and the event loop must not be started.
+        """
+        self._htmls_order = list(htmls)
+        self.htmls = iter(self._htmls_order)
+        for page in self.pages:
+            if page._fetch_next():  # pylint: disable=protected-access
+                self._busy_pages += 1
+        return bool(self._busy_pages)
+
+    def _must_recycle(self, page: PdfPage) -> bool:
+        if self.recycle_after and page.files_rendered >= self.recycle_after:
+            return True
+        if self.max_memory:
+            memory = get_renderer_memory(page)
+            if memory > self.max_memory:
+                logging.info(
+                    "The render process uses %s MB, recycling the page",
+                    memory // (1 << 20)
+                )
+                return True
+        return False
+
+    def page_done(self, page: PdfPage, recycle: bool = False) -> None:
+        """
+        Called by a page when it is done with a file, it takes the next
+        one, replaced by a new page if needed.
+        """
+        if recycle or self._must_recycle(page):
+            self.pages.remove(page)
+            page.deleteLater()
+            page = PdfPage(self.output_dir, self, self.timeout)
+            self.pages.append(page)
+            logging.debug("Recycled a pdf page")
+        if page._fetch_next():  # pylint: disable=protected-access
+            return
+        self._busy_pages -= 1
+        if not self._busy_pages:
             QtWidgets.QApplication.quit()
+
+    def get_converted(self) -> Dict[pathlib.Path, pathlib.Path]:
+        """Return the pdf path of each html file converted"""
+        return self.converted
+
+    def get_pdfs_path(self) -> List[pathlib.Path]:
+        """Return the pdfs path in the same order as the html files"""
+        return [
+            self.converted[html] for html in self._htmls_order
+            if html in self.converted
+        ]
+
+
+def init_render_process(
+        output_dir: pathlib.Path,
+        debug: bool = False,
+) -> None:
+    """
+    Initialize a worker process of the pdf process pool, it logs
+    like the main process, to the terminal and to the log file.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+    stdout_handler = logging.StreamHandler()
+    stdout_handler.setLevel(logging.DEBUG if debug else logging.INFO)
+    stdout_handler.setFormatter(ColorFormatter(FMT))
+    logger.addHandler(stdout_handler)
+    set_file_logging(output_dir, logger, FMT)
+
+
+def render_pdfs(
+        output_dir: pathlib.Path,
+        htmls: List[pathlib.Path],
+        size: int = 1,
+        img_folder_path: Optional[pathlib.Path] = None,
+        block_remote_images: bool = False,
+        timeout: int = 0,
+        recycle_after: int = 0,
+        max_memory: int = 0,
+) -> Dict[pathlib.Path, pathlib.Path]:
+    """
+    Convert html files with a pool of pages in the current process,
+    the QApplication of the process is created on first use and reused.
+    The images are loaded from img_folder_path when they are in it.
+    Return the pdf path of each html file converted.
+    """
+    register_url_scheme()
+    app = (
+        QtWidgets.QApplication.instance() or
+        QtWidgets.QApplication([])
+    )
+    if img_folder_path or block_remote_images:
+        install_image_interceptor(img_folder_path, block_remote_images)
+    pool = PdfRendererPool(
+        output_dir,
+        size,
+        timeout,
+        recycle_after,
+        max_memory
+    )
+    if pool.convert(htmls):
+        app.exec()
+    for page in pool.pages:
+        page.deleteLater()
+    return pool.get_converted()
@@ -2,13 +2,23 @@
 
 """This is the main module containing the core routines for risiparse"""
 
-from typing import List, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import concurrent.futures
+import contextlib
+import copy
 import sys
+import functools
+import heapq
+import itertools
 import logging
+import os
 import pathlib
 import re
+import socket
+import threading
+import time
+import colorama
 import requests
-import waybackpy
 
 from bs4 import BeautifulSoup
 from requests.adapters import HTTPAdapter
@@ -22,13 +32,38 @@ from risiparse.utils.utils import (
     create_pdfs,
     parse_input_links,
     get_args,
-    write_html_template
+    write_html_file,
+    append_to_html_file,
+    get_shard_name,
+    record_output,
+    open_jsonl_output,
+    write_jsonl_record,
+    strip_compressed_suffix,
+    get_html_image_urls,
+    rollback_interrupted_append,
+    complete_html_append,
+    get_topic_lock_path,
+    iter_topic_links,
+    copy_node_files,
+    get_pdf_path,
+    is_in_shard
+)
+from risiparse.utils.utils_links import (
+    contains_webarchive,
+    get_topic_id,
+    strip_webarchive_link
+)
+from risiparse.utils.utils_files import (
+    atomic_write_bytes,
+    file_lock,
+    reserve_numbered_file
 )
 from risiparse.utils.utils_page_downloader import (
     get_page_link,
     get_webarchive_link,
     get_webarchive_page_link,
     image_exists,
+    get_image_file_name,
     change_img_src_path
 )
 from risiparse.utils.utils_posts import (
@@ -36,25 +71,57 @@ from risiparse.utils.utils_posts import (
     check_post_identifiers,
     contains_blockquote,
     print_chapter_added,
-    contains_paragraph
+    contains_paragraph,
+    get_image_urls,
+    get_page_content_hash,
+    Chapter
+)
+from risiparse.utils.log import FMT, ColorFormatter, set_file_logging
+from risiparse.html_to_epub import EpubFile
+from risiparse.utils import database
+from risiparse.utils.database import (
+    update_db,
+    read_db,
+    delete_db,
+    insert_chapter,
+    read_chapters,
+    read_page,
+    update_page,
+    delete_page_chapters,
+    save_checkpoint,
+    set_checkpoint_file_path,
+    read_checkpoint,
+    delete_checkpoint,
+    read_chapters_after,
+    read_all_risitas,
+    read_manifest_names,
+    index_chapters,
+    search_chapters,
+    enqueue_jobs,
+    lease_job,
+    finish_job,
+    renew_lease,
+    release_job,
+    retry_jobs,
+    read_jobs_status,
+    read_failed_jobs,
+    merge_db,
+    read_watch,
+    update_watch,
+    read_output_topic_id
 )
-from risiparse.utils.log import ColorFormatter, set_file_logging
-from risiparse.utils.database import update_db, read_db, delete_db
 
 LOGGER = logging.getLogger()
-LOGGER.handlers.clear()
-LOGGER.setLevel(logging.DEBUG)
-
-FMT = '%(asctime)s:%(levelname)s: %(message)s'
 
 STDOUT_HANDLER = logging.StreamHandler()
 STDOUT_HANDLER.setLevel(logging.INFO)
 STDOUT_HANDLER.setFormatter(ColorFormatter(FMT))
 
-LOGGER.addHandler(STDOUT_HANDLER)
-
 DEFAULT_TIMEOUT = 5  # seconds
 
+# Seconds between two looks at the job queue when serving
+SERVE_POLL_INTERVAL = 5
+
 
 class TimeoutHTTPAdapter(HTTPAdapter):
     """This takes care of the default timeout for all requests"""
@@ -77,12 +144,19 @@ class TimeoutHTTPAdapter(HTTPAdapter):
         return super().send(request, **kwargs)
 
 
+IMAGE_PREFETCH_WORKERS = 8
+
+
 class PageDownloader():
     """Handle all the downloads made by risiparse"""
 
     def __init__(self, domain: str):
         self.domain = domain
         self.webarchive = bool(self.domain == Webarchive.SITE.value)
+        # Validators of the last topic page downloaded
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.not_modified = False
         self.http = requests.Session()
         self.retries = Retry(
             total=5,
@@ -96,8 +170,13 @@ class PageDownloader():
             self,
             page_link: str,
             page_number: int = 1,
+            validators: Optional[Tuple[Optional[str], Optional[str]]] = None,
     ) -> Optional['BeautifulSoup']:
-        """Download the soup of the current page"""
+        """
+        Download the soup of the current page, if the etag and last
+        modified date of a previous download are given and the page
+        didn't change, not_modified is set and None is returned.
+        """
         if not self.webarchive:
             page_link = get_page_link(
                 page_number,
@@ -111,8 +190,16 @@ class PageDownloader():
             if webarchive_link:
                 page_link = webarchive_link
         logging.info("Going to page %s", page_link)
+        headers = {}
+        if validators:
+            etag, last_modified = validators
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        self.not_modified = False
         try:
-            page = self.http.get(page_link)
+            page = self.http.get(page_link, headers=headers)
         except requests.exceptions.RetryError as retry_error:
             logging.exception(retry_error)
             logging.error(
@@ -121,6 +208,12 @@ class PageDownloader():
             )
             return None
         page_status = page.status_code
+        self.etag = page.headers.get("ETag")
+        self.last_modified = page.headers.get("Last-Modified")
+        if page_status == 304:
+            logging.info("The page %s has not changed", page_link)
+            self.not_modified = True
+            return None
         if page_status == 410:
             logging.error(
                 "The page has been 410ed, try "
@@ -135,6 +228,27 @@ class PageDownloader():
         soup = BeautifulSoup(page.content, features="lxml")
         return soup
 
+    def download_listing_page(
+            self,
+            listing_link: str,
+    ) -> Optional['BeautifulSoup']:
+        """Download the soup of a page listing the topics of a forum"""
+        logging.info("Going to listing page %s", listing_link)
+        try:
+            page = self.http.get(listing_link)
+        except requests.exceptions.RequestException as request_error:
+            logging.error(
+                "Couldn't download %s : %s", listing_link, request_error
+            )
+            return None
+        if page.status_code != 200:
+            logging.error(
+                "Couldn't download %s, status %d",
+                listing_link, page.status_code
+            )
+            return None
+        return BeautifulSoup(page.content, features="lxml")
+
     def download_img_page(self, page_link: str) -> Optional[str]:
         """Get the full scale image link"""
         page = self.http.get(page_link)
@@ -162,13 +276,18 @@ class PageDownloader():
             "Mozilla/5.0 (Windows NT 5.1; rv:40.0) "
             "Gecko/20100101 Firefox/40.0"
         )
+        # Imported here, the Wayback Machine is rarely needed
+        import waybackpy  # pylint: disable=import-outside-toplevel
         try:
             wayback = waybackpy.Url(link, user_agent)
             oldest_archive = wayback.oldest()
             oldest_archive_url = oldest_archive.archive_url
             image = self.http.get(oldest_archive_url)
             status_code = image.status_code
-        except waybackpy.exceptions.WaybackError as wayback_error:
+        except (
+                waybackpy.exceptions.WaybackError,
+                requests.exceptions.RequestException,
+        ) as wayback_error:
             logging.exception(wayback_error)
             return None
         if status_code != 200:
@@ -195,7 +314,7 @@ class PageDownloader():
                     link = get_webarchive_link(img)
                 else:
                     link = img.attrs["src"]
-                file_name = link[link.rfind("/"):][1:]
+                file_name = get_image_file_name(link)
                 if not image_exists(file_name, img_folder_path):
                     logging.info(
                         "Image not in cache, downloading "
@@ -216,21 +335,116 @@ class PageDownloader():
                         image = self.get_webarchive_img(link)
                         if not image:
                             continue
-                    file_name = image.url[image.url.rfind("/"):][1:]
+                    file_name = get_image_file_name(image.url)
                     img_file_path = img_folder_path / file_name
-                    img_file_path.write_bytes(image.content)
+                    atomic_write_bytes(img_file_path, image.content)
                 change_img_src_path(img, img_folder_path, file_name)
 
+    def prefetch_images(
+            self,
+            links: Iterable[str],
+            img_folder_path: pathlib.Path,
+            workers: int = IMAGE_PREFETCH_WORKERS,
+    ) -> int:
+        """
+        Download the images missing from the image folder in parallel,
+        return the number of images downloaded.
+        """
+        img_folder_path.mkdir(parents=True, exist_ok=True)
+        missing_images = {
+            get_image_file_name(link): link for link in links
+            if get_image_file_name(link) and
+            not image_exists(get_image_file_name(link), img_folder_path)
+        }
+        if not missing_images:
+            return 0
+        logging.info(
+            "Prefetching %s images not in cache", len(missing_images)
+        )
+
+        def prefetch_image(file_name: str, link: str) -> bool:
+            # An image that can't be downloaded is left out,
+            # the other images are still prefetched
+            try:
+                image = self.http.get(link)
+                if image.status_code == 404:
+                    image = self.get_webarchive_img(link)
+                if image is None or image.status_code != 200:
+                    return False
+                atomic_write_bytes(img_folder_path / file_name, image.content)
+            except Exception as error:  # pylint: disable=broad-except
+                logging.error("Couldn't download %s : %s", link, error)
+                return False
+            logging.debug("Prefetched %s", file_name)
+            return True
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            return sum(
+                executor.map(
+                    prefetch_image,
+                    missing_images.keys(),
+                    missing_images.values()
+                )
+            )
+
+
+# The page downloaders of each thread, by domain
+_PAGE_DOWNLOADERS = threading.local()
+
+
+def get_page_downloader(domain: str) -> PageDownloader:
+    """
+    Get the page downloader of a domain for the current thread,
+    its http session is kept alive from one risitas to the next.
+    """
+    page_downloaders = getattr(_PAGE_DOWNLOADERS, "by_domain", None)
+    if page_downloaders is None:
+        page_downloaders = _PAGE_DOWNLOADERS.by_domain = {}
+    if domain not in page_downloaders:
+        page_downloaders[domain] = PageDownloader(domain)
+    return page_downloaders[domain]
+
+
+def get_total_pages(soup: BeautifulSoup, selectors, domain: str) -> int:
+    """Get the number of pages of a topic from any of its pages"""
+    try:
+        topic_symbol = soup.select_one(
+            selectors.TOTAL_SELECTOR.value
+        ).text
+        if domain == Jvc.SITE.value:
+            if topic_symbol == "»":
+                topic_symbol = soup.select_one(
+                    selectors.TOTAL_SELECTOR_ALTERNATIVE.value
+                ).text
+    except AttributeError:
+        topic_symbol = None
+    if not topic_symbol and domain == Webarchive.SITE.value:
+        logging.info(
+            "This risitas has only one "
+            "page!"
+        )
+        topic_pages = 1
+    else:
+        topic_pages = int(topic_symbol)
+    return topic_pages
+
 
 class RisitasInfo():
     """
     This gets the author name and the total number of pages and the title.
     """
 
-    def __init__(self, page_soup: BeautifulSoup, selectors, domain: str):
+    def __init__(
+            self,
+            page_soup: BeautifulSoup,
+            selectors,
+            domain: str,
+            topic_id: str = "",
+    ):
         self.soup = page_soup
         self.selectors = selectors
         self.domain = domain
+        self.topic_id = topic_id
         self.author = self.get_author_name(self.soup)
         self.total_pages = self.get_total_pages(self.soup)
         self.title = self.get_title(self.soup)
@@ -269,26 +483,7 @@ class RisitasInfo():
 
     def get_total_pages(self, soup: BeautifulSoup) -> int:
         """Get the number of pages to parse"""
-        try:
-            topic_symbol = soup.select_one(
-                self.selectors.TOTAL_SELECTOR.value
-            ).text
-            if self.domain == Jvc.SITE.value:
-                if topic_symbol == "»":
-                    topic_symbol = soup.select_one(
-                        self.selectors.TOTAL_SELECTOR_ALTERNATIVE.value
-                    ).text
-        except AttributeError:
-            topic_symbol = None
-        if not topic_symbol and self.domain == Webarchive.SITE.value:
-            logging.info(
-                "This risitas has only one "
-                "page!"
-            )
-            topic_pages = 1
-        else:
-            topic_pages = int(topic_symbol)
-        return topic_pages
+        return get_total_pages(soup, self.selectors, self.domain)
 
     def get_title(self, soup: BeautifulSoup) -> str:
         """Get the title of the risitas"""
@@ -320,9 +515,16 @@ class Posts():
             risitas_info: 'RisitasInfo',
             downloader: PageDownloader,
             args,
+            chapter_sink: Optional[Callable[[Chapter], None]] = None,
     ):
         self.risitas_html: List['BeautifulSoup'] = []
         self.risitas_raw_text: List[str] = []
+        self.chapters: List[Chapter] = []
+        # Chapters accepted but not stored in the database yet
+        self.unsaved_chapters: List[Chapter] = []
+        self.chapter_sink = chapter_sink
+        self.page_number = 1
+        self.page_post_count = 0
         self.downloader = downloader
         self.risitas_info = risitas_info
         self.args = args
@@ -332,13 +534,11 @@ class Posts():
         self.count = 0
         self.duplicates = 0
 
-    def _check_post_author(
+    def _get_post_author(
             self,
             post: BeautifulSoup,
-            no_match_author: bool,
             is_web_archive: bool,
-            authors: List[str]
-    ) -> bool:
+    ) -> Optional[str]:
         # This is needed cuz deleted accounts are not handled
         # the same way for whatever reason...
         try:
@@ -346,13 +546,24 @@ class Posts():
                 self.risitas_info.selectors.AUTHOR_SELECTOR.value
             ).text.strip()
         except AttributeError:
-            if not is_web_archive:
-                logging.debug("Author deleted his account")
-                post_author = post.select_one(
-                    self.risitas_info.selectors.DELETED_AUTHOR_SELECTOR.value
-                ).text.strip()
-            else:
-                return False
+            if is_web_archive:
+                return None
+            logging.debug("Author deleted his account")
+            post_author = post.select_one(
+                self.risitas_info.selectors.DELETED_AUTHOR_SELECTOR.value
+            ).text.strip()
+        return post_author
+
+    def _check_post_author(
+            self,
+            post: BeautifulSoup,
+            no_match_author: bool,
+            is_web_archive: bool,
+            authors: List[str]
+    ) -> bool:
+        post_author = self._get_post_author(post, is_web_archive)
+        if post_author is None:
+            return False
         logging.debug(
             "The current author is "
             "%s "
@@ -518,12 +729,48 @@ class Posts():
                 self.past_post_cursor_page = True
         return skip_post
 
+    def _store_chapter(
+            self,
+            post: BeautifulSoup,
+            risitas_html: BeautifulSoup,
+            contains_image: bool,
+            post_cursor: int,
+    ) -> None:
+        """Keep the accepted post, it is stored by save_chapters"""
+        is_domain_webarchive = bool(
+            self.risitas_info.domain == Webarchive.SITE.value
+        )
+        author = self._get_post_author(post, is_domain_webarchive)
+        chapter = Chapter(
+            topic_id=self.risitas_info.topic_id,
+            title=self.risitas_info.title,
+            author=author or self.risitas_info.author,
+            page=self.page_number,
+            post_cursor=post_cursor,
+            html=str(risitas_html),
+            text=risitas_html.text,
+            contains_image=contains_image,
+            image_urls=get_image_urls(risitas_html),
+        )
+        self.chapters.append(chapter)
+        if not self.args.no_database:
+            self.unsaved_chapters.append(chapter)
+        if self.chapter_sink:
+            self.chapter_sink(chapter)
+
+    def save_chapters(self) -> None:
+        """Store the chapters accepted since the last call"""
+        for chapter in self.unsaved_chapters:
+            insert_chapter(chapter)
+        self.unsaved_chapters.clear()
+
     def is_risitas_post(
             self,
             post,
             risitas_html,
             is_domain_webarchive: bool,
-            authors: List[str]
+            authors: List[str],
+            post_cursor: int = 0,
     ) -> bool:
         """Check if the given post is a risitas"""
         is_part_of_risitas = False
@@ -539,6 +786,7 @@ class Posts():
             if self.args.all_posts:
                 self.count += 1
                 self.risitas_html.append((risitas_html, ))
+                self._store_chapter(post, risitas_html, False, post_cursor)
                 break
             contains_identifiers = check_post_identifiers(
                 post,
@@ -579,14 +827,17 @@ class Posts():
             risitas_authors: List,
             append_to_html: bool,
             post_cursor_db: int,
+            page_number: int = 1,
     ) -> None:
         """
         Check conditions to see if it's a post relevant to the risitas
         """
+        self.page_number = page_number
         is_domain_webarchive = bool(
             self.risitas_info.domain == "web.archive.org"
         )
         posts = soup.select(self.risitas_info.selectors.POST_SELECTOR.value)
+        self.page_post_count = len(posts)
         self.added_post = False
         for post_cursor, post in enumerate(posts):
             if self._skip_post(append_to_html, post_cursor, post_cursor_db):
@@ -600,7 +851,8 @@ class Posts():
                     post,
                     risitas_html,
                     is_domain_webarchive,
-                    risitas_authors
+                    risitas_authors,
+                    post_cursor
             ):
                 continue
             contains_image = self._check_post_is_image(risitas_html)
@@ -611,6 +863,12 @@ class Posts():
             self.added_post = True
             self.risitas_html.append((risitas_html, contains_image))
             self.risitas_raw_text.append(risitas_html.text)
+            self._store_chapter(
+                post,
+                risitas_html,
+                contains_image,
+                post_cursor
+            )
             self.count += 1
             self.post_cursor = post_cursor
 
@@ -618,21 +876,27 @@ class Posts():
 class RisitasPostsDownload():
     """Handle the download of posts"""
 
-    def __init__(self, page_downloader, args):
+    def __init__(self, page_downloader, args, chapter_sink=None):
         self.page_downloader = page_downloader
         self.args = args
+        self.chapter_sink = chapter_sink
         self.page_number = 0
         self.posts = None
         self.authors = []
         self.append_to_html = False
         self.post_cursor = 0
+        # Pages already revalidated by a sync, None if not modified
+        self.revalidated: Dict[int, Optional[BeautifulSoup]] = {}
 
     def disable_database_webarchive(self, domain) -> None:
         """
         If webarchive, no database because the risitas will never get updated.
         Jeuxvideo.com forbids archive by webarchive, only jvarchive works.
+        The args are copied, the next risitas downloaded with them
+        still uses the database.
         """
         if domain == Webarchive.SITE.value:
+            self.args = copy.copy(self.args)
             self.args.no_database = True
 
     def get_risitas_info(
@@ -646,14 +910,24 @@ class RisitasPostsDownload():
             link,
             1,
         )
-        risitas_info = RisitasInfo(soup, selectors, domain)
+        risitas_info = RisitasInfo(
+            soup,
+            selectors,
+            domain,
+            get_topic_id(link)
+        )
+        self.set_risitas_info(risitas_info)
+        return risitas_info
+
+    def set_risitas_info(self, risitas_info: 'RisitasInfo') -> None:
+        """Download the posts of a risitas whose informations are known"""
         self.authors = [risitas_info.author] + self.args.authors
         self.posts = Posts(
             risitas_info,
             self.page_downloader,
             self.args,
+            self.chapter_sink,
         )
-        return risitas_info
 
     def _set_init_post_cursor(
         self,
@@ -707,6 +981,127 @@ class RisitasPostsDownload():
                 "is : %d", self.posts.risitas_info.title, self.posts.duplicates
             )
 
+    def resume_from_checkpoint(self, row, checkpoint) -> int:
+        """
+        Load the chapters stored by an interrupted download, it resumes
+        after the page of the checkpoint. Return the page to resume at.
+        """
+        risitas_info = self.posts.risitas_info
+        page, post_cursor = (row[4], row[5]) if row else (0, -1)
+        for chapter in read_chapters_after(
+                risitas_info.topic_id,
+                page,
+                post_cursor,
+                checkpoint[0]
+        ):
+            risitas_html = BeautifulSoup(chapter[3], features="html.parser")
+            self.posts.risitas_html.append((risitas_html, bool(chapter[5])))
+            self.posts.risitas_raw_text.append(risitas_html.text)
+            self.posts.chapters.append(
+                Chapter(
+                    topic_id=risitas_info.topic_id,
+                    title=risitas_info.title,
+                    author=chapter[2],
+                    page=chapter[0],
+                    post_cursor=chapter[1],
+                    html=chapter[3],
+                    text=risitas_html.text,
+                    contains_image=bool(chapter[5]),
+                    image_urls=get_image_urls(risitas_html),
+                )
+            )
+            self.posts.count += 1
+        # The posts of the pages after the checkpoint are all new
+        self.posts.past_post_cursor_page = True
+        self.append_to_html = bool(row)
+        self.page_number = checkpoint[0] + 1
+        self.post_cursor = checkpoint[1]
+        logging.info(
+            "Resuming the download of %s at page %d, "
+            "%d chapters were already downloaded",
+            risitas_info.title,
+            self.page_number,
+            len(self.posts.chapters)
+        )
+        return self.page_number
+
+    def record_page(self, soup: BeautifulSoup, page_number: int) -> str:
+        """Store the state of a downloaded page, return its chapter hashes"""
+        selectors = self.posts.risitas_info.selectors
+        return update_page(
+            self.posts.risitas_info.topic_id,
+            page_number,
+            get_page_content_hash(
+                soup.select(selectors.POST_SELECTOR.value),
+                selectors.RISITAS_TEXT_SELECTOR.value
+            ),
+            self.page_downloader.etag,
+            self.page_downloader.last_modified,
+            self.posts.page_post_count,
+        )
+
+    def sync_pages(
+            self,
+            link: str,
+            last_page: int,
+            post_cursor: int,
+    ) -> Tuple[List[int], Dict[int, Optional[BeautifulSoup]]]:
+        """
+        Revalidate the pages already downloaded, a page whose posts
+        changed is processed again and its stored chapters replaced.
+        The chapters of the last page after post_cursor are new, they are
+        left to the download that appends them.
+        The first page is the one downloaded for the risitas info.
+        Return the pages whose chapters changed, and the last page
+        revalidated, None if it was not modified, so that it isn't
+        downloaded again to look for new posts.
+        """
+        topic_id = self.posts.risitas_info.topic_id
+        selectors = self.posts.risitas_info.selectors
+        changed_pages = []
+        revalidated: Dict[int, Optional[BeautifulSoup]] = {}
+        for page_number in range(1, last_page + 1):
+            page_state = read_page(topic_id, page_number)
+            if page_number == 1:
+                soup = self.posts.risitas_info.soup
+            else:
+                soup = self.page_downloader.download_topic_page(
+                    link,
+                    page_number,
+                    page_state[1:3] if page_state else None
+                )
+            if page_number == last_page and (
+                    soup or self.page_downloader.not_modified
+            ):
+                revalidated[page_number] = soup
+            if not soup:
+                continue
+            content_hash = get_page_content_hash(
+                soup.select(selectors.POST_SELECTOR.value),
+                selectors.RISITAS_TEXT_SELECTOR.value
+            )
+            if page_state and page_state[0] == content_hash:
+                logging.info("The posts of page %d are the same", page_number)
+                continue
+            self.posts.get_posts(soup, self.authors, False, 0, page_number)
+            if page_number == last_page:
+                self.posts.unsaved_chapters = [
+                    chapter for chapter in self.posts.unsaved_chapters
+                    if chapter.post_cursor <= post_cursor
+                ]
+            with database.transaction():
+                delete_page_chapters(topic_id, page_number)
+                self.posts.save_chapters()
+                chapter_hashes = self.record_page(soup, page_number)
+            if not page_state:
+                continue
+            if chapter_hashes != page_state[4]:
+                logging.info(
+                    "The chapters of page %d have changed", page_number
+                )
+                changed_pages.append(page_number)
+        return changed_pages, revalidated
+
     def download_posts(
             self,
             link: str,
@@ -718,9 +1113,17 @@ class RisitasPostsDownload():
             self._set_init_post_cursor(row)
             if not self.page_number:
                 self.page_number = 1
-            soup = self.page_downloader.download_topic_page(
-                link, self.page_number
-            )
+            if self.page_number in self.revalidated:
+                soup = self.revalidated.pop(self.page_number)
+                if soup is None:
+                    # Not modified since the last download, nothing new
+                    self.posts.past_post_cursor_page = True
+                    self.page_number += 1
+                    continue
+            else:
+                soup = self.page_downloader.download_topic_page(
+                    link, self.page_number
+                )
             if not soup:
                 self.page_number += 1
                 continue
@@ -729,12 +1132,24 @@ class RisitasPostsDownload():
                 self.authors,
                 self.append_to_html,
                 self.post_cursor,
+                self.page_number,
             )
-            self.page_number += 1
             self._set_post_cursor(
                 page,
                 total_pages
             )
+            # The chapters of a page are committed with its checkpoint,
+            # the write lock isn't held while its images are fetched
+            if not self.args.no_database:
+                with database.transaction():
+                    self.posts.save_chapters()
+                    self.record_page(soup, self.page_number)
+                    save_checkpoint(
+                        self.posts.risitas_info.topic_id,
+                        self.page_number,
+                        self.post_cursor
+                    )
+            self.page_number += 1
         self.log_posts_downloaded_and_duplicates()
         return self.posts.risitas_html
 
@@ -759,9 +1174,19 @@ class RisitasHtmlFile():
 
     htmls_file_path: List['pathlib.Path'] = []
 
-    def __init__(self, risitas_html, risitas_info, args, row):
+    def __init__(
+            self,
+            risitas_html,
+            risitas_info,
+            args,
+            row,
+            chapters=None,
+            resume_file_path=None,
+    ):
         self.html_file_path = pathlib.Path()
+        self.resume_file_path: Optional[pathlib.Path] = resume_file_path
         self.risitas_html = risitas_html
+        self.chapters: List[Chapter] = chapters or []
         self.risitas_info = risitas_info
         self.args = args
         self.row = row
@@ -769,134 +1194,915 @@ class RisitasHtmlFile():
     def append_to_or_write_html_file(
             self,
             append_to_html: bool,
+            state: Optional[Tuple[int, int]] = None,
     ) -> None:
         """
         Create or append an html file, side effect is to
-        collect html_file_path in order to convert them to pdf
+        collect html_file_path in order to convert them to pdf.
+        The page and post cursor of the download are kept in the append
+        journal until they are committed.
         """
         if append_to_html and not self.args.no_database:
             self.html_file_path = pathlib.Path(self.row[3])
             self.htmls_file_path.append(self.html_file_path)
-            self.append_html()
+            self.append_html(state)
         else:
             self.write_html()
             self.htmls_file_path.append(self.html_file_path)
 
+    def record_html_file(self, append_to_html: bool) -> None:
+        """Record the html file and index its new chapters"""
+        if not self.args.no_database:
+            # An appended file isn't hashed, it would be read in full
+            record_output(
+                self.args.output_dir,
+                self.html_file_path,
+                "html",
+                self.risitas_info.topic_id,
+                hash_file=not append_to_html
+            )
+            index_chapters(
+                self.html_file_path,
+                self.chapters,
+                replace=not append_to_html
+            )
+
     def _increment_html_file_name(self) -> None:
         title_slug = slugify(self.risitas_info.title, title=True)
         author_slug = slugify(self.risitas_info.author, title=False)
-        ext = "html"
-        i = 0
-        full_title = f"{author_slug}-{title_slug}-{i}"
-        html_path = (
-            self.args.output_dir /
-            "risitas-html" /
-            (full_title + f".{ext}")
-        )
-        while html_path.exists():
-            i += 1
-            full_title = f"{author_slug}-{title_slug}-{i}"
-            html_path = (
-                self.args.output_dir /
-                "risitas-html" /
-                (full_title + f".{ext}")
-            )
-        self.html_file_path = html_path
+        ext = "html.gz" if self.args.compress else "html"
+        html_folder_path = self.args.output_dir / "risitas-html"
+        if self.args.sharded:
+            html_folder_path = (
+                html_folder_path /
+                get_shard_name(self.risitas_info.topic_id)
+            )
+            html_folder_path.mkdir(exist_ok=True)
+        # The names already taken are looked up in the manifest,
+        # the first free name is reserved by creating the file so that
+        # other processes can't take it.
+        taken_names = set()
+        if not self.args.no_database:
+            taken_names = set(read_manifest_names(html_folder_path))
+        self.html_file_path = reserve_numbered_file(
+            html_folder_path,
+            f"{author_slug}-{title_slug}",
+            ext,
+            taken_names
+        )
 
     def write_html(
             self,
     ) -> None:
-        """Produce an html file from the risitas soup."""
-        self._increment_html_file_name()
-        with open(self.html_file_path, "w", encoding="utf-8") as html_file:
-            write_html_template(html_file, begin=True, end=False)
-            for paragraph in self.risitas_html:
-                html_file.write(str(paragraph[0]).replace("’", "'"))
-            write_html_template(html_file, begin=False, end=True)
-            logging.info("Wrote %s", self.html_file_path)
-
-    def append_html(self) -> None:
-        """Append new chapters to an existing html file."""
-        with open(self.html_file_path, encoding='utf-8') as html_file:
-            soup = BeautifulSoup(html_file, features="lxml")
-        for new_chapter in self.risitas_html:
-            soup.body.insert(len(soup.body.contents), new_chapter[0])
-            logging.debug("Appending %s ...", new_chapter[0])
-        with open(self.html_file_path, "w", encoding='utf-8') as html_file:
-            html_file.write(soup.decode().replace("’", "'"))
+        """
+        Produce an html file from the risitas soup, a download resumed
+        from a checkpoint writes the file chosen before it was interrupted.
+        """
+        if self.resume_file_path:
+            self.html_file_path = self.resume_file_path
+        else:
+            self._increment_html_file_name()
+        if not self.args.no_database:
+            set_checkpoint_file_path(
+                self.risitas_info.topic_id,
+                self.html_file_path
+            )
+        write_html_file(
+            self.html_file_path,
+            (
+                str(paragraph[0]).replace("’", "'")
+                for paragraph in self.risitas_html
+            )
+        )
+        logging.info("Wrote %s", self.html_file_path)
+
+    def append_html(self, state: Optional[Tuple[int, int]] = None) -> None:
+        """
+        Append new chapters to an existing html file,
+        only the new chapters are written.
+        """
+        append_to_html_file(
+            self.html_file_path,
+            (
+                str(new_chapter[0]).replace("’", "'")
+                for new_chapter in self.risitas_html
+            ),
+            state
+        )
         logging.info(
             "The chapters have been appended to %s",
             self.html_file_path
         )
 
 
-def download_risitas(args) -> List['pathlib.Path'] | List:
-    """Download risitas"""
-    page_links = parse_input_links(args.links)
-    risitas_html_file = None
-    for link in page_links:
-        domain = get_domain(link)
-        page_downloader = PageDownloader(domain)
-        posts_downloader = RisitasPostsDownload(page_downloader, args)
+def download_topic(
+        link: str,
+        args,
+        chapter_sink: Optional[Callable[[Chapter], None]] = None,
+        risitas_info: Optional[RisitasInfo] = None,
+        revalidated: Optional[Dict[int, Optional[BeautifulSoup]]] = None,
+) -> Optional['pathlib.Path']:
+    """
+    Download a risitas, return the html file written if any.
+    A sync gives the risitas info and the pages it already revalidated,
+    they are not downloaded again.
+    """
+    domain = get_domain(link)
+    page_downloader = get_page_downloader(domain)
+    posts_downloader = RisitasPostsDownload(
+        page_downloader,
+        args,
+        chapter_sink
+    )
+    posts_downloader.disable_database_webarchive(domain)
+    args = posts_downloader.args
+    if risitas_info:
+        posts_downloader.set_risitas_info(risitas_info)
+    else:
         risitas_info = posts_downloader.get_risitas_info(link, domain)
-        posts_downloader.disable_database_webarchive(domain)
-        total_pages = risitas_info.total_pages
-        row = None
-        if not args.no_database:
-            row = read_db(link)
-            total_pages = get_database_risitas_page(
-                row,
-                risitas_info.total_pages
+    posts_downloader.revalidated = dict(revalidated or {})
+    total_pages = risitas_info.total_pages
+    row = None
+    checkpoint = None
+    if not args.no_database:
+        row = read_db(link, risitas_info.topic_id)
+        if row:
+            rollback_interrupted_append(
+                pathlib.Path(row[3]),
+                (row[4], row[5])
             )
-        risitas_html = posts_downloader.download_posts(
-            link,
-            total_pages,
-            row
+        total_pages = get_database_risitas_page(
+            row,
+            risitas_info.total_pages
         )
-        if not risitas_html and not args.no_database:
-            logging.info("There is no new chapters available!")
-            continue
-        if args.download_images:
-            page_downloader.download_images(
-                risitas_html,
-                args.output_dir,
+        checkpoint = read_checkpoint(risitas_info.topic_id)
+        if checkpoint and row and checkpoint[0] < row[4]:
+            delete_checkpoint(risitas_info.topic_id)
+            checkpoint = None
+        if checkpoint:
+            resume_page = posts_downloader.resume_from_checkpoint(
+                row,
+                checkpoint
             )
-        risitas_html_file = RisitasHtmlFile(
+            total_pages = max(0, risitas_info.total_pages - resume_page + 1)
+    risitas_html = posts_downloader.download_posts(
+        link,
+        total_pages,
+        row
+    )
+    if not risitas_html and not args.no_database:
+        logging.info("There is no new chapters available!")
+        delete_checkpoint(risitas_info.topic_id)
+        return None
+    if args.download_images:
+        page_downloader.download_images(
             risitas_html,
-            risitas_info,
-            args,
-            row
-        )
-        risitas_html_file.append_to_or_write_html_file(
-            posts_downloader.append_to_html,
+            args.output_dir,
         )
-        if not args.no_database:
+    risitas_html_file = RisitasHtmlFile(
+        risitas_html,
+        risitas_info,
+        args,
+        row,
+        posts_downloader.posts.chapters,
+        pathlib.Path(checkpoint[2]) if checkpoint and checkpoint[2] else None
+    )
+    risitas_html_file.append_to_or_write_html_file(
+        posts_downloader.append_to_html,
+        (risitas_info.total_pages, posts_downloader.post_cursor)
+    )
+    if not args.no_database:
+        # The html file is consistent with the database once this commits
+        with database.transaction():
+            risitas_html_file.record_html_file(
+                posts_downloader.append_to_html
+            )
             update_db(
                 risitas_info.title,
                 link,
                 risitas_html_file.html_file_path,
                 risitas_info.total_pages,
                 posts_downloader.post_cursor,
+                risitas_info.topic_id,
+            )
+            delete_checkpoint(risitas_info.topic_id)
+        complete_html_append(risitas_html_file.html_file_path)
+    if args.epub:
+        if args.no_database:
+            chapters = (str(paragraph[0]) for paragraph in risitas_html)
+        else:
+            chapters = (
+                chapter[3] for chapter in read_chapters(risitas_info.topic_id)
+            )
+        create_epub(
+            risitas_html_file.html_file_path,
+            risitas_info.title,
+            risitas_info.author,
+            chapters,
+            args,
+            risitas_info.topic_id,
+        )
+    return risitas_html_file.html_file_path
+
+
+def download_locked(
+        link: str,
+        args,
+        chapter_sink: Optional[Callable[[Chapter], None]] = None,
+        topic_id: Optional[str] = None,
+) -> Optional['pathlib.Path']:
+    """
+    Download or sync a risitas, another process downloading
+    the same risitas is waited for.
+    """
+    download = download_topic
+    if args.sync and not args.no_database:
+        download = sync_topic
+    with file_lock(
+            get_topic_lock_path(
+                args.output_dir,
+                topic_id or get_topic_id(link)
+            )
+    ):
+        return download(link, args, chapter_sink)
+
+
+def download_risitas(args) -> List['pathlib.Path'] | List:
+    """Download risitas"""
+    page_links = parse_input_links(args.links)
+    htmls_file_path: List['pathlib.Path'] = []
+    with open_jsonl_output(args.jsonl) as jsonl_file:
+        chapter_sink = None
+        if jsonl_file:
+            chapter_sink = functools.partial(write_jsonl_record, jsonl_file)
+        for topic_id, link in iter_topic_links(page_links, args.shard):
+            html_file_path = download_locked(
+                link,
+                args,
+                chapter_sink,
+                topic_id
+            )
+            if html_file_path:
+                htmls_file_path.append(html_file_path)
+    return htmls_file_path
+
+
+def enqueue_risitas(args) -> int:
+    """Add the links given on the command line to the job queue"""
+    count = enqueue_jobs(
+        iter_topic_links(parse_input_links(args.links), args.shard),
+        args.priority
+    )
+    logging.info("%s links have been added to the queue", count)
+    return count
+
+
+@contextlib.contextmanager
+def renewing_lease(
+        topic_id: str,
+        worker: str,
+        lease_timeout: float,
+) -> Iterator[None]:
+    """
+    Renew the lease of a job in a thread while it is downloaded, a long
+    download isn't taken by another worker when its first lease expires.
+    """
+    stopped = threading.Event()
+
+    def renew() -> None:
+        try:
+            while not stopped.wait(lease_timeout / 3):
+                try:
+                    if not renew_lease(topic_id, worker, lease_timeout):
+                        logging.warning(
+                            "The lease of %s was taken by another worker",
+                            topic_id
+                        )
+                        return
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception(
+                        "Couldn't renew the lease of %s", topic_id
+                    )
+        finally:
+            database.close_db()
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def process_jobs(args) -> List['pathlib.Path'] | List:
+    """
+    Download the risitas of the job queue until it is empty,
+    a failed download is recorded and the next job is taken.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    htmls_file_path: List['pathlib.Path'] = []
+    jobs_done = 0
+    with open_jsonl_output(args.jsonl) as jsonl_file:
+        chapter_sink = None
+        if jsonl_file:
+            chapter_sink = functools.partial(write_jsonl_record, jsonl_file)
+        while job := lease_job(
+                worker,
+                args.lease_timeout,
+                args.max_attempts
+        ):
+            topic_id, link, attempts = job
+            logging.info("Downloading %s, attempt %s", link, attempts)
+            start = time.monotonic()
+            try:
+                with renewing_lease(topic_id, worker, args.lease_timeout):
+                    html_file_path = download_locked(
+                        link,
+                        args,
+                        chapter_sink,
+                        topic_id
+                    )
+            except KeyboardInterrupt:
+                release_job(topic_id, worker)
+                raise
+            except Exception as error:  # pylint: disable=broad-except
+                logging.exception("Couldn't download %s", link)
+                finish_job(topic_id, worker, repr(error))
+                continue
+            finish_job(topic_id, worker)
+            logging.debug(
+                "%s downloaded in %.1fs", link, time.monotonic() - start
+            )
+            if html_file_path:
+                htmls_file_path.append(html_file_path)
+            jobs_done += 1
+    if jobs_done:
+        logging.info("The queue is empty, %d jobs were done", jobs_done)
+    return htmls_file_path
+
+
+def merge_nodes(args) -> None:
+    """
+    Merge the output dirs and databases of other nodes into
+    the output dir and the database.
+    """
+    for node_dir in args.merge:
+        node_db_path = node_dir / "risiparse.db"
+        if not node_db_path.exists():
+            logging.error("There is no database in %s", node_dir)
+            continue
+        taken = merge_db(node_db_path, args.output_dir)
+        copied = copy_node_files(node_dir, args.output_dir, taken)
+        with database.transaction():
+            for file_path, topic_id in copied:
+                kind = file_path.relative_to(args.output_dir).parts[0]
+                record_output(
+                    args.output_dir,
+                    file_path,
+                    kind.replace("risitas-", ""),
+                    topic_id
+                )
+
+
+def serve(args) -> None:
+    """
+    Serve the http api and process the jobs submitted with it until
+    interrupted, the http sessions, the database connection and
+    the QApplication are kept from one job to the next.
+    """
+    # Imported here, the server is only needed by --serve
+    from risiparse.server import (  # pylint: disable=import-outside-toplevel
+        RisiparseServer
+    )
+    # The pdfs are created by the QApplication of this process
+    args.pdf_processes = 1
+    server = RisiparseServer(
+        ("127.0.0.1", args.port),
+        args.output_dir,
+        args.shard
+    )
+    server.start()
+    try:
+        while True:
+            server.submitted.wait(timeout=SERVE_POLL_INTERVAL)
+            server.submitted.clear()
+            # The server keeps running when the queue or the pdfs fail,
+            # the jobs left are processed at the next poll
+            try:
+                htmls_file_path = process_jobs(args)
+                if htmls_file_path and not args.no_pdf:
+                    convert_htmls(args, htmls_file_path)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Couldn't process the jobs")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def discover_risitas(args) -> int:
+    """Enqueue the new risitas found in the forum listings"""
+    # Imported here, the crawler is only needed by --discover
+    from risiparse.discover import (  # pylint: disable=import-outside-toplevel
+        discover_topics
+    )
+    count = 0
+    for site in (Jvc, Jvarchive):
+        topics = discover_topics(
+            site,
+            args.discover_pages,
+            args.discover_workers,
+        )
+        for topic in topics:
+            logging.info(
+                "New risitas : %s, %d pages", topic.title, topic.total_pages
+            )
+        count += enqueue_jobs(
+            (
+                (topic.topic_id, topic.link) for topic in topics
+                if not args.shard or is_in_shard(topic.topic_id, args.shard)
+            ),
+            args.priority,
+            {topic.topic_id: topic.total_pages for topic in topics}
+        )
+    logging.info("%d new risitas have been added to the queue", count)
+    return count
+
+
+def print_queue_status() -> None:
+    """Print the number of jobs by state and the last failures"""
+    for state, count, total, average, attempts in read_jobs_status():
+        line = f"{state}: {count} jobs"
+        if total is not None:
+            line += f", {total:.1f}s in total, {average:.1f}s on average"
+        print(f"{line}, at most {attempts} attempts")
+    for link, attempts, error in read_failed_jobs():
+        print(f"failed after {attempts} attempts : {link}")
+        print(f"    {error}")
+
+
+def use_local_images(
+        chapter_html: str,
+        img_folder_path: pathlib.Path
+) -> str:
+    """
+    Point the images of a stored chapter to the local images
+    when they have already been downloaded.
+    """
+    if "<img" not in chapter_html or not img_folder_path.exists():
+        return chapter_html
+    soup = BeautifulSoup(chapter_html, features="html.parser")
+    for img in soup.select("img"):
+        link = img.attrs.get("src", "")
+        if contains_webarchive(link):
+            link = strip_webarchive_link(link)
+        file_name = link[link.rfind("/"):][1:]
+        if file_name and image_exists(file_name, img_folder_path):
+            change_img_src_path(img, img_folder_path, file_name)
+    return str(soup)
+
+
+def create_epub(
+        html_file_path: pathlib.Path,
+        title: str,
+        author: str,
+        chapters: Iterable[str],
+        args,
+        topic_id: Optional[str] = None,
+) -> pathlib.Path:
+    """
+    Create an epub next to the risitas-html folder, named after
+    the html file of the risitas.
+    """
+    html_folder_path = args.output_dir / "risitas-html"
+    try:
+        shard = html_file_path.parent.relative_to(html_folder_path)
+    except ValueError:
+        shard = pathlib.Path()
+    epub_folder_path = args.output_dir / "risitas-epub" / shard
+    epub_folder_path.mkdir(parents=True, exist_ok=True)
+    epub_file_path = epub_folder_path / (
+        strip_compressed_suffix(html_file_path).with_suffix(".epub").name
+    )
+    EpubFile(epub_file_path, html_folder_path / "images").write(
+        title,
+        author,
+        chapters,
+    )
+    if not args.no_database:
+        record_output(args.output_dir, epub_file_path, "epub", topic_id)
+    return epub_file_path
+
+
+def get_stored_chapter(topic_id: str, title: str, chapter) -> Chapter:
+    """Make a chapter from a chapter row of the database"""
+    risitas_html = BeautifulSoup(chapter[3], features="html.parser")
+    return Chapter(
+        topic_id=topic_id,
+        title=title,
+        author=chapter[2],
+        page=chapter[0],
+        post_cursor=chapter[1],
+        html=chapter[3],
+        text=risitas_html.text,
+        contains_image=bool(chapter[5]),
+        image_urls=get_image_urls(risitas_html),
+    )
+
+
+def rebuild_html(args, row) -> Optional['pathlib.Path']:
+    """
+    Rewrite the html file of a risitas of the database from its
+    stored chapters, return the html file if it was rewritten.
+    """
+    html_folder_path = args.output_dir / "risitas-html"
+    img_folder_path = html_folder_path / "images"
+    html_file_path = pathlib.Path(row[3])
+    if html_folder_path not in html_file_path.parents:
+        return None
+    topic_id = row[6] or get_topic_id(row[2])
+    chapters = read_chapters(topic_id)
+    first_chapter = next(chapters, None)
+    if first_chapter is None:
+        logging.warning(
+            "No chapters stored for %s, not rebuilding it", html_file_path
+        )
+        return None
+    write_html_file(
+        html_file_path,
+        (
+            use_local_images(chapter[3], img_folder_path).replace(
+                "’", "'"
+            )
+            for chapter in itertools.chain([first_chapter], chapters)
+        )
+    )
+    logging.info("Rebuilt %s from the database", html_file_path)
+    record_output(args.output_dir, html_file_path, "html", topic_id)
+    index_chapters(
+        html_file_path,
+        (
+            get_stored_chapter(topic_id, row[1], chapter)
+            for chapter in read_chapters(topic_id)
+        ),
+        replace=True
+    )
+    if args.epub:
+        create_epub(
+            html_file_path,
+            row[1],
+            first_chapter[2],
+            (chapter[3] for chapter in read_chapters(topic_id)),
+            args,
+            topic_id,
+        )
+    return html_file_path
+
+
+def rebuild_htmls(args) -> List['pathlib.Path']:
+    """
+    Rewrite the html files of the risitas in the database
+    from the stored chapters, nothing is downloaded.
+    """
+    htmls_file_path: List['pathlib.Path'] = []
+    for row in read_all_risitas():
+        html_file_path = rebuild_html(args, row)
+        if html_file_path:
+            htmls_file_path.append(html_file_path)
+    return htmls_file_path
+
+
+def sync_topic(
+        link: str,
+        args,
+        chapter_sink: Optional[Callable[[Chapter], None]] = None,
+) -> Optional['pathlib.Path']:
+    """
+    Revalidate the pages of a risitas already downloaded, the chapters
+    of the pages that changed are replaced, the new chapters are
+    appended to the html file and it is rebuilt if chapters changed.
+    Return the html file written if any.
+    """
+    row = read_db(link)
+    if not row:
+        return download_topic(link, args, chapter_sink)
+    domain = get_domain(link)
+    # The chapters revalidated are not new, they don't go to the sink
+    posts_downloader = RisitasPostsDownload(get_page_downloader(domain), args)
+    risitas_info = posts_downloader.get_risitas_info(link, domain)
+    changed_pages, revalidated = posts_downloader.sync_pages(
+        link,
+        row[4],
+        row[5]
+    )
+    html_file_path = download_topic(
+        link,
+        args,
+        chapter_sink,
+        risitas_info,
+        revalidated
+    )
+    if changed_pages:
+        logging.info(
+            "Rebuilding %s, pages %s have changed",
+            row[3], changed_pages
+        )
+        html_file_path = rebuild_html(
+            args,
+            read_db(link, row[6])
+        ) or html_file_path
+    return html_file_path
+
+
+def probe_topic(
+        page_downloader: PageDownloader,
+        link: str,
+        row,
+) -> bool:
+    """
+    Download the last page known of a risitas with conditional requests,
+    tell if it has new pages or if the posts of its last page changed.
+    """
+    topic_id = row[6] or get_topic_id(link)
+    last_page = row[4]
+    page_state = read_page(topic_id, last_page)
+    soup = page_downloader.download_topic_page(
+        link,
+        last_page,
+        page_state[1:3] if page_state else None
+    )
+    if page_downloader.not_modified:
+        return False
+    if not soup:
+        logging.error("Couldn't check %s, it is checked later", link)
+        return False
+    selectors = get_selectors_and_site(link)
+    try:
+        total_pages = get_total_pages(
+            soup,
+            selectors,
+            page_downloader.domain
+        )
+    except (TypeError, ValueError):
+        return True
+    if total_pages > last_page:
+        logging.info("%s has %d new pages", link, total_pages - last_page)
+        return True
+    content_hash = get_page_content_hash(
+        soup.select(selectors.POST_SELECTOR.value),
+        selectors.RISITAS_TEXT_SELECTOR.value
+    )
+    return not page_state or content_hash != page_state[0]
+
+
+class WatchScheduler():
+    """
+    Check the watched risitas when they are due, the interval between
+    two checks is halved when a risitas changed and grows when it didn't,
+    between the min and max intervals.
+    """
+
+    GROWTH = 1.5
+
+    def __init__(self, args, chapter_sink=None):
+        self.args = args
+        self.chapter_sink = chapter_sink
+        self.min_interval = args.watch_min_interval
+        self.max_interval = max(args.watch_max_interval, self.min_interval)
+        # (next check, topic id, link, interval, changed at)
+        self.heap: List[Tuple[float, str, str, float, Optional[float]]] = []
+
+    def add(self, topic_id: str, link: str) -> None:
+        """Watch a risitas, from its schedule in the database if any"""
+        interval, next_check, changed_at = read_watch(topic_id) or (
+            self.min_interval, time.time(), None
+        )
+        heapq.heappush(
+            self.heap,
+            (next_check, topic_id, link, interval, changed_at)
+        )
+
+    def get_next_interval(self, interval: float, changed: bool) -> float:
+        """Get the interval until the next check of a risitas"""
+        if changed:
+            interval /= 2
+        else:
+            interval *= self.GROWTH
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def check(
+            self,
+            topic_id: str,
+            link: str,
+    ) -> Tuple[bool, Optional['pathlib.Path']]:
+        """
+        Check a risitas and download it if it changed,
+        return if it changed and the html file written.
+        """
+        row = read_db(link, topic_id)
+        if row:
+            page_downloader = get_page_downloader(get_domain(link))
+            if not probe_topic(page_downloader, link, row):
+                logging.debug("Nothing new for %s", link)
+                return False, None
+        return True, download_locked(
+            link,
+            self.args,
+            self.chapter_sink,
+            topic_id
+        )
+
+    def run_due(self, now: float) -> List['pathlib.Path']:
+        """Check the risitas due before now, return the html files written"""
+        htmls_file_path: List['pathlib.Path'] = []
+        # A risitas is checked at most once, even with a tiny interval
+        checked = []
+        while self.heap and self.heap[0][0] <= now:
+            _, topic_id, link, interval, changed_at = heapq.heappop(self.heap)
+            try:
+                changed, html_file_path = self.check(topic_id, link)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Couldn't check %s", link)
+                changed, html_file_path = False, None
+            checked_at = time.time()
+            if changed:
+                changed_at = checked_at
+            interval = self.get_next_interval(interval, changed)
+            update_watch(
+                topic_id,
+                link,
+                interval,
+                checked_at + interval,
+                changed_at
+            )
+            checked.append(
+                (checked_at + interval, topic_id, link, interval, changed_at)
+            )
+            if html_file_path:
+                htmls_file_path.append(html_file_path)
+        for item in checked:
+            heapq.heappush(self.heap, item)
+        return htmls_file_path
+
+    def watch(
+            self,
+            on_htmls: Callable[[List['pathlib.Path']], None],
+    ) -> None:
+        """Check the risitas when they are due until interrupted"""
+        while self.heap:
+            htmls_file_path = self.run_due(time.time())
+            if htmls_file_path:
+                on_htmls(htmls_file_path)
+            next_check = self.heap[0][0]
+            logging.info(
+                "Next check at %s", time.strftime(
+                    "%H:%M:%S",
+                    time.localtime(next_check)
+                )
             )
-    if risitas_html_file:
-        return risitas_html_file.htmls_file_path
-    return []
+            time.sleep(max(0.0, next_check - time.time()))
+
+
+def watch_risitas(
+        args,
+        on_htmls: Callable[[List['pathlib.Path']], None],
+) -> None:
+    """Keep the risitas of the links up to date until interrupted"""
+    with open_jsonl_output(args.jsonl) as jsonl_file:
+        chapter_sink = None
+        if jsonl_file:
+            chapter_sink = functools.partial(write_jsonl_record, jsonl_file)
+        scheduler = WatchScheduler(args, chapter_sink)
+        for topic_id, link in iter_topic_links(
+                parse_input_links(args.links),
+                args.shard
+        ):
+            # The Wayback Machine archives never change
+            if contains_webarchive(link):
+                continue
+            scheduler.add(topic_id, link)
+        logging.info("Watching %d risitas", len(scheduler.heap))
+        scheduler.watch(on_htmls)
+
+
+def convert_htmls(args, htmls_file_path: List['pathlib.Path']) -> None:
+    """Create the pdfs of html files and record them"""
+    pdfs_file_path = create_pdfs(
+        args.output_dir,
+        htmls_file_path,
+        args,
+        functools.partial(prefetch_pdf_images, args)
+        if args.cache_images else None
+    )
+    if not args.no_database:
+        # A pdf belongs to the topic of its html file
+        topic_ids = {
+            get_pdf_path(args.output_dir, html): read_output_topic_id(html)
+            for html in htmls_file_path
+        }
+        with database.transaction():
+            for pdf_file_path in pdfs_file_path:
+                if pdf_file_path.exists():
+                    record_output(
+                        args.output_dir,
+                        pdf_file_path,
+                        "pdf",
+                        topic_ids.get(pdf_file_path)
+                    )
+
+
+def set_stdout_logging() -> None:
+    """
+    Log to the terminal, this is only done by the command line
+    so that importing risiparse leaves the logging configuration alone.
+    """
+    LOGGER.setLevel(logging.DEBUG)
+    if STDOUT_HANDLER not in LOGGER.handlers:
+        LOGGER.addHandler(STDOUT_HANDLER)
+
+
+def print_search_results(query: str) -> None:
+    """Print the chapters matching the query, best matches first"""
+    results = search_chapters(
+        query,
+        highlight=(colorama.Fore.RED, colorama.Style.RESET_ALL)
+    )
+    if not results:
+        logging.info("No chapter matches '%s'", query)
+    for title, author, page, file_path, snippet in results:
+        print(f"{title} ({author}), page {page} : {file_path}")
+        print(f"    {snippet}")
+
+
+def prefetch_pdf_images(
+        args,
+        htmls_file_path: List[pathlib.Path]
+) -> None:
+    """Fill the image cache with the images of the htmls to render"""
+    links = {
+        link for html in htmls_file_path
+        for link in get_html_image_urls(html)
+    }
+    img_folder_path = args.output_dir / "risitas-html" / "images"
+    downloaded = PageDownloader(Noelshack.SITE.value).prefetch_images(
+        links,
+        img_folder_path
+    )
+    if downloaded:
+        logging.info("Added %s images to %s", downloaded, img_folder_path)
 
 
 def main() -> None:
     """Entry point of risiparse"""
+    set_stdout_logging()
     args = get_args()
     htmls_file_path: List['pathlib.Path'] = []
+    if args.database:
+        database.DB_PATH = args.database
     set_file_logging(args.output_dir, LOGGER, FMT)
+    logging.debug("The database is at : '%s'", database.DB_PATH)
     if args.clear_database:
         delete_db()
         sys.exit()
+    if args.search:
+        print_search_results(args.search)
+        sys.exit()
+    if args.queue_status:
+        print_queue_status()
+        sys.exit()
+    if args.queue_retry:
+        logging.info("%s failed jobs have been queued again", retry_jobs())
+        sys.exit()
+    if args.enqueue:
+        enqueue_risitas(args)
+        sys.exit()
+    if args.discover:
+        discover_risitas(args)
+        sys.exit()
+    if args.merge:
+        make_app_dirs(args.output_dir)
+        merge_nodes(args)
+        sys.exit()
     make_app_dirs(args.output_dir)
     if args.debug:
         STDOUT_HANDLER.setLevel(logging.DEBUG)
-    if not args.no_download:
+    if args.serve:
+        serve(args)
+        sys.exit()
+    if args.watch:
+        watch_risitas(
+            args,
+            (lambda htmls: None) if args.no_pdf
+            else functools.partial(convert_htmls, args)
+        )
+        sys.exit()
+    if args.rebuild_html:
+        htmls_file_path = rebuild_htmls(args)
+    elif args.worker:
+        htmls_file_path = process_jobs(args)
+    elif not args.no_download:
         htmls_file_path = download_risitas(args)
     if args.create_pdfs:
         htmls_file_path = htmls_file_path + args.create_pdfs
     if not args.no_pdf:
-        create_pdfs(args.output_dir, htmls_file_path)
+        convert_htmls(args, htmls_file_path)
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+"""
+This module serves a small http api on localhost to submit links to the
+job queue, follow the jobs and fetch the files written for them.
+The jobs are processed by the process that started the server.
+"""
+
+from typing import Optional, Tuple
+import http.server
+import json
+import logging
+import pathlib
+import shutil
+import sqlite3
+import threading
+from urllib.parse import unquote, urlparse
+
+from risiparse.utils.database import (
+    enqueue_jobs,
+    read_job,
+    read_jobs_status,
+)
+from risiparse.utils.utils import iter_topic_links, read_topic_files
+
+JOB_COLUMNS = (
+    "topic_id",
+    "link",
+    "priority",
+    "state",
+    "attempts",
+    "enqueued_at",
+    "started_at",
+    "finished_at",
+    "duration",
+    "error",
+    "total_pages",
+)
+
+
+class RisiparseRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    POST /jobs                {"links": [...], "priority": 0}
+    GET  /jobs                number of jobs by state
+    GET  /jobs/<topic_id>     a job with the files written for its topic
+    GET  /files/<path>        a file of the output dir
+    """
+
+    server: 'RisiparseServer'
+
+    # pylint: disable=redefined-builtin
+    def log_message(self, format, *args) -> None:
+        logging.debug("%s %s", self.address_string(), format % args)
+
+    def send_json(self, status: int, body) -> None:
+        """Send a json response"""
+        content = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_file(self, file_path: pathlib.Path) -> None:
+        """Send a file of the output dir"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(file_path.stat().st_size))
+        self.end_headers()
+        with open(file_path, "rb") as file:
+            shutil.copyfileobj(file, self.wfile)
+
+    def get_route(self) -> Tuple[str, str]:
+        """Split the path of the request into its first part and the rest"""
+        path = unquote(urlparse(self.path).path).strip("/")
+        route, _, rest = path.partition("/")
+        return route, rest
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """Add links to the job queue"""
+        route, rest = self.get_route()
+        if route != "jobs" or rest:
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            links = body["links"]
+            priority = int(body.get("priority", 0))
+            if isinstance(links, str):
+                links = [links]
+            if not isinstance(links, list) or not all(
+                    isinstance(link, str) for link in links
+            ):
+                raise TypeError("links must be a link or a list of links")
+            topic_links = list(iter_topic_links(links, self.server.shard))
+        except (KeyError, TypeError, ValueError) as error:
+            self.send_json(400, {"error": f"bad request : {error!r}"})
+            return
+        try:
+            enqueue_jobs(topic_links, priority)
+        except sqlite3.OperationalError as error:
+            logging.exception("Couldn't enqueue %s", links)
+            self.send_json(503, {"error": f"database error : {error!r}"})
+            return
+        self.server.submitted.set()
+        self.send_json(202, {
+            "jobs": [
+                {"topic_id": topic_id, "link": link}
+                for topic_id, link in topic_links
+            ]
+        })
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Get the state of the jobs or a file"""
+        route, rest = self.get_route()
+        if route == "jobs" and not rest:
+            self.send_json(200, {
+                state: count for state, count, *_ in read_jobs_status()
+            })
+        elif route == "jobs":
+            job = read_job(rest)
+            if not job:
+                self.send_json(404, {"error": f"no job for {rest}"})
+                return
+            body = dict(zip(JOB_COLUMNS, job))
+            body["files"] = [
+                {
+                    "kind": kind,
+                    "path": self.server.get_file_url(file_path),
+                    "size": size,
+                    "sha256": sha256,
+                }
+                for file_path, kind, size, sha256 in read_topic_files(rest)
+            ]
+            self.send_json(200, body)
+        elif route == "files":
+            file_path = self.server.get_output_file(rest)
+            if not file_path:
+                self.send_json(404, {"error": f"no file {rest}"})
+                return
+            self.send_file(file_path)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+
+class RisiparseServer(http.server.HTTPServer):
+    """
+    Serve the api from a single thread, so the requests share
+    the database connection of that thread.
+    """
+
+    def __init__(
+            self,
+            address: Tuple[str, int],
+            output_dir: pathlib.Path,
+            shard: Optional[Tuple[int, int]] = None,
+    ):
+        super().__init__(address, RisiparseRequestHandler)
+        self.output_dir = output_dir
+        self.shard = shard
+        # Set when jobs are submitted, to wake up the process of the jobs
+        self.submitted = threading.Event()
+
+    def get_file_url(self, file_path: pathlib.Path) -> Optional[str]:
+        """Get the url of an output file, if it is in the output dir"""
+        try:
+            relative_path = file_path.relative_to(self.output_dir)
+        except ValueError:
+            return None
+        return f"/files/{relative_path.as_posix()}"
+
+    def get_output_file(self, path: str) -> Optional[pathlib.Path]:
+        """Get a file of the output dir, nothing out of it is served"""
+        file_path = (self.output_dir / path).resolve()
+        if (
+                self.output_dir.resolve() not in file_path.parents or
+                not file_path.is_file()
+        ):
+            return None
+        return file_path
+
+    def start(self) -> threading.Thread:
+        """Serve the requests in a background thread"""
+        thread = threading.Thread(
+            target=self.serve_forever,
+            name="risiparse-server",
+            daemon=True
+        )
+        thread.start()
+        logging.info(
+            "Serving on http://%s:%d", *self.server_address[:2]
+        )
+        return thread
@@ -19,6 +19,15 @@ class Jvc(Enum):
     TITLE_SELECTOR = "#bloc-title-forum"
     NOELSHACK_IMG_SELECTOR = "img.img-shack"
     PAGE_TITLE_SELECTOR = "title"
+    # Listing of the topics of the 18-25 forum, {offset} is the rank
+    # of the first topic of the page, there are 25 topics per page
+    LISTING_LINK = (
+        "https://www.jeuxvideo.com/forums/0-51-0-1-0-{offset}-0-"
+        "blabla-18-25-ans.htm"
+    )
+    LISTING_TOPIC_SELECTOR = ".topic-list > li"
+    LISTING_TITLE_SELECTOR = "a.topic-title"
+    LISTING_COUNT_SELECTOR = ".topic-count"
 
 
 class Jvarchive(Enum):
@@ -34,6 +43,13 @@ class Jvarchive(Enum):
     TITLE_SELECTOR = "[class='h2 text-white d-inline align-middle mb-0 mr-2']"
     NOELSHACK_IMG_SELECTOR = "img"
     PAGE_TITLE_SELECTOR = "title"
+    LISTING_LINK = (
+        "https://jvarchive.com/forums/0-51-0-1-0-{offset}-0-"
+        "blabla-18-25-ans"
+    )
+    LISTING_TOPIC_SELECTOR = "tbody > tr"
+    LISTING_TITLE_SELECTOR = "a[href*='/forums/42-51-']"
+    LISTING_COUNT_SELECTOR = "td:nth-of-type(3)"
 
 
 class Webarchive(Enum):
@@ -2,23 +2,30 @@
 
 """This module contains all the database logic"""
 
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import contextlib
+import json
 import sqlite3
 import re
 import pathlib
 import logging
 import sys
+import threading
+import time
+
+from risiparse.utils.utils_files import reserve_numbered_file
+from risiparse.utils.utils_links import get_topic_id
+from risiparse.utils.utils_posts import Chapter, get_text_hash
 
 HOME = pathlib.Path.home()
 
 
+# The directory of the database is created when it is first opened
 if sys.platform == "win32":
-    (HOME / "AppData/Roaming" / 'risiparse').mkdir(exist_ok=True)
     DB_PATH = HOME / "AppData/Roaming" / 'risiparse' / 'risiparse.db'
 elif sys.platform == "linux":
-    (HOME / ".local/share" / 'risiparse').mkdir(exist_ok=True)
     DB_PATH = HOME / ".local/share" / 'risiparse' / 'risiparse.db'
 elif sys.platform == "darwin":
-    (HOME / "Library/Application Support" / 'risiparse').mkdir(exist_ok=True)
     DB_PATH = (
         HOME /
         "Library/Application Support" /
@@ -26,7 +33,15 @@ elif sys.platform == "darwin":
         'risiparse.db'
     )
 
-logging.debug("The database is at : '%s'", DB_PATH)
+
+# Version of the schema, stored in the user_version pragma
+SCHEMA_VERSION = 4
+
+# One connection per thread, opened on first use
+_LOCAL = threading.local()
+
+# Folders of an output dir whose files are tracked in the database
+OUTPUT_FOLDERS = ("risitas-html", "risitas-pdf", "risitas-epub")
 
 
 def _replace_page_number(page_link: str) -> str:
@@ -45,9 +60,8 @@ def _replace_page_number(page_link: str) -> str:
     return page_link
 
 
-def create_db() -> None:
-    """Create the database"""
-    con = sqlite3.connect(DB_PATH)
+def create_db(con: sqlite3.Connection) -> None:
+    """Create the tables missing from the database"""
     try:
         con.execute(
             '''create table if not exists risitas
@@ -58,25 +72,294 @@ def create_db() -> None:
             total_pages integer,
             post_cursor integer)'''
         )
+        con.execute(
+            '''create table if not exists chapters
+            (id integer primary key autoincrement,
+            topic_id varchar,
+            page integer,
+            post_cursor integer,
+            author varchar,
+            html text,
+            text_hash varchar,
+            contains_image integer,
+            unique (topic_id, page, post_cursor))'''
+        )
+        con.execute(
+            '''create table if not exists outputs
+            (id integer primary key autoincrement,
+            output_dir varchar,
+            directory varchar,
+            name varchar,
+            topic_id varchar,
+            kind varchar,
+            size integer,
+            sha256 varchar,
+            updated_at real,
+            mtime real,
+            unique (directory, name))'''
+        )
+        con.execute(
+            '''create index if not exists outputs_output_dir_kind
+            on outputs (output_dir, kind)'''
+        )
+        con.execute(
+            '''create table if not exists pages
+            (topic_id varchar,
+            page integer,
+            content_hash varchar,
+            etag varchar,
+            last_modified varchar,
+            post_count integer,
+            chapter_hashes varchar,
+            checked_at real,
+            primary key (topic_id, page))'''
+        )
+        con.execute(
+            '''create table if not exists checkpoints
+            (topic_id varchar primary key,
+            page integer,
+            post_cursor integer,
+            file_path varchar,
+            updated_at real)'''
+        )
+        con.execute(
+            '''create table if not exists pdf_renders
+            (html_path varchar primary key,
+            pdf_path varchar,
+            html_size integer,
+            html_mtime real,
+            html_sha256 varchar,
+            settings varchar,
+            pdf_size integer,
+            rendered_at real)'''
+        )
+        con.execute(
+            '''create table if not exists jobs
+            (topic_id varchar primary key,
+            link varchar,
+            priority integer,
+            state varchar,
+            attempts integer,
+            worker varchar,
+            leased_until real,
+            enqueued_at real,
+            started_at real,
+            finished_at real,
+            duration real,
+            error varchar,
+            total_pages integer)'''
+        )
+        con.execute(
+            '''create index if not exists jobs_state_priority
+            on jobs (state, priority desc, enqueued_at)'''
+        )
+        con.execute(
+            '''create table if not exists discovered
+            (topic_id varchar primary key,
+            link varchar,
+            title varchar,
+            risitas integer,
+            replies integer,
+            total_pages integer,
+            first_seen real,
+            last_seen real)'''
+        )
+        con.execute(
+            '''create table if not exists watch
+            (topic_id varchar primary key,
+            link varchar,
+            interval real,
+            next_check real,
+            changed_at real,
+            checked_at real)'''
+        )
     except sqlite3.OperationalError as operational_error:
         logging.exception(operational_error)
-    con.close()
+    try:
+        con.execute(
+            '''create virtual table if not exists chapters_fts using fts5
+            (text,
+            title,
+            author,
+            topic_id unindexed,
+            page unindexed,
+            file_path unindexed,
+            tokenize = 'unicode61 remove_diacritics 2')'''
+        )
+        # The unindexed columns of the index can't be searched without
+        # reading all of it, its rows are found by rowid from this table
+        con.execute(
+            '''create table if not exists chapters_fts_rows
+            (rowid integer primary key,
+            file_path varchar,
+            topic_id varchar)'''
+        )
+        con.execute(
+            '''create index if not exists chapters_fts_rows_file_path
+            on chapters_fts_rows (file_path)'''
+        )
+        con.execute(
+            '''create index if not exists chapters_fts_rows_topic_id
+            on chapters_fts_rows (topic_id)'''
+        )
+    except sqlite3.OperationalError as operational_error:
+        logging.debug(
+            "Full text search is not available %s", operational_error
+        )
 
 
-def read_db(page_link: str):
+def _migrate_db(con: sqlite3.Connection) -> None:
+    """Upgrade the schema of an existing database to SCHEMA_VERSION"""
+    version = con.execute("pragma user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    with con:
+        if version < 1:
+            columns = [
+                column[1] for column in
+                con.execute("pragma table_info(risitas)")
+            ]
+            if "topic_id" not in columns:
+                con.execute(
+                    '''alter table risitas add column topic_id varchar'''
+                )
+            rows = con.execute(
+                '''select id, page_link from risitas
+                where topic_id is null'''
+            ).fetchall()
+            for row_id, page_link in rows:
+                try:
+                    topic_id = get_topic_id(page_link)
+                except IndexError:
+                    logging.warning("Can't find the topic id of %s", page_link)
+                    continue
+                con.execute(
+                    '''update risitas set topic_id = ? where id = ?''',
+                    (topic_id, row_id)
+                )
+            con.execute(
+                '''create index if not exists risitas_topic_id
+                on risitas (topic_id)'''
+            )
+        if version < 2:
+            columns = [
+                column[1] for column in
+                con.execute("pragma table_info(outputs)")
+            ]
+            if "mtime" not in columns:
+                con.execute('''alter table outputs add column mtime real''')
+        if version < 3:
+            columns = [
+                column[1] for column in
+                con.execute("pragma table_info(jobs)")
+            ]
+            if "total_pages" not in columns:
+                con.execute(
+                    '''alter table jobs add column total_pages integer'''
+                )
+        if version < 4:
+            try:
+                con.execute(
+                    '''insert or ignore into chapters_fts_rows
+                    (rowid, file_path, topic_id)
+                    select rowid, file_path, topic_id from chapters_fts'''
+                )
+            except sqlite3.OperationalError as operational_error:
+                logging.debug(
+                    "Full text search is not available %s", operational_error
+                )
+        con.execute(f"pragma user_version = {SCHEMA_VERSION}")
+    logging.debug(
+        "Migrated the database from version %d to %d",
+        version,
+        SCHEMA_VERSION
+    )
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Get the connection of the current thread to the database,
+    it is opened, created and migrated on first use.
+    """
+    con = getattr(_LOCAL, "con", None)
+    if con is not None and _LOCAL.path == DB_PATH:
+        return con
+    close_db()
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(DB_PATH, timeout=30)
+    con.execute("pragma journal_mode = wal")
+    con.execute("pragma synchronous = normal")
+    con.execute("pragma busy_timeout = 30000")
+    create_db(con)
+    _migrate_db(con)
+    _LOCAL.con = con
+    _LOCAL.path = DB_PATH
+    _LOCAL.depth = 0
+    return con
+
+
+def close_db() -> None:
+    """Close the connection of the current thread if it is open"""
+    con = getattr(_LOCAL, "con", None)
+    if con is not None:
+        con.close()
+    _LOCAL.con = None
+
+
+@contextlib.contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """
+    Group writes in one transaction committed at the end of the block,
+    or rolled back on error, nested blocks are part of the outermost one.
+    Other processes wait for the transaction to end, up to the busy timeout.
+    """
+    con = get_connection()
+    if _LOCAL.depth:
+        _LOCAL.depth += 1
+        try:
+            yield con
+        finally:
+            _LOCAL.depth -= 1
+        return
+    _LOCAL.depth = 1
+    try:
+        with con:
+            # Take the write lock now, a select followed by a write
+            # can't be interleaved with the writes of another process
+            if not con.in_transaction:
+                con.execute("begin immediate")
+            yield con
+    finally:
+        _LOCAL.depth = 0
+
+
+def _find_risitas(
+        con: sqlite3.Connection,
+        page_link: str,
+        topic_id: Optional[str] = None,
+) -> Optional[Tuple]:
+    """
+    Find a risitas by its topic id, the page link tells apart
+    the same topic downloaded from different sites.
+    """
+    if topic_id is None:
+        topic_id = get_topic_id(page_link)
+    return con.execute(
+        '''select * from risitas
+        where (topic_id = ? or topic_id is null) and page_link like ?
+        order by id limit 1''',
+        (topic_id, _replace_page_number(page_link))
+    ).fetchone()
+
+
+def read_db(page_link: str, topic_id: Optional[str] = None):
     """Fetch records from the database"""
-    create_db()
-    con = sqlite3.connect(DB_PATH)
-    page_link_normalized = _replace_page_number(page_link)
+    con = get_connection()
+    row = None
     try:
-        cursor = con.execute(
-            '''select * from risitas where page_link LIKE ? limit 1''',
-            (page_link_normalized, )
-        )
-        row = cursor.fetchone()
+        row = _find_risitas(con, page_link, topic_id)
     except sqlite3.OperationalError as operational_error:
         logging.exception(operational_error)
-    con.close()
     return row
 
 
@@ -86,25 +369,24 @@ def update_db(
         file_path: 'pathlib.Path',
         total_pages: int,
         post_cursor: int,
+        topic_id: Optional[str] = None,
 ) -> None:
     """Updates records in the database"""
-    create_db()
-    con = sqlite3.connect(DB_PATH)
-    page_link_normalized = _replace_page_number(page_link)
-    cursor_existing_row = con.execute(
-        '''select id from risitas where page_link like ? limit 1''',
-        (page_link_normalized, )
-    ).fetchone()
-    if cursor_existing_row:
-        try:
-            with con:
-                cursor = con.execute(
+    con = get_connection()
+    if topic_id is None:
+        topic_id = get_topic_id(page_link)
+    try:
+        with transaction():
+            existing_row = _find_risitas(con, page_link, topic_id)
+            if existing_row:
+                con.execute(
                     '''UPDATE risitas
                     SET title = ?,
                     page_link = ?,
                     file_path = ?,
                     total_pages = ?,
-                    post_cursor = ?
+                    post_cursor = ?,
+                    topic_id = ?
                     WHERE id = ?''',
                     (
                         title,
@@ -112,61 +394,1119 @@ def update_db(
                         str(file_path),
                         total_pages,
                         post_cursor,
-                        cursor_existing_row[0],
+                        topic_id,
+                        existing_row[0],
                     )
                 )
-                con.commit()
                 logging.info(
                     "A risitas has been updated in the database!"
                 )
-                logging.debug(
-                    "Id: %d "
-                    "Title: %s "
-                    "Total pages : %d",
-                    cursor.lastrowid,
-                    title,
-                    total_pages,
-                )
-        except sqlite3.OperationalError as operational_error:
-            logging.exception(operational_error)
-    else:
-        try:
-            with con:
+                row_id = existing_row[0]
+            else:
                 cursor = con.execute(
                     '''INSERT INTO risitas
                     (title,
                     page_link,
                     file_path,
                     total_pages,
-                    post_cursor)
-                    VALUES (?, ?, ?, ?, ?)''',
+                    post_cursor,
+                    topic_id)
+                    VALUES (?, ?, ?, ?, ?, ?)''',
                     (
                         title,
                         page_link,
                         str(file_path),
                         total_pages,
                         post_cursor,
+                        topic_id,
                     )
                 )
-                con.commit()
                 logging.info(
                     "A new risitas has been inserted in the database "
                     "at %s", DB_PATH
                 )
-                logging.debug(
-                    "Id: %d "
-                    "Title: %s "
-                    "Total pages : %d",
-                    cursor.lastrowid,
-                    title,
-                    total_pages,
+                row_id = cursor.lastrowid
+            logging.debug(
+                "Id: %d "
+                "Title: %s "
+                "Total pages : %d",
+                row_id,
+                title,
+                total_pages,
+            )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def read_all_risitas() -> List[Tuple]:
+    """Fetch all the risitas in the database"""
+    con = get_connection()
+    rows = []
+    try:
+        rows = con.execute('''select * from risitas order by id''').fetchall()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return rows
+
+
+def insert_chapter(chapter: Chapter) -> None:
+    """
+    Store a chapter, a chapter downloaded again at the same
+    position replaces the previous one.
+    """
+    con = get_connection()
+    try:
+        with transaction():
+            con.execute(
+                '''INSERT INTO chapters
+                (topic_id,
+                page,
+                post_cursor,
+                author,
+                html,
+                text_hash,
+                contains_image)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (topic_id, page, post_cursor) DO UPDATE SET
+                author = excluded.author,
+                html = excluded.html,
+                text_hash = excluded.text_hash,
+                contains_image = excluded.contains_image''',
+                (
+                    chapter.topic_id,
+                    chapter.page,
+                    chapter.post_cursor,
+                    chapter.author,
+                    chapter.html,
+                    get_text_hash(chapter.text),
+                    int(chapter.contains_image),
+                )
+            )
+        logging.debug(
+            "Stored chapter of %s at page %d, post %d",
+            chapter.topic_id,
+            chapter.page,
+            chapter.post_cursor,
+        )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def read_chapters(
+        topic_id: str,
+        first_page: int = 1,
+        last_page: Optional[int] = None,
+) -> Iterator[Tuple]:
+    """
+    Yield the stored chapters of a topic in order,
+    optionally only those between first_page and last_page.
+    """
+    con = get_connection()
+    if last_page is None:
+        last_page = sys.maxsize
+    try:
+        yield from con.execute(
+            '''select page, post_cursor, author, html, text_hash,
+            contains_image from chapters
+            where topic_id = ? and page between ? and ?
+            order by page, post_cursor''',
+            (topic_id, first_page, last_page)
+        )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def read_page(topic_id: str, page: int) -> Optional[Tuple]:
+    """
+    Fetch the state of a page when it was last downloaded, as
+    (content_hash, etag, last_modified, post_count, chapter_hashes)
+    """
+    con = get_connection()
+    row = None
+    try:
+        row = con.execute(
+            '''select content_hash, etag, last_modified, post_count,
+            chapter_hashes from pages where topic_id = ? and page = ?''',
+            (topic_id, page)
+        ).fetchone()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return row
+
+
+def update_page(
+        topic_id: str,
+        page: int,
+        content_hash: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        post_count: int,
+) -> str:
+    """
+    Record the state of a downloaded page with the hashes of the
+    chapters stored for it, return these hashes.
+    """
+    con = get_connection()
+    chapter_hashes = ""
+    try:
+        with transaction():
+            chapter_hashes = json.dumps(
+                con.execute(
+                    '''select post_cursor, text_hash from chapters
+                    where topic_id = ? and page = ?
+                    order by post_cursor''',
+                    (topic_id, page)
+                ).fetchall()
+            )
+            con.execute(
+                '''INSERT INTO pages
+                (topic_id,
+                page,
+                content_hash,
+                etag,
+                last_modified,
+                post_count,
+                chapter_hashes,
+                checked_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (topic_id, page) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                post_count = excluded.post_count,
+                chapter_hashes = excluded.chapter_hashes,
+                checked_at = excluded.checked_at''',
+                (
+                    topic_id,
+                    page,
+                    content_hash,
+                    etag,
+                    last_modified,
+                    post_count,
+                    chapter_hashes,
+                    time.time(),
+                )
+            )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return chapter_hashes
+
+
+def delete_page_chapters(topic_id: str, page: int) -> None:
+    """Remove the stored chapters of a page before it is processed again"""
+    con = get_connection()
+    try:
+        with transaction():
+            con.execute(
+                '''DELETE FROM chapters WHERE topic_id = ? and page = ?''',
+                (topic_id, page)
+            )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def save_checkpoint(topic_id: str, page: int, post_cursor: int) -> None:
+    """Record the last page fully processed of a risitas being downloaded"""
+    con = get_connection()
+    try:
+        with transaction():
+            con.execute(
+                '''INSERT INTO checkpoints
+                (topic_id, page, post_cursor, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (topic_id) DO UPDATE SET
+                page = excluded.page,
+                post_cursor = excluded.post_cursor,
+                updated_at = excluded.updated_at''',
+                (topic_id, page, post_cursor, time.time())
+            )
+        logging.debug("Checkpoint of %s at page %d", topic_id, page)
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def set_checkpoint_file_path(topic_id: str, file_path: pathlib.Path) -> None:
+    """Record the html file being written for a risitas being downloaded"""
+    con = get_connection()
+    try:
+        with transaction():
+            con.execute(
+                '''UPDATE checkpoints SET file_path = ?
+                WHERE topic_id = ?''',
+                (str(file_path), topic_id)
+            )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def read_checkpoint(topic_id: str) -> Optional[Tuple]:
+    """
+    Fetch the checkpoint of an interrupted download,
+    as (page, post_cursor, file_path)
+    """
+    con = get_connection()
+    row = None
+    try:
+        row = con.execute(
+            '''select page, post_cursor, file_path from checkpoints
+            where topic_id = ?''',
+            (topic_id, )
+        ).fetchone()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return row
+
+
+def delete_checkpoint(topic_id: str) -> None:
+    """Remove the checkpoint of a risitas once it is fully downloaded"""
+    con = get_connection()
+    try:
+        with transaction():
+            con.execute(
+                '''DELETE FROM checkpoints WHERE topic_id = ?''',
+                (topic_id, )
+            )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def read_chapters_after(
+        topic_id: str,
+        page: int,
+        post_cursor: int,
+        last_page: int,
+) -> Iterator[Tuple]:
+    """
+    Yield the stored chapters of a topic that come after a post,
+    up to last_page included.
+    """
+    con = get_connection()
+    try:
+        yield from con.execute(
+            '''select page, post_cursor, author, html, text_hash,
+            contains_image from chapters
+            where topic_id = ?
+            and (page > ? or (page = ? and post_cursor > ?))
+            and page <= ?
+            order by page, post_cursor''',
+            (topic_id, page, page, post_cursor, last_page)
+        )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def update_manifest(
+        output_dir: pathlib.Path,
+        file_path: pathlib.Path,
+        kind: str,
+        size: int,
+        sha256: Optional[str],
+        topic_id: Optional[str] = None,
+        mtime: Optional[float] = None,
+) -> None:
+    """
+    Record an output file (html or pdf) in the manifest,
+    without its hash if it isn't known yet.
+    """
+    con = get_connection()
+    try:
+        with transaction():
+            con.execute(
+                '''INSERT INTO outputs
+                (output_dir,
+                directory,
+                name,
+                topic_id,
+                kind,
+                size,
+                sha256,
+                updated_at,
+                mtime)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (directory, name) DO UPDATE SET
+                output_dir = excluded.output_dir,
+                topic_id = coalesce(excluded.topic_id, topic_id),
+                kind = excluded.kind,
+                size = excluded.size,
+                sha256 = excluded.sha256,
+                updated_at = excluded.updated_at,
+                mtime = excluded.mtime''',
+                (
+                    str(output_dir),
+                    str(file_path.parent),
+                    file_path.name,
+                    topic_id,
+                    kind,
+                    size,
+                    sha256,
+                    time.time(),
+                    mtime,
+                )
+            )
+        logging.debug("Recorded %s in the manifest", file_path)
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def update_manifest_hash(
+        file_path: pathlib.Path,
+        size: int,
+        mtime: float,
+        sha256: str,
+) -> None:
+    """
+    Record the hash of an output file recorded without it,
+    unless the file was recorded again since it was hashed.
+    """
+    con = get_connection()
+    try:
+        with transaction():
+            con.execute(
+                '''UPDATE outputs SET sha256 = ?
+                WHERE directory = ? and name = ? and sha256 is null
+                and size = ? and mtime = ?''',
+                (sha256, str(file_path.parent), file_path.name, size, mtime)
+            )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def read_manifest(
+        output_dir: pathlib.Path,
+        kind: str,
+) -> List[pathlib.Path]:
+    """Get all the output files of a kind in an output dir"""
+    con = get_connection()
+    rows = []
+    try:
+        rows = con.execute(
+            '''select directory, name from outputs
+            where output_dir = ? and kind = ?
+            order by directory, name''',
+            (str(output_dir), kind)
+        ).fetchall()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return [pathlib.Path(directory) / name for directory, name in rows]
+
+
+def read_output_topic_id(file_path: pathlib.Path) -> Optional[str]:
+    """Get the topic id an output file was recorded with"""
+    con = get_connection()
+    row = None
+    try:
+        row = con.execute(
+            '''select topic_id from outputs
+            where directory = ? and name = ?''',
+            (str(file_path.parent), file_path.name)
+        ).fetchone()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return row[0] if row else None
+
+
+def read_manifest_names(directory: pathlib.Path) -> List[str]:
+    """Get the names of the output files recorded in a directory"""
+    con = get_connection()
+    rows = []
+    try:
+        rows = con.execute(
+            '''select name from outputs where directory = ?''',
+            (str(directory), )
+        ).fetchall()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return [row[0] for row in rows]
+
+
+def read_pdf_render(html_path: pathlib.Path) -> Optional[Tuple]:
+    """
+    Fetch the last render of an html file, as
+    (pdf_path, html_size, html_mtime, html_sha256, settings, pdf_size)
+    """
+    con = get_connection()
+    row = None
+    try:
+        row = con.execute(
+            '''select pdf_path, html_size, html_mtime, html_sha256,
+            settings, pdf_size from pdf_renders where html_path = ?''',
+            (str(html_path), )
+        ).fetchone()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return row
+
+
+def update_pdf_render(
+        html_path: pathlib.Path,
+        pdf_path: pathlib.Path,
+        html_size: int,
+        html_mtime: float,
+        html_sha256: str,
+        settings: str,
+) -> None:
+    """Record the html file and the settings a pdf was rendered from"""
+    con = get_connection()
+    try:
+        with transaction():
+            con.execute(
+                '''INSERT INTO pdf_renders
+                (html_path,
+                pdf_path,
+                html_size,
+                html_mtime,
+                html_sha256,
+                settings,
+                pdf_size,
+                rendered_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (html_path) DO UPDATE SET
+                pdf_path = excluded.pdf_path,
+                html_size = excluded.html_size,
+                html_mtime = excluded.html_mtime,
+                html_sha256 = excluded.html_sha256,
+                settings = excluded.settings,
+                pdf_size = excluded.pdf_size,
+                rendered_at = excluded.rendered_at''',
+                (
+                    str(html_path),
+                    str(pdf_path),
+                    html_size,
+                    html_mtime,
+                    html_sha256,
+                    settings,
+                    pdf_path.stat().st_size,
+                    time.time(),
+                )
+            )
+        logging.debug("Recorded the render of %s", pdf_path)
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def index_chapters(
+        file_path: pathlib.Path,
+        chapters: Iterable[Chapter],
+        replace: bool = False,
+) -> None:
+    """
+    Add the chapters written in an html file to the full text index,
+    if replace is set, the chapters already indexed for it are removed.
+    """
+    con = get_connection()
+    try:
+        with transaction():
+            if replace:
+                _delete_fts_rows(con, "file_path", str(file_path))
+            _insert_fts_rows(
+                con,
+                (
+                    (
+                        chapter.text,
+                        chapter.title,
+                        chapter.author,
+                        chapter.topic_id,
+                        chapter.page,
+                        str(file_path),
+                    )
+                    for chapter in chapters
                 )
+            )
+        logging.debug("Indexed the chapters of %s", file_path)
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def _delete_fts_rows(
+        con: sqlite3.Connection,
+        column: str,
+        value: str,
+) -> None:
+    """Remove the indexed chapters of a file_path or a topic_id"""
+    con.execute(
+        f'''DELETE FROM main.chapters_fts WHERE rowid IN
+        (select rowid from main.chapters_fts_rows where {column} = ?)''',
+        (value, )
+    )
+    con.execute(
+        f'''DELETE FROM main.chapters_fts_rows WHERE {column} = ?''',
+        (value, )
+    )
+
+
+def _insert_fts_rows(
+        con: sqlite3.Connection,
+        rows: Iterable[Tuple[str, str, str, str, int, str]],
+) -> None:
+    """
+    Index (text, title, author, topic_id, page, file_path) rows,
+    each one under the rowid it gets in chapters_fts_rows.
+    """
+    for text, title, author, topic_id, page, file_path in rows:
+        row_id = con.execute(
+            '''INSERT INTO main.chapters_fts_rows (file_path, topic_id)
+            VALUES (?, ?)''',
+            (file_path, topic_id)
+        ).lastrowid
+        con.execute(
+            '''INSERT INTO main.chapters_fts
+            (rowid, text, title, author, topic_id, page, file_path)
+            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (row_id, text, title, author, topic_id, page, file_path)
+        )
+
+
+def search_chapters(
+        query: str,
+        limit: int = 20,
+        highlight: Tuple[str, str] = ("[", "]"),
+) -> List[Tuple]:
+    """
+    Search the indexed chapters, the best matches come first
+    with a snippet of the text where the words are highlighted.
+    """
+    con = get_connection()
+    rows: List[Tuple] = []
+    search = '''select title, author, page, file_path,
+    snippet(chapters_fts, 0, ?, ?, '...', 16)
+    from chapters_fts where chapters_fts match ?
+    order by rank limit ?'''
+    try:
+        rows = con.execute(search, (*highlight, query, limit)).fetchall()
+    except sqlite3.OperationalError:
+        # Not a valid fts5 query, search it as a phrase instead
+        phrase = '"' + query.replace('"', '""') + '"'
+        try:
+            rows = con.execute(
+                search, (*highlight, phrase, limit)
+            ).fetchall()
         except sqlite3.OperationalError as operational_error:
             logging.exception(operational_error)
-    con.close()
+    return rows
+
+
+def enqueue_jobs(
+        links: Iterable[Tuple[str, str]],
+        priority: int = 0,
+        total_pages: Optional[Dict[str, int]] = None,
+) -> int:
+    """
+    Add (topic_id, link) pairs to the job queue, a topic already queued
+    keeps one job with the highest priority, a finished one is queued again.
+    total_pages has the number of pages of the topics when it is known
+    before their download, from the listings.
+    Return the number of links enqueued, an error of the database
+    is raised, nothing was enqueued then.
+    """
+    con = get_connection()
+    count = 0
+    total_pages = total_pages or {}
+
+    def jobs() -> Iterator[Tuple]:
+        nonlocal count
+        now = time.time()
+        for topic_id, link in links:
+            count += 1
+            yield (topic_id, link, priority, now, total_pages.get(topic_id))
+
+    with transaction():
+        con.executemany(
+            '''INSERT INTO jobs
+            (topic_id, link, priority, state, attempts, enqueued_at,
+            total_pages)
+            VALUES (?, ?, ?, 'queued', 0, ?, ?)
+            ON CONFLICT (topic_id) DO UPDATE SET
+            link = excluded.link,
+            priority = max(priority, excluded.priority),
+            total_pages = coalesce(excluded.total_pages, total_pages),
+            state = case when state = 'leased'
+                then state else 'queued' end,
+            attempts = case when state = 'leased'
+                then attempts else 0 end,
+            error = case when state = 'leased'
+                then error else null end,
+            enqueued_at = case when state = 'queued'
+                then enqueued_at else excluded.enqueued_at end''',
+            jobs()
+        )
+    return count
+
+
+def lease_job(
+        worker: str,
+        lease_timeout: float,
+        max_attempts: int = 3,
+) -> Optional[Tuple]:
+    """
+    Take the queued job with the highest priority, or a job whose lease
+    has expired, for lease_timeout seconds. A job whose lease expired
+    max_attempts times is failed, its download never finishes.
+    Return (topic_id, link, attempts) or None when the queue is empty,
+    an error of the database is raised.
+    """
+    con = get_connection()
+    now = time.time()
+    with transaction():
+        con.execute(
+            '''UPDATE jobs SET state = 'failed',
+            finished_at = ?,
+            leased_until = null,
+            error = ?
+            WHERE state = 'leased' and leased_until < ? and attempts >= ?''',
+            (
+                now,
+                f"The lease expired {max_attempts} times",
+                now,
+                max_attempts,
+            )
+        )
+        row = con.execute(
+            '''select topic_id, link, attempts from jobs
+            where state = 'queued'
+            or (state = 'leased' and leased_until < ?)
+            order by priority desc, enqueued_at limit 1''',
+            (now, )
+        ).fetchone()
+        if row:
+            con.execute(
+                '''UPDATE jobs SET state = 'leased',
+                attempts = attempts + 1,
+                worker = ?,
+                leased_until = ?,
+                started_at = ?
+                WHERE topic_id = ?''',
+                (worker, now + lease_timeout, now, row[0])
+            )
+    if row:
+        return (row[0], row[1], row[2] + 1)
+    return None
+
+
+def finish_job(
+        topic_id: str,
+        worker: str,
+        error: Optional[str] = None,
+) -> None:
+    """
+    Mark a leased job as done, or failed with its error, nothing is
+    changed if the lease expired and another worker took the job.
+    """
+    con = get_connection()
+    now = time.time()
+    try:
+        with transaction():
+            con.execute(
+                '''UPDATE jobs SET state = ?,
+                finished_at = ?,
+                duration = ? - started_at,
+                leased_until = null,
+                error = ?
+                WHERE state = 'leased' and topic_id = ? and worker = ?''',
+                (
+                    "failed" if error else "done",
+                    now,
+                    now,
+                    error,
+                    topic_id,
+                    worker,
+                )
+            )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def renew_lease(topic_id: str, worker: str, lease_timeout: float) -> bool:
+    """
+    Extend the lease of a job being downloaded by lease_timeout seconds,
+    return False if the lease expired and another worker took the job.
+    """
+    con = get_connection()
+    with transaction():
+        renewed = con.execute(
+            '''UPDATE jobs SET leased_until = ?
+            WHERE state = 'leased' and topic_id = ? and worker = ?''',
+            (time.time() + lease_timeout, topic_id, worker)
+        ).rowcount
+    return bool(renewed)
+
+
+def release_job(topic_id: str, worker: str) -> None:
+    """Put back a leased job in the queue, when a worker is stopped"""
+    con = get_connection()
+    try:
+        with transaction():
+            con.execute(
+                '''UPDATE jobs SET state = 'queued',
+                attempts = attempts - 1,
+                leased_until = null
+                WHERE state = 'leased' and topic_id = ? and worker = ?''',
+                (topic_id, worker)
+            )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def retry_jobs() -> int:
+    """Queue the failed jobs again, return how many were queued"""
+    con = get_connection()
+    count = 0
+    try:
+        with transaction():
+            count = con.execute(
+                '''UPDATE jobs SET state = 'queued',
+                attempts = 0,
+                error = null,
+                enqueued_at = ?
+                WHERE state = ?''',
+                (time.time(), "failed")
+            ).rowcount
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return count
+
+
+def read_jobs_status() -> List[Tuple]:
+    """
+    Count the jobs by state, as (state, count, total duration,
+    average duration, max attempts)
+    """
+    con = get_connection()
+    rows = []
+    try:
+        rows = con.execute(
+            '''select state, count(*), sum(duration), avg(duration),
+            max(attempts) from jobs
+            group by state order by state'''
+        ).fetchall()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return rows
+
+
+def read_job(topic_id: str) -> Optional[Tuple]:
+    """
+    Fetch a job, as (topic_id, link, priority, state, attempts,
+    enqueued_at, started_at, finished_at, duration, error, total_pages)
+    """
+    con = get_connection()
+    row = None
+    try:
+        row = con.execute(
+            '''select topic_id, link, priority, state, attempts,
+            enqueued_at, started_at, finished_at, duration, error,
+            total_pages from jobs where topic_id = ?''',
+            (topic_id, )
+        ).fetchone()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return row
+
+
+def read_topic_outputs(topic_id: str) -> List[Tuple]:
+    """
+    Fetch the files of a topic, as (path, kind, size, sha256, mtime),
+    the hash is None for the files recorded without it.
+    """
+    con = get_connection()
+    rows = []
+    try:
+        rows = con.execute(
+            '''select directory, name, kind, size, sha256, mtime
+            from outputs where topic_id = ? order by kind, directory, name''',
+            (topic_id, )
+        ).fetchall()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return [
+        (pathlib.Path(directory) / name, kind, size, sha256, mtime)
+        for directory, name, kind, size, sha256, mtime in rows
+    ]
+
+
+def read_failed_jobs(limit: int = 20) -> List[Tuple]:
+    """Fetch the last failed jobs, as (link, attempts, error)"""
+    con = get_connection()
+    rows = []
+    try:
+        rows = con.execute(
+            '''select link, attempts, error from jobs
+            where state = 'failed'
+            order by finished_at desc limit ?''',
+            (limit, )
+        ).fetchall()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return rows
+
+
+def read_discovered(topic_ids: Iterable[str]) -> Dict[str, int]:
+    """Get the number of replies the topics had when last seen"""
+    con = get_connection()
+    replies: Dict[str, int] = {}
+    try:
+        for topic_id in topic_ids:
+            row = con.execute(
+                '''select replies from discovered where topic_id = ?''',
+                (topic_id, )
+            ).fetchone()
+            if row:
+                replies[topic_id] = row[0]
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return replies
+
+
+def update_discovered(
+        topics: Iterable[Tuple[str, str, str, bool, int, int]],
+) -> None:
+    """
+    Record the topics seen in the listings, as
+    (topic_id, link, title, risitas, replies, total_pages)
+    """
+    con = get_connection()
+    now = time.time()
+    try:
+        with transaction():
+            con.executemany(
+                '''INSERT INTO discovered
+                (topic_id, link, title, risitas, replies, total_pages,
+                first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (topic_id) DO UPDATE SET
+                title = excluded.title,
+                replies = excluded.replies,
+                total_pages = excluded.total_pages,
+                last_seen = excluded.last_seen''',
+                (
+                    (topic_id, link, title, int(risitas), replies,
+                     total_pages, now, now)
+                    for topic_id, link, title, risitas, replies, total_pages
+                    in topics
+                )
+            )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def read_watch(topic_id: str) -> Optional[Tuple]:
+    """
+    Fetch when a watched topic is checked next,
+    as (interval, next_check, changed_at)
+    """
+    con = get_connection()
+    row = None
+    try:
+        row = con.execute(
+            '''select interval, next_check, changed_at from watch
+            where topic_id = ?''',
+            (topic_id, )
+        ).fetchone()
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    return row
+
+
+def update_watch(
+        topic_id: str,
+        link: str,
+        interval: float,
+        next_check: float,
+        changed_at: Optional[float],
+) -> None:
+    """Record when a watched topic was checked and is checked next"""
+    con = get_connection()
+    try:
+        with transaction():
+            con.execute(
+                '''INSERT INTO watch
+                (topic_id, link, interval, next_check, changed_at, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (topic_id) DO UPDATE SET
+                link = excluded.link,
+                interval = excluded.interval,
+                next_check = excluded.next_check,
+                changed_at = excluded.changed_at,
+                checked_at = excluded.checked_at''',
+                (topic_id, link, interval, next_check, changed_at, time.time())
+            )
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+
+
+def _remap_path(file_path: Optional[str], output_dir: str) -> Optional[str]:
+    """Move a path of another output dir to the same place in output_dir"""
+    if file_path is None:
+        return None
+    parts = pathlib.PurePath(file_path).parts
+    for index, part in enumerate(parts):
+        if part in OUTPUT_FOLDERS:
+            return str(pathlib.Path(output_dir, *parts[index:]))
+    return file_path
+
+
+def _get_merged_file_path(
+        con: sqlite3.Connection,
+        file_path: str,
+        topic_id: str,
+        existing_row,
+) -> str:
+    """
+    Get the path of the html file of a risitas taken from a node,
+    it replaces the file of the same risitas. The file of another
+    risitas with the same name is kept, the next free number is used.
+    """
+    html = pathlib.Path(file_path)
+    stem, _, suffix = html.name.partition(".")
+    if existing_row and existing_row[3]:
+        existing_html = pathlib.Path(existing_row[3])
+        existing_stem = existing_html.name.partition(".")[0]
+        return str(existing_html.with_name(f"{existing_stem}.{suffix}"))
+    other_topic = con.execute(
+        '''select 1 from risitas where file_path = ? and topic_id is not ?''',
+        (file_path, topic_id)
+    ).fetchone()
+    if not other_topic and not html.exists():
+        return file_path
+    html.parent.mkdir(parents=True, exist_ok=True)
+    taken_names = set(read_manifest_names(html.parent))
+    taken_names.update(
+        pathlib.Path(row[0]).name for row in con.execute(
+            '''select file_path from risitas where file_path like ?''',
+            (f"{html.parent}%", )
+        )
+    )
+    return str(
+        reserve_numbered_file(
+            html.parent,
+            re.sub(r"-\d+$", "", stem),
+            suffix,
+            taken_names
+        )
+    )
+
+
+def merge_db(
+        node_db_path: pathlib.Path,
+        output_dir: pathlib.Path,
+) -> List[Tuple[str, pathlib.Path, pathlib.Path]]:
+    """
+    Merge the risitas of another database, a risitas is taken with its
+    chapters and pages when it is further than the one already there,
+    by total pages then post cursor. The file paths are moved to output_dir.
+    Return (topic_id, html file path relative to the node output dir,
+    html file path relative to output_dir) of the risitas taken.
+    """
+    # Bring the database of the node to the current schema first
+    node_con = sqlite3.connect(node_db_path, timeout=30)
+    try:
+        create_db(node_con)
+        _migrate_db(node_con)
+    finally:
+        node_con.close()
+    con = get_connection()
+    taken = []
+    taken_files: Dict[str, str] = {}
+    con.execute("attach database ? as node", (str(node_db_path), ))
+    try:
+        with transaction():
+            rows = con.execute(
+                '''select title, page_link, file_path, total_pages,
+                post_cursor, topic_id from node.risitas'''
+            ).fetchall()
+            for title, page_link, file_path, total_pages, post_cursor, \
+                    topic_id in rows:
+                topic_id = topic_id or get_topic_id(page_link)
+                existing_row = _find_risitas(con, page_link, topic_id)
+                if existing_row and (
+                        (existing_row[4], existing_row[5]) >=
+                        (total_pages, post_cursor)
+                ):
+                    continue
+                node_file_path = _remap_path(file_path, str(output_dir))
+                file_path = _get_merged_file_path(
+                    con,
+                    node_file_path,
+                    topic_id,
+                    existing_row
+                )
+                update_db(
+                    title,
+                    page_link,
+                    file_path,
+                    total_pages,
+                    post_cursor,
+                    topic_id,
+                )
+                for table, columns in (
+                        ("chapters", '''topic_id, page, post_cursor, author,
+                        html, text_hash, contains_image'''),
+                        ("pages", '''topic_id, page, content_hash, etag,
+                        last_modified, post_count, chapter_hashes,
+                        checked_at'''),
+                ):
+                    con.execute(
+                        f'''DELETE FROM main.{table} WHERE topic_id = ?''',
+                        (topic_id, )
+                    )
+                    con.execute(
+                        f'''INSERT INTO main.{table} ({columns})
+                        select {columns} from node.{table}
+                        where topic_id = ?''',
+                        (topic_id, )
+                    )
+                taken_files[topic_id] = file_path
+                try:
+                    taken.append((
+                        topic_id,
+                        pathlib.Path(node_file_path).relative_to(output_dir),
+                        pathlib.Path(file_path).relative_to(output_dir),
+                    ))
+                except ValueError:
+                    logging.warning(
+                        "%s is not in an output dir, it won't be copied",
+                        file_path
+                    )
+            logging.info(
+                "Took %d risitas from %s", len(taken_files), node_db_path
+            )
+            _merge_fts(con, taken_files)
+    except sqlite3.OperationalError as operational_error:
+        logging.exception(operational_error)
+    finally:
+        con.execute("detach database node")
+    return taken
+
+
+def _merge_fts(con: sqlite3.Connection, taken_files: Dict[str, str]) -> None:
+    """
+    Copy the full text index of the risitas taken from a node,
+    taken_files maps their topic id to their html file.
+    """
+    try:
+        with transaction():
+            for topic_id, file_path in taken_files.items():
+                _delete_fts_rows(con, "topic_id", topic_id)
+                _insert_fts_rows(
+                    con,
+                    con.execute(
+                        '''select text, title, author, fts.topic_id, page, ?
+                        from node.chapters_fts_rows as fts_rows
+                        join node.chapters_fts as fts
+                        on fts.rowid = fts_rows.rowid
+                        where fts_rows.topic_id = ?''',
+                        (file_path, topic_id)
+                    ).fetchall()
+                )
+    except sqlite3.OperationalError as operational_error:
+        logging.debug(
+            "Full text search is not available %s", operational_error
+        )
 
 
 def delete_db() -> None:
     """Delete the database"""
+    close_db()
     DB_PATH.unlink()
+    for suffix in ("-wal", "-shm"):
+        DB_PATH.with_name(DB_PATH.name + suffix).unlink(missing_ok=True)
     logging.info("Deleted database at %s", DB_PATH)
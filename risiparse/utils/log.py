@@ -20,6 +20,8 @@ LOG_COLORS = {
 
 TODAY = datetime.date.today()
 
+FMT = '%(asctime)s:%(levelname)s: %(message)s'
+
 
 class ColorFormatter(logging.Formatter):
     """Color the logs"""
@@ -2,19 +2,61 @@
 
 """This module just regroup some routines"""
 
-from typing import List, Type, Dict
+from typing import (
+    Callable,
+    List,
+    Type,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    TextIO,
+    Tuple,
+)
+import concurrent.futures
+import contextlib
+import functools
+import sys
 import tempfile
+import io
+import os
+import json
+import mmap
+import multiprocessing
+import gzip
+import itertools
+import zlib
+import hashlib
+import shutil
 import unicodedata
 import pathlib
 import re
 import argparse
 import logging
 
+from html import escape as html_escape
 from urllib.parse import urlparse
-from PyPDF2 import PdfFileMerger
 from bs4 import BeautifulSoup
-from risiparse import html_to_pdf, sites_selectors
+from lxml import etree
+from risiparse import sites_selectors
 from risiparse.sites_selectors import Webarchive
+from risiparse.utils.database import (
+    OUTPUT_FOLDERS,
+    update_manifest,
+    update_manifest_hash,
+    read_manifest,
+    read_topic_outputs,
+    read_pdf_render,
+    update_pdf_render,
+    transaction,
+)
+from risiparse.utils.utils_posts import Chapter
+from risiparse.utils.utils_links import get_topic_id, strip_webarchive_link
+from risiparse.utils.utils_files import (
+    atomic_write,
+    atomic_write_bytes,
+    atomic_write_text,
+)
 
 
 def _replace_whitespaces(title: str) -> str:
@@ -22,9 +64,16 @@ def _replace_whitespaces(title: str) -> str:
     return title_dashes
 
 
+RISITAS_TITLE_REGEXP = re.compile(r"\[risitas\]", re.IGNORECASE)
+
+
 def _remove_risitas(title: str) -> str:
-    regexp = re.compile(r"\[risitas\]", re.IGNORECASE)
-    return regexp.sub("", title).strip()
+    return RISITAS_TITLE_REGEXP.sub("", title).strip()
+
+
+def is_risitas_title(title: str) -> bool:
+    """Check if a topic title is the one of a risitas"""
+    return bool(RISITAS_TITLE_REGEXP.search(title))
 
 
 def slugify(
@@ -61,6 +110,139 @@ def get_domain(url: str) -> str:
     return domain
 
 
+def get_shard_name(topic_id: str) -> str:
+    """Get the name of the directory where a topic files are stored"""
+    return hashlib.sha1(topic_id.encode("utf-8")).hexdigest()[:2]
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """Parse a shard given as i/N on the command line"""
+    try:
+        index, count = (int(number) for number in shard.split("/"))
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(
+            f"{shard} is not a shard, it must be i/N"
+        ) from error
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(
+            f"{shard} is not a shard, i must be between 0 and N - 1"
+        )
+    return index, count
+
+
+def is_in_shard(topic_id: str, shard: Tuple[int, int]) -> bool:
+    """
+    Check if a topic belongs to a shard, a topic always
+    lands in the same shard whatever the node.
+    """
+    index, count = shard
+    topic_hash = hashlib.sha1(topic_id.encode("utf-8")).hexdigest()
+    return int(topic_hash, 16) % count == index
+
+
+def get_topic_lock_path(
+        output_dir: pathlib.Path,
+        topic_id: str,
+) -> pathlib.Path:
+    """Get the lock file of a topic, held while it is downloaded"""
+    return (
+        output_dir / ".locks" /
+        f"{hashlib.sha1(topic_id.encode('utf-8')).hexdigest()}.lock"
+    )
+
+
+def get_file_hash(file_path: pathlib.Path) -> str:
+    """Compute the sha256 of a file"""
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def record_output(
+        output_dir: pathlib.Path,
+        file_path: pathlib.Path,
+        kind: str,
+        topic_id: Optional[str] = None,
+        hash_file: bool = True,
+) -> None:
+    """
+    Record an output file with its size and hash in the manifest,
+    a file appended to is recorded without its hash so that an append
+    doesn't read the whole file, it is hashed when first needed.
+    """
+    file_stat = file_path.stat()
+    update_manifest(
+        output_dir,
+        file_path,
+        kind,
+        file_stat.st_size,
+        get_file_hash(file_path) if hash_file else None,
+        topic_id,
+        file_stat.st_mtime,
+    )
+
+
+def read_topic_files(topic_id: str) -> List[Tuple]:
+    """
+    Get the files of a topic from the manifest, as (path, kind, size,
+    sha256), the files recorded without their hash are hashed now.
+    """
+    files = []
+    for file_path, kind, size, sha256, mtime in read_topic_outputs(topic_id):
+        if sha256 is None and file_path.is_file():
+            sha256 = get_file_hash(file_path)
+            update_manifest_hash(file_path, size, mtime, sha256)
+        files.append((file_path, kind, size, sha256))
+    return files
+
+
+def is_html_file(file_path: pathlib.Path) -> bool:
+    """Check if a file is an html file, compressed or not"""
+    return bool(file_path.name.endswith((".html", ".html.gz")))
+
+
+def scan_html_files(output_dir: pathlib.Path) -> List[pathlib.Path]:
+    """List the html files of an output dir and of its shards"""
+    html_folder_path = output_dir / "risitas-html"
+    htmls_file_path = []
+    for file_path in html_folder_path.iterdir():
+        if file_path.is_dir() and file_path.name != "images":
+            htmls_file_path.extend(
+                html for html in file_path.iterdir() if is_html_file(html)
+            )
+        elif is_html_file(file_path):
+            htmls_file_path.append(file_path)
+    return sorted(html for html in htmls_file_path if html.is_file())
+
+
+def get_html_files(
+        output_dir: pathlib.Path,
+        use_database: bool = True,
+        scan: bool = False,
+) -> List[pathlib.Path]:
+    """
+    Get the html files of an output dir from the manifest. Without the
+    database, or if scan is set, the directories are listed instead
+    and the files missing from the manifest are recorded.
+    """
+    if use_database and not scan:
+        return sorted(
+            html for html in read_manifest(output_dir, "html")
+            if html.exists()
+        )
+    htmls_file_path = scan_html_files(output_dir)
+    if not use_database:
+        return htmls_file_path
+    recorded = set(read_manifest(output_dir, "html"))
+    missing = [html for html in htmls_file_path if html not in recorded]
+    with transaction():
+        for html in missing:
+            record_output(output_dir, html, "html", hash_file=False)
+    return htmls_file_path
+
+
 def make_app_dirs(output_dir: 'pathlib.Path') -> None:
     """Create the dirs where the htmls and pdfs are stored"""
     (output_dir / "risitas-html").mkdir(exist_ok=True, parents=True)
@@ -87,108 +269,637 @@ def get_selectors_and_site(
     )
 
 
+PDF_FRAGMENT_CHAPTERS = 10
+
+
 def html_is_too_big(html: pathlib.Path, size: int = 3670016) -> bool:
     """Check if an html file is too big"""
-    return bool(html.stat().st_size >= size)
+    return bool(get_html_size(html) >= size)
+
+
+def get_pdf_path(output_dir: pathlib.Path, html: pathlib.Path) -> pathlib.Path:
+    """Get the path of the pdf of an html file, in the same shard"""
+    html = strip_compressed_suffix(html)
+    try:
+        shard = html.parent.relative_to(output_dir / "risitas-html")
+    except ValueError:
+        shard = pathlib.Path()
+    return output_dir / "risitas-pdf" / shard / html.with_suffix(".pdf").name
+
+
+def iter_html_chapters(html: pathlib.Path) -> Iterator[str]:
+    """
+    Stream the top-level elements of the body of an html file,
+    nested elements are never yielded on their own and the elements
+    already yielded are freed.
+    """
+    opener = gzip.open if is_compressed(html) else open
+    with opener(html, "rb") as html_file:
+        for _, element in etree.iterparse(
+                html_file,
+                events=("end",),
+                html=True,
+                encoding="utf-8",
+        ):
+            parent = element.getparent()
+            if parent is None or parent.tag != "body":
+                continue
+            if parent.text and parent.text.strip():
+                yield html_escape(parent.text)
+                parent.text = None
+            yield etree.tostring(
+                element,
+                method="html",
+                encoding="unicode",
+                with_tail=True
+            )
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+
+
+def get_html_image_urls(html: pathlib.Path) -> Iterator[str]:
+    """Yield the links of the remote images of an html file"""
+    for chapter in iter_html_chapters(html):
+        yield from re.findall(r'<img[^>]*?\ssrc="(https?://[^"]+)"', chapter)
+
+
+def group_chapters(
+        chapters: Iterable[str],
+        part_size: int,
+        max_chapters: Optional[int] = None,
+) -> Iterator[List[str]]:
+    """
+    Group chapters in parts of at most part_size bytes and max_chapters
+    chapters, a part is closed only by the chapters it holds so the
+    first parts don't change when chapters are appended.
+    """
+    part: List[str] = []
+    size = 0
+    for chapter in chapters:
+        chapter_size = len(chapter.encode("utf-8"))
+        if part and (
+                size + chapter_size > part_size or
+                len(part) == max_chapters
+        ):
+            yield part
+            part = []
+            size = 0
+        part.append(chapter)
+        size += chapter_size
+    if part:
+        yield part
 
 
 def split_big_html(
         html: pathlib.Path,
         html_part_tmpdir: str,
         splitted_pdfs: Dict[str, List[pathlib.Path]],
-        divs_step: int = 30
+        output_dir: pathlib.Path,
+        part_size: int = 3670016,
 ) -> Dict[str, List[pathlib.Path]]:
-    """Split an html file into smaller htmls"""
-    (pathlib.Path(f"{html_part_tmpdir}") / "risitas-pdf").mkdir(exist_ok=True)
-    data = BeautifulSoup(
-        html.read_text(encoding='utf-8'), features="lxml"
-    )
-    divs = data.select("div")
-    start = 0
-    end = divs_step
-    for _ in range(0, len(divs), divs_step):
+    """
+    Split an html file into smaller htmls at chapter boundaries,
+    a part holds as many chapters as fit in part_size bytes.
+    """
+    pdf_path = str(get_pdf_path(output_dir, html))
+    # Html files of different shards can have the same name
+    part_name = (
+        f"{strip_compressed_suffix(html).stem}-"
+        f"{hashlib.sha1(str(html).encode()).hexdigest()[:8]}"
+    )
+    parts: List[pathlib.Path] = splitted_pdfs.setdefault(pdf_path, [])
+    for chapters in group_chapters(iter_html_chapters(html), part_size):
         file_path = pathlib.Path(
-            f"{html_part_tmpdir}/{html.name}"
-            f"-part-{start}-to-{end}.html"
-        )
-        with open(file_path, "w", encoding='utf-8') as file:
-            for div in divs[start:end]:
-                file.write(div.decode())
-                logging.debug("Appended div to %s", file_path)
-        pdf_path = str(html).replace("html", "pdf")
-        if pdf_path not in splitted_pdfs:
-            splitted_pdfs[pdf_path] = [file_path]
-        else:
-            splitted_pdfs[pdf_path].append(file_path)
-        start = end
-        end += divs_step
-        file_path = pathlib.Path(f"{html}-part-{start}-to-{end}.html")
+            html_part_tmpdir
+        ) / f"{part_name}-part-{len(parts):04d}.html"
+        write_html_file(file_path, chapters)
+        logging.debug("Wrote %s chapters to %s", len(chapters), file_path)
+        parts.append(file_path)
     return splitted_pdfs
 
 
+def get_pdf_cache_dir(
+        output_dir: pathlib.Path,
+        html: pathlib.Path
+) -> pathlib.Path:
+    """Get the directory of the cached pdf fragments of an html file"""
+    pdf_folder_path = output_dir / "risitas-pdf"
+    return pdf_folder_path / ".cache" / get_pdf_path(
+        output_dir,
+        html
+    ).relative_to(pdf_folder_path).with_suffix("")
+
+
+def prune_pdf_cache(
+        cache_dir: pathlib.Path,
+        fragments: List[pathlib.Path]
+) -> None:
+    """Remove the cached fragments no longer used by the pdf"""
+    for fragment in cache_dir.glob("*.pdf"):
+        if fragment not in fragments:
+            fragment.unlink()
+            logging.debug("Removed unused pdf fragment %s", fragment)
+
+
+def report_failed_renders(
+        htmls_file_path: List[pathlib.Path],
+        converted: Dict[pathlib.Path, pathlib.Path],
+) -> None:
+    """Log the html files that couldn't be converted"""
+    failed = [html for html in htmls_file_path if html not in converted]
+    for html in failed:
+        logging.error("No pdf was created for %s", html)
+    if failed:
+        logging.error(
+            "%s of %s html files couldn't be converted to pdf",
+            len(failed), len(htmls_file_path)
+        )
+
+
+def render_pdfs(
+        output_dir: pathlib.Path,
+        htmls_file_path: List[pathlib.Path],
+        args,
+        pdf_workers: Optional[int] = None,
+) -> Dict[pathlib.Path, pathlib.Path]:
+    """
+    Convert html files to pdf, in this process or sharded across a pool
+    of processes that each own a QApplication, biggest files first.
+    Return the pdf path of each html file converted.
+    """
+    if not htmls_file_path:
+        return {}
+    # Imported here so that Qt is only loaded when pdfs are created
+    from risiparse import (  # pylint: disable=import-outside-toplevel
+        html_to_pdf
+    )
+    pdf_workers = pdf_workers or args.pdf_workers
+    max_memory = args.pdf_max_memory << 20
+    if max_memory and not pathlib.Path("/proc").is_dir():
+        logging.warning(
+            "--pdf-max-memory is ignored, the memory of the render "
+            "processes is only known on Linux"
+        )
+        max_memory = 0
+    img_folder_path = (
+        args.output_dir / "risitas-html" / "images"
+        if args.cache_images else None
+    )
+    render_options = (
+        img_folder_path,
+        args.block_remote_images,
+        args.pdf_timeout,
+        args.pdf_recycle,
+        max_memory,
+    )
+    if args.pdf_processes <= 1:
+        converted = html_to_pdf.render_pdfs(
+            output_dir,
+            htmls_file_path,
+            pdf_workers,
+            *render_options
+        )
+        report_failed_renders(htmls_file_path, converted)
+        return converted
+    htmls_file_path = sorted(
+        htmls_file_path,
+        key=get_html_size,
+        reverse=True
+    )
+    # Small batches keep the processes busy until the end,
+    # each batch fills the pages of a process.
+    batch_size = max(1, pdf_workers)
+    batches = [
+        htmls_file_path[i:i + batch_size]
+        for i in range(0, len(htmls_file_path), batch_size)
+    ]
+    converted: Dict[pathlib.Path, pathlib.Path] = {}
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.pdf_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=html_to_pdf.init_render_process,
+            initargs=(args.output_dir, args.debug),
+    ) as executor:
+        futures = {
+            executor.submit(
+                html_to_pdf.render_pdfs,
+                output_dir,
+                batch,
+                pdf_workers,
+                *render_options
+            ): batch
+            for batch in batches
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                converted.update(future.result())
+            except Exception as error:  # pylint: disable=broad-except
+                logging.error(
+                    "Couldn't create the pdfs of %s : %s",
+                    [str(html) for html in futures[future]], error
+                )
+    report_failed_renders(htmls_file_path, converted)
+    return converted
+
+
+def write_merged_pdf(
+        pdf_path: pathlib.Path,
+        pdfs: List[pathlib.Path]
+) -> None:
+    """
+    Concatenate pdfs into pdf_path, the result replaces the previous pdf
+    only once fully written. PyPDF2 can't write a pdf incrementally, the
+    pages of all the pdfs are held by one PdfWriter until it is written,
+    so the memory used grows with the size of the merged pdf.
+    """
+    # Imported here so that PyPDF2 is only loaded when pdfs are merged
+    from PyPDF2 import (  # pylint: disable=import-outside-toplevel
+        PdfReader,
+        PdfWriter
+    )
+    writer = PdfWriter()
+    for pdf in pdfs:
+        for page in PdfReader(str(pdf)).pages:
+            writer.add_page(page)
+    with atomic_write(pdf_path, "wb") as final_pdf:
+        writer.write(final_pdf)
+
+
 def merge_pdfs(
         splitted_pdfs: Dict[str, List[pathlib.Path]],
+        converted: Dict[pathlib.Path, pathlib.Path],
+) -> List[pathlib.Path]:
+    """Merge the pdfs of the smaller htmls back into one pdf"""
+    pdfs_file_path: List[pathlib.Path] = []
+    for pdf_file_name, htmls_part in splitted_pdfs.items():
+        missing_parts = [
+            html_part for html_part in htmls_part
+            if html_part not in converted
+        ]
+        if missing_parts:
+            logging.error(
+                "Couldn't create %s, %s parts failed",
+                pdf_file_name, len(missing_parts)
+            )
+            continue
+        write_merged_pdf(
+            pathlib.Path(pdf_file_name),
+            [converted[html_part] for html_part in htmls_part]
+        )
+        logging.info("Merged pdf parts into %s", pdf_file_name)
+        pdfs_file_path.append(pathlib.Path(pdf_file_name))
+    return pdfs_file_path
+
+
+def create_cached_pdfs(
+        output_dir: pathlib.Path,
+        htmls_file_path: List[pathlib.Path],
         html_part_tmpdir: str,
-        app
+        args,
+) -> List[pathlib.Path]:
+    """
+    Create pdfs from fragments of a few chapters cached by content hash,
+    only the fragments not in the cache are rendered, usually the last
+    ones of a topic that got new chapters.
+    """
+    fragments: Dict[pathlib.Path, List[pathlib.Path]] = {}
+    cache_dirs: Dict[pathlib.Path, pathlib.Path] = {}
+    to_render: Dict[pathlib.Path, pathlib.Path] = {}
+    for html in htmls_file_path:
+        pdf_path = get_pdf_path(output_dir, html)
+        cache_dir = cache_dirs[pdf_path] = get_pdf_cache_dir(output_dir, html)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        fragments_path = fragments.setdefault(pdf_path, [])
+        for chapters in group_chapters(
+                iter_html_chapters(html),
+                args.pdf_part_size,
+                PDF_FRAGMENT_CHAPTERS
+        ):
+            fragment = "".join(chapters)
+            fragment_path = cache_dir / (
+                f"{hashlib.sha256(fragment.encode('utf-8')).hexdigest()}.pdf"
+            )
+            fragments_path.append(fragment_path)
+            if fragment_path.exists() or fragment_path in to_render.values():
+                continue
+            fragment_html = pathlib.Path(
+                html_part_tmpdir
+            ) / f"fragment-{len(to_render):06d}.html"
+            write_html_file(fragment_html, [fragment])
+            to_render[fragment_html] = fragment_path
+    logging.info(
+        "Rendering %s pdf fragments not in the cache", len(to_render)
+    )
+    converted = render_pdfs(
+        pathlib.Path(html_part_tmpdir),
+        list(to_render),
+        args,
+        max(
+            args.pdf_workers,
+            min(len(to_render), os.cpu_count() or 1, 4)
+        )
+    )
+    for fragment_html, fragment_path in to_render.items():
+        if fragment_html in converted:
+            atomic_write_bytes(
+                fragment_path,
+                converted[fragment_html].read_bytes()
+            )
+    pdfs_file_path: List[pathlib.Path] = []
+    for pdf_path, fragments_path in fragments.items():
+        if not fragments_path:
+            logging.warning("No chapters to create %s from", pdf_path)
+            continue
+        if not all(fragment.exists() for fragment in fragments_path):
+            logging.error("Couldn't create %s, fragments failed", pdf_path)
+            continue
+        write_merged_pdf(pdf_path, fragments_path)
+        prune_pdf_cache(cache_dirs[pdf_path], fragments_path)
+        logging.info("Created %s from cached fragments", pdf_path)
+        pdfs_file_path.append(pdf_path)
+    return pdfs_file_path
+
+
+def get_render_settings(args) -> str:
+    """Get the settings that change the pdf rendered from an html file"""
+    return json.dumps(
+        {
+            "pdf_part_size": args.pdf_part_size,
+            "pdf_cache": args.pdf_cache,
+            "cache_images": args.cache_images,
+            "block_remote_images": args.block_remote_images,
+        },
+        sort_keys=True
+    )
+
+
+def pdf_is_up_to_date(
+        output_dir: pathlib.Path,
+        html: pathlib.Path,
+        settings: str,
+) -> bool:
+    """
+    Check if the pdf of an html file was rendered from the same content
+    with the same settings, the html is only hashed if its size is the
+    same but its modification time changed.
+    """
+    row = read_pdf_render(html)
+    pdf_path = get_pdf_path(output_dir, html)
+    if not row or row[0] != str(pdf_path) or row[4] != settings:
+        return False
+    _, html_size, html_mtime, html_sha256, _, pdf_size = row
+    if not pdf_path.is_file() or pdf_path.stat().st_size != pdf_size:
+        return False
+    html_stat = html.stat()
+    if html_stat.st_size != html_size:
+        return False
+    if html_stat.st_mtime == html_mtime:
+        return True
+    if get_file_hash(html) != html_sha256:
+        return False
+    update_pdf_render(
+        html, pdf_path, html_size, html_stat.st_mtime, html_sha256, settings
+    )
+    return True
+
+
+def record_pdf_renders(
+        output_dir: pathlib.Path,
+        htmls_file_path: List[pathlib.Path],
+        pdfs_file_path: List[pathlib.Path],
+        settings: str,
 ) -> None:
-    """Create pdfs from smaller htmls and merge them back"""
-    if splitted_pdfs:
-        for pdf_file_name, htmls_part in splitted_pdfs.items():
-            merger = PdfFileMerger()
-            output_dir = pathlib.Path(f"{html_part_tmpdir}")
-            page = html_to_pdf.PdfPage(output_dir)
-            page.convert(htmls_part)
-            app.exec()
-            pdfs_to_merge = page.get_pdfs_path()
-            for filename in pdfs_to_merge:
-                merger.append(str(filename))
-            with open(f"{pdf_file_name}", 'wb') as final_pdf:
-                merger.write(final_pdf)
-                logging.info("Merged pdf parts into %s", pdf_file_name)
+    """Record the html files the pdfs were rendered from"""
+    with transaction():
+        for html in htmls_file_path:
+            pdf_path = get_pdf_path(output_dir, html)
+            if pdf_path not in pdfs_file_path:
+                continue
+            html_stat = html.stat()
+            update_pdf_render(
+                html,
+                pdf_path,
+                html_stat.st_size,
+                html_stat.st_mtime,
+                get_file_hash(html),
+                settings
+            )
 
 
 def create_pdfs(
         output_dir: 'pathlib.Path',
         htmls_file_path: List['pathlib.Path'],
-) -> None:
-    """Create pdfs from a list of htmls"""
-    app = html_to_pdf.QtWidgets.QApplication([])
-    splitted_pdfs: Dict[str, List[pathlib.Path]] = {}
-    html_folder_path = output_dir / "risitas-html"
+        args,
+        before_render: Optional[Callable[[List[pathlib.Path]], None]] = None,
+) -> List['pathlib.Path']:
+    """
+    Create pdfs from a list of htmls, all the htmls of the output dir
+    if the list is empty, return the pdfs created.
+    The htmls whose pdf was rendered from the same content and settings
+    are skipped unless --force is given, before_render is called
+    with the htmls that will be rendered.
+    """
     if not htmls_file_path:
-        htmls_file_path = list(html_folder_path.glob("*.html"))
+        htmls_file_path = get_html_files(
+            output_dir,
+            not args.no_database,
+            args.scan_outputs
+        )
+    if args.no_database:
+        if before_render:
+            before_render(htmls_file_path)
+        return _create_pdfs(output_dir, htmls_file_path, args)
+    settings = get_render_settings(args)
+    if not args.force:
+        up_to_date = {
+            html for html in htmls_file_path
+            if pdf_is_up_to_date(output_dir, html, settings)
+        }
+        if up_to_date:
+            logging.info(
+                "Skipping %s html files whose pdf is up to date, "
+                "use --force to render them anyway", len(up_to_date)
+            )
+        htmls_file_path = [
+            html for html in htmls_file_path if html not in up_to_date
+        ]
+    if before_render:
+        before_render(htmls_file_path)
+    pdfs_file_path = _create_pdfs(output_dir, htmls_file_path, args)
+    record_pdf_renders(output_dir, htmls_file_path, pdfs_file_path, settings)
+    return pdfs_file_path
+
+
+def _create_pdfs(
+        output_dir: pathlib.Path,
+        htmls_file_path: List[pathlib.Path],
+        args,
+) -> List[pathlib.Path]:
+    """Render the pdfs of html files, big ones are splitted"""
+    splitted_pdfs: Dict[str, List[pathlib.Path]] = {}
+    pdfs_file_path: List[pathlib.Path] = []
+    small_htmls_file_path: List[pathlib.Path] = []
     with tempfile.TemporaryDirectory() as html_part_tmpdir:
+        if args.pdf_cache:
+            return create_cached_pdfs(
+                output_dir,
+                htmls_file_path,
+                html_part_tmpdir,
+                args
+            )
         for html in htmls_file_path:
-            if html_is_too_big(html):
-                logging.info(
-                    "The html file %s is too big and will be splitted "
-                    "into multiple parts, then pdfs will be created and "
-                    "merged back into one single pdf.", html
-                )
-                splitted_pdfs = splitted_pdfs | split_big_html(
-                    html,
-                    html_part_tmpdir,
-                    splitted_pdfs
-                )
-                htmls_file_path.remove(html)
+            if not html_is_too_big(html, args.pdf_part_size):
+                small_htmls_file_path.append(html)
+                continue
+            logging.info(
+                "The html file %s is too big and will be splitted "
+                "into multiple parts, then pdfs will be created and "
+                "merged back into one single pdf.", html
+            )
+            split_big_html(
+                html,
+                html_part_tmpdir,
+                splitted_pdfs,
+                output_dir,
+                args.pdf_part_size
+            )
         logging.debug("Splitted pdfs is %s", splitted_pdfs)
-        merge_pdfs(splitted_pdfs, html_part_tmpdir, app)
-    if htmls_file_path:
-        page = html_to_pdf.PdfPage(output_dir)
-        page.convert(htmls_file_path)
-        app.exec()
+        htmls_part = [
+            part for parts in splitted_pdfs.values() for part in parts
+        ]
+        # The parts are rendered in parallel even with one page per file
+        converted = render_pdfs(
+            pathlib.Path(html_part_tmpdir),
+            htmls_part,
+            args,
+            max(
+                args.pdf_workers,
+                min(len(htmls_part), os.cpu_count() or 1, 4)
+            )
+        )
+        pdfs_file_path += merge_pdfs(splitted_pdfs, converted)
+    converted = render_pdfs(output_dir, small_htmls_file_path, args)
+    pdfs_file_path += [
+        converted[html] for html in small_htmls_file_path
+        if html in converted
+    ]
+    return pdfs_file_path
 
 
-def read_links(links_file: pathlib.Path) -> List[str]:
-    """Get all the links in a text file."""
+def read_links(links_file: pathlib.Path) -> Iterator[str]:
+    """Yield the links of a text file, one line at a time."""
     links_file = links_file.expanduser().resolve()
     with open(links_file, encoding='utf-8') as file:
-        page_links = [line.strip() for line in file if line.strip() != '']
-    return page_links
+        for line in file:
+            if line.strip() != '':
+                yield line.strip()
 
 
-def get_args() -> argparse.Namespace:
-    """Parse arguments given on the command line"""
+def normalize_link(link: str) -> str:
+    """Strip the blanks and the anchor of a link"""
+    return link.strip().split("#")[0]
+
+
+def iter_topic_links(
+        page_links: Iterable[str],
+        shard: Optional[Tuple[int, int]] = None,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (topic_id, link) for each topic, the links pointing
+    to a topic already seen, without a topic id
+    or out of the shard are skipped.
+    """
+    seen = set()
+    for link in page_links:
+        link = normalize_link(link)
+        try:
+            topic_id = get_topic_id(link)
+        except IndexError:
+            logging.warning("Can't find the topic id of %s, skipping it", link)
+            continue
+        if shard and not is_in_shard(topic_id, shard):
+            continue
+        if topic_id in seen:
+            logging.debug("%s was already given, skipping it", link)
+            continue
+        seen.add(topic_id)
+        yield topic_id, link
+
+
+def _get_output_key(file_path: pathlib.Path) -> pathlib.Path:
+    """
+    Get the path of an output file relative to its folder and
+    without suffix, the html, pdf and epub of a risitas share it.
+    """
+    relative_path = pathlib.Path(*file_path.parts[1:])
+    return strip_compressed_suffix(relative_path).with_suffix("")
+
+
+def copy_node_files(
+        node_dir: pathlib.Path,
+        output_dir: pathlib.Path,
+        taken: List[Tuple[str, pathlib.Path, pathlib.Path]],
+) -> List[Tuple[pathlib.Path, Optional[str]]]:
+    """
+    Copy the html, pdf, epub and image files of another output dir,
+    the files missing are copied and the files of the risitas taken
+    from it replace the existing ones, under the name merge_db gave
+    to their html file.
+    Return the (file copied, topic_id) except images.
+    """
+    taken_keys = {
+        _get_output_key(node_html): (topic_id, _get_output_key(html))
+        for topic_id, node_html, html in taken
+    }
+    copied = []
+    for folder in OUTPUT_FOLDERS:
+        for file_path in sorted((node_dir / folder).rglob("*")):
+            relative_path = file_path.relative_to(node_dir)
+            # Temporary files, journals and the pdf cache stay on the node
+            if not file_path.is_file() or any(
+                    part.startswith(".") for part in relative_path.parts
+            ) or file_path.name.endswith(".journal"):
+                continue
+            key = _get_output_key(relative_path)
+            topic_id, taken_key = taken_keys.get(key, (None, key))
+            destination = (
+                output_dir / folder / taken_key.parent /
+                f"{taken_key.name}{file_path.name[len(key.name):]}"
+            )
+            if destination.exists() and topic_id is None:
+                continue
+            with open(file_path, "rb") as source, \
+                    atomic_write(destination) as file:
+                shutil.copyfileobj(source, file)
+            if relative_path.parts[1] != "images":
+                copied.append((destination, topic_id))
+    logging.info("Copied %d files from %s", len(copied), node_dir)
+    return copied
+
+
+@contextlib.contextmanager
+def open_jsonl_output(jsonl: Optional[str]) -> Iterator[Optional[TextIO]]:
+    """Open the file where the chapters are written as json lines"""
+    if not jsonl:
+        yield None
+    elif jsonl == "-":
+        yield sys.stdout
+    else:
+        jsonl_path = pathlib.Path(jsonl).expanduser().resolve()
+        with open(jsonl_path, "a", encoding="utf-8") as jsonl_file:
+            yield jsonl_file
+
+
+def write_jsonl_record(jsonl_file: TextIO, chapter: Chapter) -> None:
+    """Write a chapter as one json line, flushed right away"""
+    jsonl_file.write(json.dumps(chapter._asdict(), ensure_ascii=False))
+    jsonl_file.write("\n")
+    jsonl_file.flush()
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Build the command line parser"""
     parser = argparse.ArgumentParser()
     default_links = [pathlib.Path().cwd() / "risitas-links"]
     parser.add_argument(
@@ -337,6 +1048,358 @@ def get_args() -> argparse.Namespace:
             "Default : False"
         )
     )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        default=False,
+        help=(
+            "If set, new html files are gzip compressed (.html.gz), "
+            "compressed files are appended to and converted to pdf "
+            "like the others, "
+            "Default : False"
+        )
+    )
+    parser.add_argument(
+        "--sharded",
+        action="store_true",
+        default=False,
+        help=(
+            "If set, new html and pdf files are stored in subdirectories "
+            "of risitas-html and risitas-pdf named after the topic id, "
+            "useful for huge archives, "
+            "Default : False"
+        )
+    )
+    parser.add_argument(
+        "--jsonl",
+        nargs="?",
+        const="-",
+        default=None,
+        help=(
+            "Write each chapter as soon as it is accepted as a json line "
+            "(topic id, title, author, page, post cursor, html, text, "
+            "images) to the given file or to the standard output "
+            "if no file is given, "
+            "Default : None"
+        )
+    )
+    parser.add_argument(
+        "--epub",
+        action="store_true",
+        default=False,
+        help=(
+            "If set, an epub is also created for each risitas "
+            "in risitas-epub, this doesn't need Qt, "
+            "use it with --no-pdf to skip the pdfs, "
+            "Default : False"
+        )
+    )
+    # Search
+    parser.add_argument(
+        "--search",
+        action="store",
+        help=(
+            "Search the downloaded chapters for the given words "
+            "and print the best matches, see the sqlite fts5 syntax "
+            "for the queries"
+        )
+    )
+    parser.add_argument(
+        "--pdf-workers",
+        action="store",
+        type=int,
+        default=1,
+        help=(
+            "Number of html files converted to pdf at the same time, "
+            "each one is rendered in its own process by QWebEngine, "
+            "Default : 1"
+        )
+    )
+    parser.add_argument(
+        "--pdf-processes",
+        action="store",
+        type=int,
+        default=1,
+        help=(
+            "Number of processes converting html files to pdf, each one "
+            "has its own QApplication and --pdf-workers pages, "
+            "the biggest files are converted first, Default : 1"
+        )
+    )
+    parser.add_argument(
+        "--pdf-part-size",
+        action="store",
+        type=int,
+        default=3670016,
+        help=(
+            "Html files bigger than this size in bytes are splitted "
+            "between chapters into parts of at most this size, the pdfs "
+            "of the parts are merged back, Default : 3670016"
+        )
+    )
+    parser.add_argument(
+        "--pdf-cache",
+        action="store_true",
+        help=(
+            "Render the pdfs by fragments of a few chapters kept in "
+            "risitas-pdf/.cache, only the new fragments are rendered "
+            "when a topic gets new chapters, "
+            "Default : False"
+        )
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help=(
+            "Render the pdfs even if the html file and the settings "
+            "did not change since the last render, "
+            "Default : False"
+        )
+    )
+    parser.add_argument(
+        "--scan-outputs",
+        action="store_true",
+        help=(
+            "Find the html files to convert by listing the output dir "
+            "instead of reading the manifest, the files written without "
+            "the database are recorded, Default : False"
+        )
+    )
+    parser.add_argument(
+        "--cache-images",
+        action="store_true",
+        help=(
+            "Download the missing images of the htmls to "
+            "risitas-html/images before creating the pdfs, "
+            "the images are then loaded from there instead of the network, "
+            "Default : False"
+        )
+    )
+    parser.add_argument(
+        "--block-remote-images",
+        action="store_true",
+        help=(
+            "Don't let the pdf renderer fetch anything from the network, "
+            "the images not in risitas-html/images are left out, "
+            "Default : False"
+        )
+    )
+    parser.add_argument(
+        "--pdf-timeout",
+        action="store",
+        type=int,
+        default=300,
+        help=(
+            "Seconds after which the conversion of an html file is given "
+            "up and the next one is converted, 0 to wait forever, "
+            "Default : 300"
+        )
+    )
+    parser.add_argument(
+        "--pdf-recycle",
+        action="store",
+        type=int,
+        default=100,
+        help=(
+            "Replace a pdf page by a new one after it converted this "
+            "many files, to release the memory of its render process, "
+            "0 to never replace it, Default : 100"
+        )
+    )
+    parser.add_argument(
+        "--pdf-max-memory",
+        action="store",
+        type=int,
+        default=0,
+        help=(
+            "Replace a pdf page by a new one when its render process "
+            "uses more than this many MB, only on Linux where the memory "
+            "is read from /proc, 0 for no limit, Default : 0"
+        )
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help=(
+            "Check the pages already downloaded again, the html file is "
+            "rebuilt from the database if chapters were edited or deleted, "
+            "unchanged pages are revalidated with conditional requests, "
+            "Default : False"
+        )
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help=(
+            "Add the links to the job queue of the database instead of "
+            "downloading them, a topic is only queued once"
+        )
+    )
+    parser.add_argument(
+        "--priority",
+        action="store",
+        type=int,
+        default=0,
+        help=(
+            "Priority of the links enqueued, the highest are "
+            "downloaded first, Default : 0"
+        )
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help=(
+            "Download the topics of the job queue until it is empty, "
+            "several workers can run at the same time"
+        )
+    )
+    parser.add_argument(
+        "--lease-timeout",
+        action="store",
+        type=int,
+        default=3600,
+        help=(
+            "Seconds after which a job taken by a worker that didn't "
+            "finish it can be taken by another worker, the lease is "
+            "renewed while the job is downloaded, Default : 3600"
+        )
+    )
+    parser.add_argument(
+        "--max-attempts",
+        action="store",
+        type=int,
+        default=3,
+        help=(
+            "Number of times the lease of a job can expire before the job "
+            "is failed, Default : 3"
+        )
+    )
+    parser.add_argument(
+        "--queue-status",
+        action="store_true",
+        help="Print the number of jobs by state and the last failures"
+    )
+    parser.add_argument(
+        "--queue-retry",
+        action="store_true",
+        help="Queue the failed jobs again"
+    )
+    parser.add_argument(
+        "--shard",
+        action="store",
+        type=parse_shard,
+        help=(
+            "Only download or enqueue the topics of the shard i out of N, "
+            "given as i/N, the topics are spread by a hash of their id"
+        )
+    )
+    parser.add_argument(
+        "--database",
+        action="store",
+        type=lambda p: pathlib.Path(p).expanduser().resolve(),
+        help=(
+            "The database to use instead of the one in the "
+            "user data directory"
+        )
+    )
+    parser.add_argument(
+        "--merge",
+        action="store",
+        nargs="+",
+        type=lambda p: pathlib.Path(p).expanduser().resolve(),
+        help=(
+            "Merge the output dirs of other nodes, each with its database "
+            "in risiparse.db, into the output dir and the database, "
+            "a risitas is taken from the node where it is the furthest"
+        )
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Keep checking the risitas of the links, a risitas is only "
+            "downloaded again when its last page changed, the risitas "
+            "that change often are checked more often, it needs the "
+            "database, Default : False"
+        )
+    )
+    parser.add_argument(
+        "--watch-min-interval",
+        action="store",
+        type=int,
+        default=600,
+        help=(
+            "Seconds between two checks of a risitas that keeps "
+            "changing, Default : 600"
+        )
+    )
+    parser.add_argument(
+        "--watch-max-interval",
+        action="store",
+        type=int,
+        default=604800,
+        help=(
+            "Seconds between two checks of a risitas that doesn't "
+            "change anymore, Default : 604800 (a week)"
+        )
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help=(
+            "Serve an http api on localhost to submit links, follow "
+            "their jobs and fetch their files, the jobs are processed "
+            "by this process"
+        )
+    )
+    parser.add_argument(
+        "--port",
+        action="store",
+        type=int,
+        default=8765,
+        help="Port of the http api, Default : 8765"
+    )
+    parser.add_argument(
+        "--discover",
+        action="store_true",
+        help=(
+            "Crawl the topic listings of the 18-25 forum on jeuxvideo.com "
+            "and jvarchive.com and enqueue the new risitas, it stops at "
+            "the listing pages already seen"
+        )
+    )
+    parser.add_argument(
+        "--discover-pages",
+        action="store",
+        type=int,
+        default=20,
+        help=(
+            "Maximum number of listing pages crawled on each site, "
+            "Default : 20"
+        )
+    )
+    parser.add_argument(
+        "--discover-workers",
+        action="store",
+        type=int,
+        default=4,
+        help=(
+            "Number of listing pages downloaded at the same time, "
+            "Default : 4"
+        )
+    )
+    # Rebuild html files from the database
+    parser.add_argument(
+        "--rebuild-html",
+        action="store_true",
+        default=False,
+        help=(
+            "If set, the html files of the risitas in the database "
+            "are rewritten from the chapters stored in the database, "
+            "nothing is downloaded, "
+            "Default : False"
+        )
+    )
     # Output dir
     parser.add_argument(
         '-o',
@@ -346,13 +1409,19 @@ def get_args() -> argparse.Namespace:
         default=pathlib.Path.cwd(),
         type=lambda p: pathlib.Path(p).expanduser().resolve()
     )
-    args = parser.parse_args()
-    return args
+    return parser
 
 
-def contains_webarchive(archive_link: str) -> bool:
-    """Check if link domain is webarchive"""
-    return bool("web.archive.org" in archive_link)
+def get_args() -> argparse.Namespace:
+    """Parse arguments given on the command line"""
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.watch and args.no_database:
+        parser.error(
+            "--watch can't be used with --no-database, the state of the "
+            "pages checked is kept in the database"
+        )
+    return args
 
 
 def replace_youtube_embed(youtube_link: str) -> str:
@@ -370,14 +1439,6 @@ def replace_youtube_embed(youtube_link: str) -> str:
     return youtube_link
 
 
-def strip_webarchive_link(archive_link: str) -> str:
-    """Remove the webarchive part to get the clean jeuxvideo.com link"""
-    archive_link_parsed = urlparse(archive_link)
-    splitted_link = archive_link_parsed.geturl().split("/")[5:]
-    new_link = "/".join(splitted_link)
-    return new_link
-
-
 def replace_youtube_frames(soup: 'BeautifulSoup') -> 'BeautifulSoup':
     """Replace youtube frames by the link of the video"""
     for page in soup:
@@ -397,11 +1458,11 @@ def replace_youtube_frames(soup: 'BeautifulSoup') -> 'BeautifulSoup':
     return soup
 
 
-def parse_input_links(links: List[str]) -> List[str]:
+def parse_input_links(links: List[str]) -> Iterable[str]:
     """Parse the links given on the command line."""
     links_file = pathlib.Path(links[0])
     if len(links) == 1 and links_file.exists():
-        page_links = read_links(links_file)
+        page_links: Iterable[str] = read_links(links_file)
     else:
         page_links = links
     return page_links
@@ -420,15 +1481,8 @@ def replace_webarchive_youtube_frame(
     return risitas_html
 
 
-def write_html_template(
-        html_file,
-        begin: bool = False,
-        end: bool = False,
-) -> None:
-    """Write html template"""
-    if begin:
-        html = (
-            """<!DOCTYPE html>
+HTML_BEGIN_TEMPLATE = (
+    """<!DOCTYPE html>
             <html lang='fr'>
             <head>
             <meta charset='UTF-8'>
@@ -437,10 +1491,262 @@ def write_html_template(
             <title>Risitas</title>
             </head>
             <body>"""
-        )
-    elif end:
-        html = (
-            """</body>
+)
+
+HTML_END_TEMPLATE = (
+    """</body>
               </html>"""
-        )
+)
+
+GZIP_MAGIC = b"\x1f\x8b\x08"
+
+
+def write_html_template(
+        html_file,
+        begin: bool = False,
+        end: bool = False,
+) -> None:
+    """Write html template"""
+    if begin:
+        html = HTML_BEGIN_TEMPLATE
+    elif end:
+        html = HTML_END_TEMPLATE
     html_file.write(html)
+
+
+def is_compressed(html: pathlib.Path) -> bool:
+    """Check if an html file is gzip compressed"""
+    return bool(html.suffix == ".gz")
+
+
+def strip_compressed_suffix(html: pathlib.Path) -> pathlib.Path:
+    """Get the html file path without the .gz suffix"""
+    if is_compressed(html):
+        return html.with_suffix("")
+    return html
+
+
+def read_html_text(html: pathlib.Path) -> str:
+    """Read an html file, compressed or not"""
+    if is_compressed(html):
+        with gzip.open(html, "rt", encoding="utf-8") as html_file:
+            return html_file.read()
+    return html.read_text(encoding="utf-8")
+
+
+def get_html_size(html: pathlib.Path) -> int:
+    """
+    Get the uncompressed size of an html file, a compressed file
+    is only decompressed again once it has changed.
+    """
+    stat = html.stat()
+    if not is_compressed(html):
+        return stat.st_size
+    return _get_gzip_size(html, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_gzip_size(
+        html: pathlib.Path,
+        mtime_ns: int,  # pylint: disable=unused-argument
+        size: int,  # pylint: disable=unused-argument
+) -> int:
+    """Decompress a gzip file to get its size, cached by mtime and size"""
+    uncompressed_size = 0
+    with gzip.open(html, "rb") as html_file:
+        while chunk := html_file.read(1 << 20):
+            uncompressed_size += len(chunk)
+    return uncompressed_size
+
+
+def _write_gzip_member(file, parts: Iterable[str]) -> None:
+    """
+    Write the parts as a new gzip member at the current position,
+    concatenated members are read back as a single stream.
+    """
+    with gzip.GzipFile(fileobj=file, mode="wb", mtime=0) as gzip_file:
+        for part in parts:
+            gzip_file.write(part.encode("utf-8"))
+
+
+def write_html_file(
+        html: pathlib.Path,
+        chapters: Iterable[str],
+) -> None:
+    """
+    Write the chapters in a new html file, if the file name ends
+    with .gz, it is compressed and the end template is written as its
+    own gzip member so that chapters can be appended later.
+    The file is replaced atomically once fully written.
+    """
+    if is_compressed(html):
+        with atomic_write(html, "wb") as file:
+            _write_gzip_member(
+                file,
+                itertools.chain([HTML_BEGIN_TEMPLATE], chapters)
+            )
+            _write_gzip_member(file, [HTML_END_TEMPLATE])
+        return
+    with atomic_write(html, "w", encoding="utf-8") as html_file:
+        write_html_template(html_file, begin=True, end=False)
+        for chapter in chapters:
+            html_file.write(chapter)
+        write_html_template(html_file, begin=False, end=True)
+
+
+def _find_compressed_body_end_offset(html: pathlib.Path) -> int:
+    """
+    Find the offset of the gzip member holding the end template,
+    only the tail of the file is read.
+    """
+    size = html.stat().st_size
+    with open(html, "rb") as file:
+        file.seek(max(0, size - 1024))
+        tail = file.read()
+    tail_offset = size - len(tail)
+    member_offset = tail.rfind(GZIP_MAGIC)
+    while member_offset != -1:
+        try:
+            member = gzip.decompress(tail[member_offset:])
+            if member.decode("utf-8") == HTML_END_TEMPLATE:
+                return tail_offset + member_offset
+        except (OSError, EOFError, UnicodeDecodeError, zlib.error):
+            pass
+        member_offset = tail.rfind(GZIP_MAGIC, 0, member_offset)
+    return -1
+
+
+def _split_compressed_end_template(html: pathlib.Path) -> int:
+    """
+    Rewrite a compressed html file whose end template is not in its own
+    gzip member, return the offset of the new end template member.
+    """
+    logging.warning(
+        "The end of %s is not in its own gzip member, rewriting it", html
+    )
+    text = read_html_text(html)
+    body_end = text.rfind("</body>")
+    if body_end == -1:
+        body_end = len(text)
+    with atomic_write(html, "wb") as file:
+        _write_gzip_member(file, [text[:body_end]])
+        offset = file.tell()
+        _write_gzip_member(file, [HTML_END_TEMPLATE])
+    return offset
+
+
+def find_body_end_offset(html: pathlib.Path) -> int:
+    """
+    Find the byte offset of the closing body tag, the file is memory
+    mapped and searched backward so only its tail is actually read.
+    For a compressed file, this is the offset of the end template member.
+    """
+    size = html.stat().st_size
+    if not size:
+        return 0
+    if is_compressed(html):
+        offset = _find_compressed_body_end_offset(html)
+        if offset == -1:
+            offset = _split_compressed_end_template(html)
+        return offset
+    with open(html, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = data.rfind(b"</body>")
+    if offset == -1:
+        logging.warning("No closing body tag found in %s", html)
+        return size
+    return offset
+
+
+def _get_append_journal_path(html: pathlib.Path) -> pathlib.Path:
+    return html.with_name(f"{html.name}.journal")
+
+
+def _rewrite_html_tail(
+        html: pathlib.Path,
+        offset: int,
+        chapters: Iterable[str],
+) -> None:
+    """Replace everything after offset by the chapters and the end template"""
+    with open(html, "r+b") as file:
+        file.seek(offset)
+        file.truncate()
+        if is_compressed(html):
+            if chapters:
+                _write_gzip_member(file, chapters)
+            _write_gzip_member(file, [HTML_END_TEMPLATE])
+            file.flush()
+            os.fsync(file.fileno())
+            return
+        with io.TextIOWrapper(file, encoding="utf-8") as html_file:
+            for chapter in chapters:
+                html_file.write(chapter)
+            write_html_template(html_file, begin=False, end=True)
+            html_file.flush()
+            os.fsync(file.fileno())
+
+
+def rollback_interrupted_append(
+        html: pathlib.Path,
+        committed: Optional[Tuple[int, int]] = None,
+) -> None:
+    """
+    If a journal is left next to the html file, the last append
+    did not complete, so the file is truncated back to its previous end.
+    If the journal holds the page and post cursor the append was made
+    for and they are the committed ones, the append is kept.
+    A journal that can't be read was never fully written, so the html
+    file wasn't touched yet.
+    """
+    journal = _get_append_journal_path(html)
+    if not journal.exists():
+        return
+    try:
+        state = json.loads(journal.read_text(encoding="utf-8"))
+        offset = int(state["offset"])
+    except (ValueError, KeyError, TypeError):
+        logging.warning(
+            "The journal of %s is unreadable, the append never started", html
+        )
+        journal.unlink()
+        return
+    if committed and [state.get("page"), state.get("post_cursor")] == list(
+            committed
+    ):
+        logging.info("The last append to %s was committed", html)
+        journal.unlink()
+        return
+    logging.warning(
+        "The last append to %s was interrupted, rolling it back", html
+    )
+    _rewrite_html_tail(html, offset, [])
+    journal.unlink()
+
+
+def complete_html_append(html: pathlib.Path) -> None:
+    """Remove the journal of an append once its state is committed"""
+    _get_append_journal_path(html).unlink(missing_ok=True)
+
+
+def append_to_html_file(
+        html: pathlib.Path,
+        chapters: Iterable[str],
+        state: Optional[Tuple[int, int]] = None,
+) -> None:
+    """
+    Append chapters to an html file in place, only the end template is
+    rewritten. The offset where it starts is saved in a journal first
+    so that an interrupted append can be rolled back.
+    If the page and post cursor of the append are given, the journal is
+    kept until complete_html_append is called once they are committed.
+    """
+    rollback_interrupted_append(html)
+    offset = find_body_end_offset(html)
+    journal = _get_append_journal_path(html)
+    journal_state = {"offset": offset}
+    if state:
+        journal_state["page"], journal_state["post_cursor"] = state
+    atomic_write_text(journal, json.dumps(journal_state))
+    _rewrite_html_tail(html, offset, chapters)
+    if not state:
+        journal.unlink()
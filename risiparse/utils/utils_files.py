@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+
+"""Regroup the file routines that are safe between several processes"""
+
+from typing import Collection, Iterator
+import contextlib
+import functools
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+# Longest wait between two attempts to take a lock on Windows, in seconds
+LOCK_MAX_DELAY = 2
+
+
+@functools.lru_cache(maxsize=None)
+def get_umask() -> int:
+    """Get the umask of the process, read once when first needed"""
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+@contextlib.contextmanager
+def file_lock(lock_path: pathlib.Path) -> Iterator[None]:
+    """
+    Hold an exclusive lock on a file, other processes
+    wait until it is released.
+    """
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+b") as lock_file:
+        if sys.platform == "win32":
+            # LK_LOCK already retries every second, LK_NBLCK fails at once
+            # and the wait is spaced out while the lock is held
+            delay = 0.05
+            while True:
+                try:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(delay)
+                    delay = min(delay * 2, LOCK_MAX_DELAY)
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def atomic_write(file_path: pathlib.Path, mode: str = "wb", **kwargs):
+    """
+    Write a file under a temporary name in the same directory, it
+    replaces file_path only once fully written, so other processes
+    see either the previous file or the new one.
+    """
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=file_path.parent,
+        prefix=f".{file_path.name}.",
+        suffix=".tmp"
+    )
+    try:
+        with open(fd, mode, **kwargs) as file:
+            # Temporary files are created readable only by the user,
+            # the files written get the usual permissions instead.
+            os.chmod(tmp_path, 0o666 & ~get_umask())
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        pathlib.Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_bytes(file_path: pathlib.Path, data: bytes) -> None:
+    """Write bytes to a file atomically"""
+    with atomic_write(file_path, "wb") as file:
+        file.write(data)
+
+
+def atomic_write_text(file_path: pathlib.Path, text: str) -> None:
+    """Write text to a file atomically"""
+    with atomic_write(file_path, "w", encoding="utf-8") as file:
+        file.write(text)
+
+
+def reserve_file(file_path: pathlib.Path) -> bool:
+    """
+    Create an empty file if it doesn't exist, return False if it
+    already exists, only one process can reserve a name.
+    """
+    try:
+        fd = os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    return True
+
+
+def reserve_numbered_file(
+        directory: pathlib.Path,
+        prefix: str,
+        suffix: str,
+        taken_names: Collection[str] = (),
+) -> pathlib.Path:
+    """
+    Reserve the first free name prefix-i.suffix of a directory,
+    the names in taken_names are skipped even if there is no such file.
+    """
+    i = 0
+    while True:
+        file_path = directory / f"{prefix}-{i}.{suffix}"
+        if file_path.name not in taken_names and reserve_file(file_path):
+            return file_path
+        i += 1
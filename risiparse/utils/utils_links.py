@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+
+"""
+Regroup the routines on topic links, this module imports nothing
+from risiparse so that every other module can use it.
+"""
+
+from urllib.parse import urlparse
+import re
+
+
+def contains_webarchive(archive_link: str) -> bool:
+    """Check if link domain is webarchive"""
+    return bool("web.archive.org" in archive_link)
+
+
+def strip_webarchive_link(archive_link: str) -> str:
+    """Remove the webarchive part to get the clean jeuxvideo.com link"""
+    archive_link_parsed = urlparse(archive_link)
+    splitted_link = archive_link_parsed.geturl().split("/")[5:]
+    new_link = "/".join(splitted_link)
+    return new_link
+
+
+def get_topic_id(link: str) -> str:
+    """
+    Get the canonical id of a topic, the same topic on jeuxvideo.com
+    and jvarchive.com shares the same id, on webarchive this is
+    the risific slug.
+    """
+    if contains_webarchive(link):
+        risific_link = urlparse(strip_webarchive_link(link))
+        return risific_link.path.strip("/").split("/")[0]
+    link_numbers = re.findall(r"\d*\d", link)
+    return link_numbers[2]
@@ -7,7 +7,7 @@ import pathlib
 import re
 
 from bs4 import BeautifulSoup
-from .utils import strip_webarchive_link, contains_webarchive
+from .utils_links import strip_webarchive_link, contains_webarchive
 
 
 def change_img_src_path(
@@ -19,6 +19,11 @@ def change_img_src_path(
     img.attrs["src"] = str(img_folder_path) + "/" + file_name
 
 
+def get_image_file_name(link: str) -> str:
+    """Get the name of an image in the image folder from its link"""
+    return link[link.rfind("/"):][1:]
+
+
 def image_exists(
     file_name: str,
     img_folder: pathlib.Path
@@ -2,13 +2,55 @@
 
 """Regroup all posts related utils"""
 
-from typing import List
+from typing import List, NamedTuple
+import hashlib
 import logging
 import re
 
 from bs4 import BeautifulSoup, Tag
 
 
+class Chapter(NamedTuple):
+    """A post that has been accepted as part of a risitas"""
+    topic_id: str
+    title: str
+    author: str
+    page: int
+    post_cursor: int
+    html: str
+    text: str
+    contains_image: bool
+    image_urls: List[str]
+
+
+def get_text_hash(text: str) -> str:
+    """Hash the text of a post, used to compare chapters"""
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
+def get_page_content_hash(
+        posts: List[Tag],
+        text_selector: str,
+) -> str:
+    """
+    Hash the messages of the posts of a page, the rest
+    of the page changes on every request.
+    """
+    page_hash = hashlib.sha256()
+    for post in posts:
+        message = post.select_one(text_selector)
+        page_hash.update(str(message or post).encode("utf-8"))
+    return page_hash.hexdigest()
+
+
+def get_image_urls(risitas_html: BeautifulSoup) -> List[str]:
+    """Get the src of all images in a post"""
+    return [
+        img.attrs["src"] for img in risitas_html.select("img")
+        if img.attrs.get("src")
+    ]
+
+
 def check_post_length(post: BeautifulSoup) -> bool:
     """Check the post length to see if this is a chapter
     or an offtopic post"""
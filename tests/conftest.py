@@ -1 +1,97 @@
 #!/usr/bin/python3
+
+import hashlib
+
+from bs4 import BeautifulSoup
+import pytest
+
+import risiparse.risiparse as risiparse
+import risiparse.utils.database as database
+from risiparse.utils.utils import get_parser, make_app_dirs
+
+FORUM_LINK = (
+    "https://www.jeuxvideo.com/forums/42-51-74793440-1-0-1-0-risitas.htm"
+)
+
+
+def chapter_text(number):
+    """A post long enough to be a chapter"""
+    return f"Chapitre {number} " + "la suite " * 150
+
+
+class Forum():
+    """A jeuxvideo.com topic served without the network"""
+
+    def __init__(self):
+        self.pages = []
+        self.downloads = []
+        # Page number whose download raises, once
+        self.fail_at = None
+
+    def add_page(self, *posts):
+        """Add a page of (author, text) posts"""
+        self.pages.append(list(posts))
+
+    def get_soup(self, page_number):
+        posts = "".join(
+            '<div class="conteneur-message">'
+            f'<div class="bloc-header"><span>{author}</span></div>'
+            f'<div class="txt-msg text-enrichi-forum"><p>{text}</p></div>'
+            '</div>'
+            for author, text in self.pages[page_number - 1]
+        )
+        pages = "".join(
+            f"<span>{number}</span>"
+            for number in range(1, len(self.pages) + 1)
+        )
+        return (
+            '<html><head><title>Titre</title></head><body>'
+            '<div id="bloc-title-forum">Titre</div>'
+            '<div class="bloc-pseudo-msg">auteur</div>'
+            f'<div class="bloc-liste-num-page">{pages}</div>'
+            f'{posts}</body></html>'
+        )
+
+    def download_topic_page(
+            self,
+            page_downloader,
+            page_link,
+            page_number=1,
+            validators=None,
+    ):
+        if page_number == self.fail_at:
+            self.fail_at = None
+            raise ConnectionError(f"page {page_number}")
+        self.downloads.append(page_number)
+        html = self.get_soup(page_number)
+        etag = f'"{hashlib.sha1(html.encode()).hexdigest()}"'
+        page_downloader.not_modified = bool(
+            validators and validators[0] == etag
+        )
+        page_downloader.etag = etag
+        page_downloader.last_modified = None
+        if page_downloader.not_modified:
+            return None
+        return BeautifulSoup(html, features="lxml")
+
+
+@pytest.fixture
+def forum(monkeypatch, tmp_path):
+    """A topic of jeuxvideo.com and the args to download it to tmp_path"""
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / "risiparse.db")
+    fake_forum = Forum()
+
+    def download_topic_page(self, page_link, page_number=1, validators=None):
+        return fake_forum.download_topic_page(
+            self, page_link, page_number, validators
+        )
+
+    monkeypatch.setattr(
+        risiparse.PageDownloader,
+        "download_topic_page",
+        download_topic_page
+    )
+    fake_forum.args = get_parser().parse_args(["-o", f"{tmp_path}"])
+    make_app_dirs(tmp_path)
+    yield fake_forum
+    database.close_db()
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+
+from risiparse.api import iter_chapters, aiter_chapters
+import risiparse.utils.database as database
+import asyncio
+import itertools
+import pytest
+
+@pytest.mark.parametrize(
+    "test_link,expected_author",
+    [
+        ("https://www.jeuxvideo.com/forums/42-51-67052724-1-0-1-0-risitas-un-celestin-a-istanbul.htm", "turkissou"),
+        ("https://jvarchive.com/forums/42-51-66574499-1-0-1-0-risitas-au-bout-du-monde-un-khey-au-japon", "cybercuck1997"),
+    ],
+)
+def test_iter_chapters(monkeypatch, tmp_path, test_link, expected_author):
+    # Anything written would land in tmp_path
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / "risiparse.db")
+    chapters = list(itertools.islice(iter_chapters(test_link), 3))
+    assert len(chapters) == 3
+    assert expected_author in chapters[0].author.lower()
+    assert chapters[0].page == 1
+    assert chapters[0].text
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize(
+    "test_link,expected_author",
+    [
+        ("https://www.jeuxvideo.com/forums/42-51-67052724-1-0-1-0-risitas-un-celestin-a-istanbul.htm", "turkissou"),
+    ],
+)
+def test_aiter_chapters(test_link, expected_author):
+    async def first_chapter():
+        async for chapter in aiter_chapters(test_link):
+            return chapter
+    chapter = asyncio.run(first_chapter())
+    assert expected_author in chapter.author.lower()
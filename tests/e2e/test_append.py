@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+import risiparse.utils.utils as utils
+from risiparse.utils.utils import (
+    append_to_html_file,
+    complete_html_append,
+    get_html_size,
+    read_html_text,
+    rollback_interrupted_append,
+    write_html_file,
+)
+
+import pytest
+
+
+def chapters_of(html):
+    text = read_html_text(html)
+    return text[text.index("<body>") + 6:text.index("</body>")]
+
+
+@pytest.mark.parametrize("name", ["titre.html", "titre.html.gz"])
+def test_append(tmp_path, name):
+    html = tmp_path / name
+    write_html_file(html, ["<p>un</p>"])
+    append_to_html_file(html, ["<p>deux</p>"])
+    append_to_html_file(html, ["<p>trois</p>"])
+    assert chapters_of(html) == "<p>un</p><p>deux</p><p>trois</p>"
+    assert read_html_text(html).endswith("</html>")
+    assert not list(tmp_path.glob("*.journal"))
+
+
+@pytest.mark.parametrize("name", ["titre.html", "titre.html.gz"])
+def test_rollback(tmp_path, name):
+    html = tmp_path / name
+    journal = tmp_path / f"{name}.journal"
+    write_html_file(html, ["<p>un</p>"])
+    # The journal is kept until the state of the append is committed
+    append_to_html_file(html, ["<p>deux</p>"], (2, 5))
+    assert journal.exists()
+    rollback_interrupted_append(html, (1, 0))
+    assert chapters_of(html) == "<p>un</p>"
+    assert not journal.exists()
+    append_to_html_file(html, ["<p>deux</p>"], (2, 5))
+    rollback_interrupted_append(html, (2, 5))
+    assert chapters_of(html) == "<p>un</p><p>deux</p>"
+    assert not journal.exists()
+    # An append without a committed state is rolled back by the next one
+    append_to_html_file(html, ["<p>perdu</p>"], (3, 1))
+    append_to_html_file(html, ["<p>trois</p>"], (3, 2))
+    complete_html_append(html)
+    assert chapters_of(html) == "<p>un</p><p>deux</p><p>trois</p>"
+
+
+@pytest.mark.parametrize("content", ["", '{"offset": ', "[]"])
+def test_unreadable_journal(tmp_path, content):
+    html = tmp_path / "titre.html"
+    journal = tmp_path / "titre.html.journal"
+    write_html_file(html, ["<p>un</p>"])
+    journal.write_text(content)
+    rollback_interrupted_append(html)
+    assert chapters_of(html) == "<p>un</p>"
+    assert not journal.exists()
+    append_to_html_file(html, ["<p>deux</p>"])
+    assert chapters_of(html) == "<p>un</p><p>deux</p>"
+
+
+def test_html_size(tmp_path):
+    html = tmp_path / "titre.html.gz"
+    write_html_file(html, ["<p>un</p>"])
+    size = len(read_html_text(html).encode("utf-8"))
+    assert get_html_size(html) == size
+    # The size of a file that didn't change isn't decompressed again
+    hits = utils._get_gzip_size.cache_info().hits
+    assert get_html_size(html) == size
+    assert utils._get_gzip_size.cache_info().hits == hits + 1
+    append_to_html_file(html, ["<p>deux</p>"])
+    assert get_html_size(html) == len(read_html_text(html).encode("utf-8"))
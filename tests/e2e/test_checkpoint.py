@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+import pytest
+
+import risiparse.risiparse as risiparse
+from risiparse.risiparse import download_topic
+from risiparse.utils.utils import read_html_text
+import risiparse.utils.database as database
+
+from tests.conftest import FORUM_LINK, chapter_text
+
+TOPIC_ID = "74793440"
+
+
+def add_chapter_pages(forum, numbers):
+    for number in numbers:
+        if forum.pages:
+            # A page is full before the next one is opened
+            forum.pages[-1].append(("lecteur", "La suite ?"))
+        forum.add_page(("auteur", chapter_text(number)))
+
+
+def count_chapters(html, numbers):
+    text = read_html_text(html)
+    return [text.count(chapter_text(number)) for number in numbers]
+
+
+def test_resume_after_failed_page(forum):
+    add_chapter_pages(forum, range(1, 4))
+    forum.fail_at = 3
+    with pytest.raises(ConnectionError):
+        download_topic(FORUM_LINK, forum.args)
+    assert database.read_checkpoint(TOPIC_ID)[:2] == (2, 0)
+    assert not database.read_db(FORUM_LINK)
+    # The pages before the checkpoint are not downloaded again
+    forum.downloads.clear()
+    html = download_topic(FORUM_LINK, forum.args)
+    assert forum.downloads == [1, 3]
+    assert count_chapters(html, range(1, 4)) == [1, 1, 1]
+    assert not database.read_checkpoint(TOPIC_ID)
+    assert database.read_db(FORUM_LINK)[4] == 3
+
+
+def test_resume_at_last_page(forum, monkeypatch):
+    add_chapter_pages(forum, range(1, 3))
+    write_html = risiparse.RisitasHtmlFile.append_to_or_write_html_file
+
+    def fail_write(self, append_to_html, state=None):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(
+        risiparse.RisitasHtmlFile,
+        "append_to_or_write_html_file",
+        fail_write
+    )
+    with pytest.raises(OSError):
+        download_topic(FORUM_LINK, forum.args)
+    assert database.read_checkpoint(TOPIC_ID)[0] == 2
+    monkeypatch.setattr(
+        risiparse.RisitasHtmlFile,
+        "append_to_or_write_html_file",
+        write_html
+    )
+    # Every page was processed, only the html file is left to write
+    forum.downloads.clear()
+    html = download_topic(FORUM_LINK, forum.args)
+    assert forum.downloads == [1]
+    assert count_chapters(html, range(1, 3)) == [1, 1]
+    assert not database.read_checkpoint(TOPIC_ID)
+
+
+def test_uncommitted_append(forum, monkeypatch):
+    add_chapter_pages(forum, range(1, 3))
+    html = download_topic(FORUM_LINK, forum.args)
+    add_chapter_pages(forum, [3])
+    update_db = risiparse.update_db
+
+    def fail_update_db(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(risiparse, "update_db", fail_update_db)
+    with pytest.raises(OSError):
+        download_topic(FORUM_LINK, forum.args)
+    # The append reached the html file but the database didn't
+    assert count_chapters(html, [3]) == [1]
+    assert html.with_name(f"{html.name}.journal").exists()
+    assert database.read_db(FORUM_LINK)[4] == 2
+    monkeypatch.setattr(risiparse, "update_db", update_db)
+    assert download_topic(FORUM_LINK, forum.args) == html
+    assert count_chapters(html, range(1, 4)) == [1, 1, 1]
+    assert not html.with_name(f"{html.name}.journal").exists()
+    assert database.read_db(FORUM_LINK)[4] == 3
+
+
+def test_committed_append(forum, monkeypatch):
+    add_chapter_pages(forum, range(1, 3))
+    html = download_topic(FORUM_LINK, forum.args)
+    add_chapter_pages(forum, [3])
+    complete_html_append = risiparse.complete_html_append
+    # Interrupted once the database committed, before the journal removal
+    monkeypatch.setattr(risiparse, "complete_html_append", lambda html: None)
+    assert download_topic(FORUM_LINK, forum.args) == html
+    assert html.with_name(f"{html.name}.journal").exists()
+    monkeypatch.setattr(
+        risiparse,
+        "complete_html_append",
+        complete_html_append
+    )
+    assert download_topic(FORUM_LINK, forum.args) is None
+    assert count_chapters(html, range(1, 4)) == [1, 1, 1]
+    assert not html.with_name(f"{html.name}.journal").exists()
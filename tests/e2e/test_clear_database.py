@@ -16,6 +16,7 @@ def test_clear_database(monkeypatch, tmp_path, caplog):
     database_path.write_text("This is a test database for risiparse")
     testargs = [
         f"{SCRIPT}",
+        "-o", f"{tmpdir}",
         "--clear-database"
     ]
     monkeypatch.setattr(sys, 'argv', testargs)
@@ -26,3 +27,5 @@ def test_clear_database(monkeypatch, tmp_path, caplog):
     last_message = caplog.records[-1].getMessage()
     assert "Deleted database" in last_message
     assert not database_path.exists()
+    # The log file is written to the output directory
+    assert list(tmpdir.glob("risiparse-*.log"))
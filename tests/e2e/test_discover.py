@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+from risiparse.discover import discover_topics
+from risiparse.risiparse import PageDownloader, discover_risitas
+from risiparse.sites_selectors import Jvc
+from risiparse.utils.utils import get_parser
+import risiparse.utils.database as database
+
+from bs4 import BeautifulSoup
+
+
+def listing_page(offset):
+    topics = "".join(
+        f'<li><a class="topic-title" title="{title}" '
+        f'href="/forums/42-51-{topic_id}-1-0-1-0-a.htm">{title}</a>'
+        f'<span class="topic-count">{replies}</span></li>'
+        for topic_id, title, replies in [
+            (1000 + offset, "[RISITAS] Un celestin a Istanbul", 45),
+            (2000 + offset, "Un topic comme un autre", 3),
+        ]
+    )
+    return BeautifulSoup(
+        f'<ul class="topic-list"><li class="topic-head"></li>{topics}</ul>',
+        features="lxml"
+    )
+
+
+def patch_listing_pages(monkeypatch):
+    downloaded = []
+
+    def download_listing_page(self, listing_link):
+        downloaded.append(listing_link)
+        return listing_page(int(listing_link.split("-")[5]))
+
+    monkeypatch.setattr(
+        PageDownloader,
+        "download_listing_page",
+        download_listing_page
+    )
+    return downloaded
+
+
+def test_discover(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / "risiparse.db")
+    downloaded = patch_listing_pages(monkeypatch)
+    risitas = discover_topics(Jvc, 4, 2)
+    assert len(downloaded) == 4
+    assert [topic.topic_id for topic in risitas] == [
+        "1001", "1026", "1051", "1076"
+    ]
+    assert risitas[0].link == (
+        "https://www.jeuxvideo.com/forums/42-51-1001-1-0-1-0-a.htm"
+    )
+    assert risitas[0].total_pages == 3
+    downloaded.clear()
+    assert discover_topics(Jvc, 4, 2) == []
+    assert len(downloaded) == 2
+
+
+def test_discover_enqueue(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / "risiparse.db")
+    patch_listing_pages(monkeypatch)
+    args = get_parser().parse_args(
+        ["-o", f"{tmp_path}", "--discover", "--discover-pages", "1"]
+    )
+    assert discover_risitas(args) == 1
+    # The total pages of the listing are kept with the job
+    job = database.read_job("1001")
+    assert job[3] == "queued"
+    assert job[10] == 3
@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+
+from risiparse.risiparse import main
+import sys
+import pathlib
+import zipfile
+import pytest
+
+SCRIPT = pathlib.Path(__file__).parent / "risiparse" / "risiparse.py"
+
+@pytest.mark.parametrize(
+    "test_link",
+    [
+        ("https://www.jeuxvideo.com/forums/42-51-67616891-1-0-1-0-risitas-comment-j-ai-couche-avec-une-milf-ce-dimanche.htm")
+    ],
+)
+def test_epub(monkeypatch, tmp_path, caplog, test_link):
+    tmpdir = tmp_path
+    tmpdir.mkdir(exist_ok=True)
+    testargs = [
+        f"{SCRIPT}",
+        "-o", f"{tmpdir}",
+        "-l" , test_link,
+        "--no-pdf",
+        "--epub",
+        "--no-database",
+    ]
+    monkeypatch.setattr(sys, 'argv', testargs)
+    main()
+    last_message = caplog.records[-1].getMessage()
+    assert "Created" in last_message
+    output_file_path = pathlib.Path(last_message.split()[1])
+    assert output_file_path.suffix == ".epub"
+    with zipfile.ZipFile(output_file_path) as epub:
+        assert epub.namelist()[0] == "mimetype"
+        assert "OEBPS/chapter-1.xhtml" in epub.namelist()
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+
+import xml.dom.minidom
+import zipfile
+
+from risiparse.html_to_epub import EpubFile
+from risiparse.utils.utils import iter_html_chapters
+
+REMOTE_IMAGE = "https://image.noelshack.com/fichiers/2016/24/distant.png"
+
+
+def test_epub_from_html(tmp_path):
+    img_folder = tmp_path / "images"
+    img_folder.mkdir()
+    (img_folder / "local.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+    html = tmp_path / "auteur-titre-0.html"
+    html.write_text(
+        "<html><head><meta charset='utf-8'></head><body>"
+        "<div><p>Chapitre 1 &amp; la suite</p>"
+        "<img src='https://image.noelshack.com/fichiers/2016/24/local.png'>"
+        "</div>"
+        f"<div><p>Chapitre 2</p><img src='{REMOTE_IMAGE}'></div>"
+        "</body></html>",
+        encoding="utf-8"
+    )
+    epub_path = tmp_path / "auteur-titre-0.epub"
+    EpubFile(epub_path, img_folder).write(
+        "Titre", "auteur", iter_html_chapters(html)
+    )
+    assert epub_path.is_file()
+    # The temporary file was renamed to the epub
+    assert not list(tmp_path.glob(".*"))
+    with zipfile.ZipFile(epub_path) as epub:
+        names = epub.namelist()
+        assert names[0] == "mimetype"
+        assert epub.getinfo("mimetype").compress_type == zipfile.ZIP_STORED
+        assert "OEBPS/images/local.png" in names
+        for name in names:
+            if name.endswith((".xhtml", ".opf", ".xml")):
+                xml.dom.minidom.parseString(epub.read(name))
+        chapter_1 = epub.read("OEBPS/chapter-1.xhtml").decode("utf-8")
+        chapter_2 = epub.read("OEBPS/chapter-2.xhtml").decode("utf-8")
+        opf = epub.read("OEBPS/content.opf").decode("utf-8")
+    assert 'src="images/local.png"' in chapter_1
+    # The remote images are not allowed in epub 3, they become links
+    assert "<img" not in chapter_2
+    assert f'<a href="{REMOTE_IMAGE}">' in chapter_2
+    assert "remote-resources" not in opf
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+
+import json
+
+from risiparse.risiparse import download_risitas
+from risiparse.utils.utils_posts import Chapter
+
+from tests.conftest import FORUM_LINK, chapter_text
+
+
+def test_jsonl(forum, tmp_path):
+    jsonl = tmp_path / "chapters.jsonl"
+    forum.args.jsonl = str(jsonl)
+    forum.args.links = [FORUM_LINK]
+    forum.add_page(("auteur", chapter_text(1)), ("lecteur", "Pas mal"))
+    forum.add_page(("auteur", chapter_text(2)), ("lecteur", "La suite ?"))
+    download_risitas(forum.args)
+    forum.add_page(("auteur", chapter_text(3)))
+    download_risitas(forum.args)
+    records = [
+        json.loads(line)
+        for line in jsonl.read_text(encoding="utf-8").splitlines()
+    ]
+    # One record per chapter, the chapters already written are not again
+    assert [(record["page"], record["post_cursor"]) for record in records] == [
+        (1, 0), (2, 0), (3, 0)
+    ]
+    assert [record["text"] for record in records] == [
+        chapter_text(number) for number in (1, 2, 3)
+    ]
+    for record in records:
+        assert list(record) == list(Chapter._fields)
+        assert record["topic_id"] == "74793440"
+        assert record["title"] == "Titre"
+        assert record["author"] == "auteur"
+        assert record["html"].startswith("<div")
+        assert record["contains_image"] is False
+        assert record["image_urls"] == []
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+
+import concurrent.futures
+import threading
+
+import risiparse.risiparse as risiparse
+from risiparse.risiparse import download_topic
+from risiparse.utils.utils_files import file_lock, reserve_file
+import risiparse.utils.database as database
+
+from tests.conftest import FORUM_LINK, chapter_text
+
+
+def test_file_lock(tmp_path):
+    lock_path = tmp_path / ".locks" / "topic.lock"
+    locked = threading.Event()
+
+    def take_lock():
+        with file_lock(lock_path):
+            locked.set()
+
+    with file_lock(lock_path):
+        thread = threading.Thread(target=take_lock)
+        thread.start()
+        # The lock is held, the other holder waits
+        assert not locked.wait(0.3)
+    thread.join(5)
+    assert locked.is_set()
+
+
+def test_reserve_file(tmp_path):
+    file_path = tmp_path / "auteur-titre-0.html"
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        reserved = list(
+            executor.map(lambda _: reserve_file(file_path), range(8))
+        )
+    assert reserved.count(True) == 1
+    assert file_path.read_bytes() == b""
+    assert not reserve_file(file_path)
+
+
+def test_no_transaction_while_parsing(forum, monkeypatch):
+    forum.add_page(("auteur", chapter_text(1)))
+    get_posts = risiparse.Posts.get_posts
+    in_transaction = []
+
+    def check_get_posts(self, *args):
+        # The images of the posts are fetched without the write lock
+        in_transaction.append(database.get_connection().in_transaction)
+        return get_posts(self, *args)
+
+    monkeypatch.setattr(risiparse.Posts, "get_posts", check_get_posts)
+    download_topic(FORUM_LINK, forum.args)
+    assert in_transaction == [False]
+    assert len(list(database.read_chapters("74793440"))) == 1
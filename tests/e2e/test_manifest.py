@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+
+from risiparse.utils.utils import (
+    append_to_html_file,
+    get_file_hash,
+    get_html_files,
+    read_topic_files,
+    record_output,
+    write_html_file,
+)
+import risiparse.utils.database as database
+
+
+def test_manifest(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / "risiparse.db")
+    html_folder_path = tmp_path / "risitas-html"
+    html = html_folder_path / "auteur-titre-0.html"
+    write_html_file(html, ["<p>un</p>"])
+    record_output(tmp_path, html, "html", "74793440")
+    append_to_html_file(html, ["<p>deux</p>"])
+    record_output(tmp_path, html, "html", "74793440", hash_file=False)
+    assert database.read_topic_outputs("74793440")[0][3] is None
+    # The appended file is hashed once, when its hash is asked for
+    files = read_topic_files("74793440")
+    assert files == [(html, "html", html.stat().st_size, get_file_hash(html))]
+    assert database.read_topic_outputs("74793440")[0][3] == files[0][3]
+    # A file written without the database is only listed by a scan
+    other_html = html_folder_path / "74" / "auteur-autre-0.html.gz"
+    write_html_file(other_html, ["<p>un</p>"])
+    (html_folder_path / "images").mkdir()
+    (html_folder_path / "images" / "image.html").write_text("")
+    assert get_html_files(tmp_path) == [html]
+    assert get_html_files(tmp_path, scan=True) == [other_html, html]
+    assert get_html_files(tmp_path) == [other_html, html]
+    assert set(database.read_manifest(tmp_path, "html")) == {other_html, html}
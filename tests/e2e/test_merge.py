@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+from risiparse.risiparse import main
+from risiparse.utils.utils import is_in_shard, iter_topic_links
+from risiparse.utils.utils_posts import Chapter
+import risiparse.utils.database as database
+
+import pytest
+import sys
+import pathlib
+
+SCRIPT = pathlib.Path(__file__).parent / "risiparse" / "risiparse.py"
+
+LINK = "https://www.jeuxvideo.com/forums/42-51-74793440-1-0-1-0-risitas.htm"
+OTHER_LINK = "https://www.jeuxvideo.com/forums/42-51-68123456-1-0-1-0-autre.htm"
+
+
+def make_node(monkeypatch, node_dir, link, total_pages, texts, name=None):
+    """Fill an output dir as if a node had downloaded a risitas"""
+    monkeypatch.setattr(database, 'DB_PATH', node_dir / "risiparse.db")
+    topic_id = link.split("-")[2]
+    name = name or f"auteur-{topic_id}-0"
+    html = node_dir / "risitas-html" / f"{name}.html"
+    html.parent.mkdir(parents=True)
+    html.write_text("".join(texts))
+    (html.parent / "images").mkdir()
+    (html.parent / "images" / f"{topic_id}.png").write_bytes(b"png")
+    chapters = [
+        Chapter(topic_id, "Titre", "auteur", page, 0,
+                f"<p>{text}</p>", text, False, [])
+        for page, text in enumerate(texts, 1)
+    ]
+    for chapter in chapters:
+        database.insert_chapter(chapter)
+    database.index_chapters(html, chapters)
+    database.update_db("Titre", link, html, total_pages, 0, topic_id)
+    return html
+
+
+def test_merge(monkeypatch, tmp_path):
+    first_node = tmp_path / "node-0"
+    second_node = tmp_path / "node-1"
+    output_dir = tmp_path / "archive"
+    output_dir.mkdir()
+    make_node(monkeypatch, first_node, LINK, 2, ["un", "deux"])
+    make_node(monkeypatch, second_node, LINK, 3, ["un", "deux", "trois"])
+    database.update_db("Autre", OTHER_LINK,
+                       second_node / "risitas-html" / "autre.html", 1, 0)
+    testargs = [
+        f"{SCRIPT}",
+        "-o", f"{output_dir}",
+        "--database", f"{output_dir / 'risiparse.db'}",
+        "--merge", f"{second_node}", f"{first_node}",
+    ]
+    monkeypatch.setattr(sys, 'argv', testargs)
+    with pytest.raises(SystemExit):
+        main()
+    row = database.read_db(LINK)
+    html = output_dir / "risitas-html" / "auteur-74793440-0.html"
+    assert row[3] == str(html)
+    assert row[4] == 3
+    assert html.read_text() == "undeuxtrois"
+    assert [chapter[0] for chapter in database.read_chapters("74793440")] == [
+        1, 2, 3
+    ]
+    assert database.read_db(OTHER_LINK)[1] == "Autre"
+    assert (output_dir / "risitas-html" / "images" / "74793440.png").exists()
+    assert database.read_manifest(output_dir, "html") == [html]
+
+
+def test_merge_same_name(monkeypatch, tmp_path):
+    node = tmp_path / "node-0"
+    output_dir = tmp_path / "archive"
+    html = make_node(
+        monkeypatch, output_dir, LINK, 2, ["un", "deux"], "auteur-titre-0"
+    )
+    node_html = make_node(
+        monkeypatch, node, OTHER_LINK, 1, ["autre"], "auteur-titre-0"
+    )
+    (node / "risitas-pdf").mkdir()
+    (node / "risitas-pdf" / "auteur-titre-0.pdf").write_bytes(b"pdf")
+    node_html.with_name(f"{node_html.name}.journal").write_text("{}")
+    testargs = [
+        f"{SCRIPT}",
+        "-o", f"{output_dir}",
+        "--database", f"{output_dir / 'risiparse.db'}",
+        "--merge", f"{node}",
+    ]
+    monkeypatch.setattr(sys, 'argv', testargs)
+    with pytest.raises(SystemExit):
+        main()
+    # Another risitas has the same name, the next one is used
+    other_html = output_dir / "risitas-html" / "auteur-titre-1.html"
+    assert html.read_text() == "undeux"
+    assert other_html.read_text() == "autre"
+    assert database.read_db(LINK)[3] == str(html)
+    assert database.read_db(OTHER_LINK)[3] == str(other_html)
+    assert (output_dir / "risitas-pdf" / "auteur-titre-1.pdf").exists()
+    assert not (output_dir / "risitas-pdf" / "auteur-titre-0.pdf").exists()
+    assert not list(output_dir.rglob("*.journal"))
+    assert [row[3] for row in database.search_chapters("autre")] == [
+        str(other_html)
+    ]
+    assert [row[3] for row in database.search_chapters("deux")] == [
+        str(html)
+    ]
+
+
+def test_shard():
+    links = [
+        f"https://www.jeuxvideo.com/forums/42-51-{topic}-1-0-1-0-a.htm"
+        for topic in range(100, 200)
+    ]
+    shards = [
+        [topic_id for topic_id, _ in iter_topic_links(links, (index, 3))]
+        for index in range(3)
+    ]
+    assert sorted(sum(shards, [])) == [str(topic) for topic in range(100, 200)]
+    assert all(shards)
+    assert all(is_in_shard(topic_id, (1, 3)) for topic_id in shards[1])
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+from risiparse.utils.utils import (
+    PDF_FRAGMENT_CHAPTERS,
+    create_cached_pdfs,
+    get_parser,
+    get_pdf_cache_dir,
+    group_chapters,
+    iter_html_chapters,
+    write_html_file,
+)
+
+import hashlib
+
+from PyPDF2 import PdfReader, PdfWriter
+
+
+def write_blank_pdf(pdf_path, pages):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(100, 100)
+    with open(pdf_path, "wb") as pdf:
+        writer.write(pdf)
+
+
+def test_pdf_cache(tmp_path):
+    args = get_parser().parse_args(["-o", f"{tmp_path}", "--pdf-cache"])
+    html_folder_path = tmp_path / "risitas-html"
+    empty_html = html_folder_path / "auteur-vide-0.html"
+    html = html_folder_path / "auteur-titre-0.html"
+    # A risitas downloaded without any chapter
+    write_html_file(empty_html, [])
+    write_html_file(
+        html,
+        [f"<div><p>Chapitre {number}</p></div>" for number in range(15)]
+    )
+    cache_dir = get_pdf_cache_dir(tmp_path, html)
+    cache_dir.mkdir(parents=True)
+    # Every fragment is already rendered, only the merge is left
+    for pages, chapters in enumerate(
+            group_chapters(
+                iter_html_chapters(html),
+                args.pdf_part_size,
+                PDF_FRAGMENT_CHAPTERS
+            ),
+            1
+    ):
+        fragment_hash = hashlib.sha256(
+            "".join(chapters).encode("utf-8")
+        ).hexdigest()
+        write_blank_pdf(cache_dir / f"{fragment_hash}.pdf", pages)
+    write_blank_pdf(cache_dir / "unused.pdf", 1)
+    pdfs = create_cached_pdfs(
+        tmp_path,
+        [empty_html, html],
+        str(tmp_path),
+        args
+    )
+    pdf_path = tmp_path / "risitas-pdf" / "auteur-titre-0.pdf"
+    assert pdfs == [pdf_path]
+    assert len(PdfReader(str(pdf_path)).pages) == 3
+    assert not (cache_dir / "unused.pdf").exists()
+    assert not (tmp_path / "risitas-pdf" / "auteur-vide-0.pdf").exists()
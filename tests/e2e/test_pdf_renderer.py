@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+import pathlib
+import types
+
+import pytest
+
+# QtWebEngine needs the libraries of a desktop to be loaded
+html_to_pdf = pytest.importorskip(
+    "risiparse.html_to_pdf", exc_type=ImportError
+)
+PDF_PAGE = html_to_pdf.PdfPage
+
+
+class StubPage():
+    """A pdf page without Qt, it converts the files of its pool"""
+
+    def __init__(self, output_dir, pool=None, timeout=0):
+        self.pool = pool
+        self.files_rendered = 0
+        self.deleted = False
+
+    def _fetch_next(self):
+        return next(self.pool.htmls, None) is not None
+
+    def deleteLater(self):  # pylint: disable=invalid-name
+        self.deleted = True
+
+
+class PrintingPage(StubPage):
+    """A stub page that prints like a pdf page"""
+
+    _fail = PDF_PAGE._fail
+    _done = PDF_PAGE._done
+    _handle_printing_finished = PDF_PAGE._handle_printing_finished
+
+    def __init__(self, output_dir, pool=None, timeout=0):
+        super().__init__(output_dir, pool, timeout)
+        self.timer = types.SimpleNamespace(stop=lambda: None)
+        self.failed = pool.failed
+        self.current_file = pathlib.Path()
+        self._pdf_file = ""
+        self._rendering = True
+
+
+@pytest.fixture
+def pool(monkeypatch, tmp_path):
+    monkeypatch.setattr(html_to_pdf, "PdfPage", StubPage)
+    monkeypatch.setattr(
+        html_to_pdf.QtWidgets.QApplication, "quit", lambda: None
+    )
+    pool = html_to_pdf.PdfRendererPool(
+        tmp_path, 1, 60, recycle_after=2, max_memory=100 << 20
+    )
+    pool.convert([pathlib.Path(f"{number}.html") for number in range(5)])
+    return pool
+
+
+def test_recycle_after(pool, monkeypatch):
+    monkeypatch.setattr(html_to_pdf, "get_renderer_memory", lambda page: 0)
+    page = pool.pages[0]
+    page.files_rendered = 1
+    pool.page_done(page)
+    assert pool.pages == [page]
+    page.files_rendered = 2
+    pool.page_done(page)
+    assert page.deleted
+    assert pool.pages[0] is not page
+
+
+def test_recycle_max_memory(pool, monkeypatch):
+    memory = {"used": 50 << 20}
+    monkeypatch.setattr(
+        html_to_pdf, "get_renderer_memory", lambda page: memory["used"]
+    )
+    page = pool.pages[0]
+    pool.page_done(page)
+    assert pool.pages == [page]
+    memory["used"] = 200 << 20
+    pool.page_done(page)
+    assert page.deleted
+
+
+def test_timeout(pool, monkeypatch, tmp_path):
+    monkeypatch.setattr(html_to_pdf, "get_renderer_memory", lambda page: 0)
+    pdf_file = tmp_path / ".auteur-titre-0.pdf.1.tmp"
+    pdf_file.write_bytes(b"%PDF")
+    page = PrintingPage(tmp_path, pool)
+    page.current_file = pathlib.Path("0.html")
+    page._pdf_file = str(pdf_file)
+    pool.pages = [page]
+    page._fail("timed out after 60s")
+    # The page of a file that timed out is always replaced
+    assert pool.failed == [pathlib.Path("0.html")]
+    assert page.deleted
+    assert not pdf_file.exists()
+    # A pdf printed after its timeout is removed
+    pdf_file.write_bytes(b"%PDF")
+    page._handle_printing_finished(str(pdf_file), True)
+    assert not pdf_file.exists()
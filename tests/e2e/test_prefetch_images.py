@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+
+from risiparse.risiparse import PageDownloader
+
+import requests
+
+
+class Response():
+    def __init__(self, url, status_code):
+        self.url = url
+        self.status_code = status_code
+        self.content = b"png"
+
+
+class Session():
+    def get(self, link):
+        if "connection" in link:
+            raise requests.exceptions.ConnectionError(link)
+        return Response(link, 404 if "404" in link else 200)
+
+
+def test_prefetch_images(monkeypatch, tmp_path):
+    page_downloader = PageDownloader("image.noelshack.com")
+    page_downloader.http = Session()
+
+    def get_webarchive_img(link):
+        raise requests.exceptions.ConnectionError(link)
+
+    monkeypatch.setattr(
+        page_downloader,
+        "get_webarchive_img",
+        get_webarchive_img
+    )
+    links = [
+        "https://image.noelshack.com/fichiers/2016/a.png",
+        "https://image.noelshack.com/fichiers/2016/404.png",
+        "https://image.noelshack.com/fichiers/2016/connection.png",
+    ]
+    # The images that fail don't stop the others
+    assert page_downloader.prefetch_images(links, tmp_path) == 1
+    assert [path.name for path in tmp_path.iterdir()] == ["a.png"]
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+from risiparse.risiparse import main, renewing_lease
+import risiparse.utils.database as database
+
+import pytest
+import sys
+import pathlib
+import sqlite3
+import time
+
+SCRIPT = pathlib.Path(__file__).parent / "risiparse" / "risiparse.py"
+
+LINKS = [
+    "https://www.jeuxvideo.com/forums/42-51-74793440-1-0-1-0-risitas-el-famoso.htm",
+    "https://www.jeuxvideo.com/forums/42-51-74793440-2-0-1-0-risitas-el-famoso.htm#post_1",
+    "https://jvarchive.com/forums/42-51-74793440-1-0-1-0-risitas-el-famoso.htm",
+    "https://www.jeuxvideo.com/forums/42-51-68123456-1-0-1-0-un-autre-risitas.htm",
+]
+
+
+def run(monkeypatch, tmp_path, *options):
+    testargs = [f"{SCRIPT}", "-o", f"{tmp_path}", *options]
+    monkeypatch.setattr(sys, 'argv', testargs)
+    with pytest.raises(SystemExit):
+        main()
+
+
+def test_enqueue(monkeypatch, tmp_path, capsys):
+    database_path = tmp_path / "risiparse.db"
+    monkeypatch.setattr(database, 'DB_PATH', database_path)
+    links_file = tmp_path / "risitas-links"
+    links_file.write_text("\n".join(LINKS) + "\n")
+    run(monkeypatch, tmp_path, "--enqueue", "--links", f"{links_file}")
+    run(monkeypatch, tmp_path, "--enqueue", "--priority", "5",
+        "--links", LINKS[3])
+    job = database.lease_job("worker", 60)
+    assert job == ("68123456", LINKS[3], 1)
+    database.finish_job(job[0], "worker", "ValueError()")
+    run(monkeypatch, tmp_path, "--queue-status")
+    output = capsys.readouterr().out
+    assert "failed: 1 jobs" in output
+    assert "queued: 1 jobs" in output
+    assert "ValueError()" in output
+    run(monkeypatch, tmp_path, "--queue-retry")
+    assert database.lease_job("worker", 60)[0] == "68123456"
+    assert database.lease_job("worker", 60)[0] == "74793440"
+    assert database.lease_job("worker", 60) is None
+
+
+def test_lease(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / "risiparse.db")
+    database.enqueue_jobs([("74793440", LINKS[0])])
+    assert database.lease_job("worker", 0.3, 2) == ("74793440", LINKS[0], 1)
+    # The lease is renewed during a download longer than the lease
+    with renewing_lease("74793440", "worker", 0.3):
+        time.sleep(0.5)
+        assert database.lease_job("other", 0.3, 2) is None
+    time.sleep(0.4)
+    assert database.lease_job("other", 0, 2)[2] == 2
+    # The lease expired too many times, the job is failed
+    assert database.lease_job("other", 0, 2) is None
+    job = database.read_job("74793440")
+    assert job[3] == "failed"
+    assert job[9] == "The lease expired 2 times"
+    assert database.retry_jobs() == 1
+    assert database.lease_job("worker", 60, 2)[2] == 1
+    database.close_db()
+
+
+def test_busy_queue(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / "risiparse.db")
+    database.get_connection().execute("pragma busy_timeout = 0")
+    writer = sqlite3.connect(tmp_path / "risiparse.db")
+    writer.execute("begin immediate")
+    # A busy database isn't an empty queue
+    with pytest.raises(sqlite3.OperationalError):
+        database.enqueue_jobs([("74793440", LINKS[0])])
+    with pytest.raises(sqlite3.OperationalError):
+        database.lease_job("worker", 60)
+    writer.rollback()
+    writer.close()
+    assert database.enqueue_jobs([("74793440", LINKS[0])]) == 1
+    assert database.lease_job("worker", 60)[0] == "74793440"
+    database.close_db()
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+
+from risiparse.risiparse import main
+from risiparse.utils.utils_posts import Chapter
+import risiparse.utils.database as database
+
+import pytest
+import sqlite3
+import sys
+import pathlib
+
+SCRIPT = pathlib.Path(__file__).parent / "risiparse" / "risiparse.py"
+
+def test_search(monkeypatch, tmp_path, capsys):
+    database_path = tmp_path / "risiparse.db"
+    monkeypatch.setattr(database, 'DB_PATH', database_path)
+    chapters = [
+        Chapter("1", "Un celestin a Istanbul", "turkissou9", page, 0,
+                f"<p>{text}</p>", text, False, [])
+        for page, text in [
+            (1, "Chapitre 1 : le départ pour la Turquie"),
+            (2, "Chapitre 2 : la rencontre au bazar"),
+        ]
+    ]
+    database.index_chapters(tmp_path / "turkissou9-0.html", chapters)
+    testargs = [
+        f"{SCRIPT}",
+        "-o", f"{tmp_path}",
+        "--search", "depart turquie"
+    ]
+    monkeypatch.setattr(sys, 'argv', testargs)
+    with pytest.raises(SystemExit):
+        main()
+    output = capsys.readouterr().out
+    assert "turkissou9-0.html" in output
+    assert "page 1" in output
+    assert "bazar" not in output
+
+
+def test_reindex(monkeypatch, tmp_path):
+    database_path = tmp_path / "risiparse.db"
+    # An index of the previous schema, without the rowid of its rows
+    con = sqlite3.connect(database_path)
+    con.execute(
+        '''create virtual table chapters_fts using fts5
+        (text, title, author, topic_id unindexed, page unindexed,
+        file_path unindexed)'''
+    )
+    con.execute(
+        '''insert into chapters_fts values
+        ('Chapitre 1 : le départ', 'Titre', 'auteur', '1', 1, ?)''',
+        (str(tmp_path / "auteur-0.html"), )
+    )
+    con.execute("pragma user_version = 3")
+    con.commit()
+    con.close()
+    monkeypatch.setattr(database, 'DB_PATH', database_path)
+    chapter = Chapter("1", "Titre", "auteur", 1, 0, "<p>Chapitre 1</p>",
+                      "Chapitre 1 : l'arrivée", False, [])
+    database.index_chapters(tmp_path / "auteur-0.html", [chapter], True)
+    assert not database.search_chapters("depart")
+    assert len(database.search_chapters("arrivee")) == 1
+    con = database.get_connection()
+    assert con.execute(
+        "select count(*) from chapters_fts_rows"
+    ).fetchone()[0] == 1
+    database.close_db()
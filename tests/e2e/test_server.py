@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+import risiparse.risiparse as risiparse
+from risiparse.server import RisiparseServer
+from risiparse.utils.utils import get_parser, record_output
+import risiparse.utils.database as database
+
+import json
+import sqlite3
+import urllib.error
+import urllib.request
+
+import pytest
+
+LINK = "https://www.jeuxvideo.com/forums/42-51-74793440-1-0-1-0-risitas.htm"
+
+
+def request(server, path, body=None):
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    with urllib.request.urlopen(url, data) as response:
+        return response.status, response.read()
+
+
+def test_server(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / "risiparse.db")
+    html = tmp_path / "risitas-html" / "auteur-titre-0.html"
+    html.parent.mkdir()
+    html.write_text("<p>Chapitre 1</p>")
+    server = RisiparseServer(("127.0.0.1", 0), tmp_path)
+    server.start()
+    try:
+        status, body = request(server, "/jobs", {"links": [LINK, LINK]})
+        assert status == 202
+        assert json.loads(body)["jobs"] == [
+            {"topic_id": "74793440", "link": LINK}
+        ]
+        assert server.submitted.is_set()
+        assert json.loads(request(server, "/jobs")[1]) == {"queued": 1}
+        job = database.lease_job("worker", 60)
+        record_output(tmp_path, html, "html", job[0])
+        database.finish_job(job[0], "worker")
+        job = json.loads(request(server, "/jobs/74793440")[1])
+        assert job["state"] == "done"
+        assert job["files"][0]["path"] == (
+            "/files/risitas-html/auteur-titre-0.html"
+        )
+        assert request(server, job["files"][0]["path"])[1] == (
+            b"<p>Chapitre 1</p>"
+        )
+        for path in ["/jobs/1", "/files/../risiparse.db", "/files/x"]:
+            try:
+                request(server, path)
+                assert False, path
+            except urllib.error.HTTPError as error:
+                assert error.code == 404
+        for body in [{"links": 5}, {"links": [5]}, {"link": LINK}, [LINK]]:
+            try:
+                request(server, "/jobs", body)
+                assert False, body
+            except urllib.error.HTTPError as error:
+                assert error.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_serve_after_error(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / "risiparse.db")
+    monkeypatch.setattr(risiparse, "SERVE_POLL_INTERVAL", 0.01)
+    calls = []
+
+    def process_jobs(args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(risiparse, "process_jobs", process_jobs)
+    args = get_parser().parse_args(
+        ["-o", f"{tmp_path}", "--serve", "--port", "0", "--no-pdf"]
+    )
+    # The jobs are processed again after an error
+    with pytest.raises(KeyboardInterrupt):
+        risiparse.serve(args)
+    assert len(calls) == 2
+
+
+def test_webarchive_args():
+    args = get_parser().parse_args([])
+    posts_downloader = risiparse.RisitasPostsDownload(None, args)
+    posts_downloader.disable_database_webarchive("web.archive.org")
+    assert posts_downloader.args.no_database
+    # The next risitas downloaded with the args uses the database
+    assert not args.no_database
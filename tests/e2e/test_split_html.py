@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+
+from risiparse.utils.utils import (
+    append_to_html_file,
+    get_pdf_path,
+    group_chapters,
+    iter_html_chapters,
+    split_big_html,
+    write_html_file,
+)
+
+
+def test_iter_html_chapters(tmp_path):
+    html = tmp_path / "auteur-titre-0.html"
+    html.write_text(
+        "<html><head></head><body>Avant &amp; "
+        "<div><div><p>Chapitre 1</p></div><p>fin</p></div> entre "
+        "<div><p>Chapitre 2</p></div></body></html>",
+        encoding="utf-8"
+    )
+    # The nested divs stay in their chapter, the loose text is kept
+    assert list(iter_html_chapters(html)) == [
+        "Avant &amp; ",
+        "<div><div><p>Chapitre 1</p></div><p>fin</p></div> entre ",
+        "<div><p>Chapitre 2</p></div>",
+    ]
+
+
+def test_iter_appended_gzip_html(tmp_path):
+    html = tmp_path / "auteur-titre-0.html.gz"
+    write_html_file(html, ["<div><p>Chapitre 1</p></div>"])
+    append_to_html_file(html, ["<div><p>Chapitre 2 à suivre</p></div>"])
+    assert list(iter_html_chapters(html)) == [
+        "<div><p>Chapitre 1</p></div>",
+        "<div><p>Chapitre 2 à suivre</p></div>",
+    ]
+
+
+def test_group_chapters():
+    chapters = ["a" * 4, "é" * 2, "b" * 3, "c" * 10, "d"]
+    # The size is counted in bytes, a chapter too big gets its own part
+    assert list(group_chapters(chapters, 8)) == [
+        ["a" * 4, "é" * 2], ["b" * 3], ["c" * 10], ["d"]
+    ]
+    assert list(group_chapters(chapters, 100, 2)) == [
+        ["a" * 4, "é" * 2], ["b" * 3, "c" * 10], ["d"]
+    ]
+    # The first parts don't change when chapters are appended
+    assert list(group_chapters(chapters + ["e" * 8], 8))[:3] == [
+        ["a" * 4, "é" * 2], ["b" * 3], ["c" * 10]
+    ]
+    assert not list(group_chapters([], 8))
+
+
+def test_split_big_html(tmp_path):
+    html = tmp_path / "risitas-html" / "auteur-titre-0.html.gz"
+    html.parent.mkdir()
+    chapters = [
+        f"<div><p>Chapitre {number}</p></div>" for number in range(5)
+    ]
+    write_html_file(html, chapters[:3])
+    append_to_html_file(html, chapters[3:])
+    part_tmpdir = tmp_path / "parts"
+    part_tmpdir.mkdir()
+    chapter_size = len(chapters[0])
+    splitted_pdfs = split_big_html(
+        html, str(part_tmpdir), {}, tmp_path, 2 * chapter_size
+    )
+    pdf_path = tmp_path / "risitas-pdf" / "auteur-titre-0.pdf"
+    assert get_pdf_path(tmp_path, html) == pdf_path
+    parts = splitted_pdfs[str(pdf_path)]
+    assert len(parts) == 3
+    assert [list(iter_html_chapters(part)) for part in parts] == [
+        chapters[0:2], chapters[2:4], chapters[4:]
+    ]
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+import os
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).parents[2]
+
+# Only loaded by the paths that need them
+HEAVY_MODULES = ["PySide6", "waybackpy", "PyPDF2"]
+
+# Import time allowed for a module, in microseconds, about 0.3s is
+# measured, the margin is for slow machines
+IMPORT_BUDGET = 1_000_000
+
+
+def import_times(module, cwd):
+    """Import a module in a new interpreter, return the cumulative
+    import time in microseconds of each module it loaded"""
+    env = dict(os.environ, HOME=str(cwd), PYTHONPATH=str(ROOT))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize(
+    "module",
+    ["risiparse.risiparse", "risiparse.api", "risiparse.utils.utils"]
+)
+def test_startup(tmp_path, module):
+    times = import_times(module, tmp_path)
+    assert times[module] < IMPORT_BUDGET, (
+        f"{module} imported in {times[module] / 1000:.1f}ms"
+    )
+    loaded = {name.split(".")[0] for name in times}
+    for heavy_module in HEAVY_MODULES:
+        assert heavy_module not in loaded
+    # Importing doesn't create the database directory nor any file
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+import json
+
+import risiparse.risiparse as risiparse
+from risiparse.risiparse import download_risitas, download_topic, sync_topic
+from risiparse.utils.utils import read_html_text
+import risiparse.utils.database as database
+
+from tests.conftest import FORUM_LINK, chapter_text
+
+
+def count_chapters(html, numbers):
+    text = read_html_text(html)
+    return [text.count(chapter_text(number)) for number in numbers]
+
+
+def test_sync(forum):
+    forum.add_page(("auteur", chapter_text(1)), ("lecteur", "Pas mal"))
+    forum.add_page(("auteur", chapter_text(2)))
+    html = download_topic(FORUM_LINK, forum.args)
+    assert forum.downloads == [1, 1, 2]
+    # Nothing changed, page 1 and the last page are downloaded once
+    forum.downloads.clear()
+    assert sync_topic(FORUM_LINK, forum.args) is None
+    assert forum.downloads == [1, 2]
+    # A new page, the last page known is not downloaded again
+    forum.pages[1].append(("lecteur", "La suite ?"))
+    forum.add_page(("auteur", chapter_text(3)))
+    forum.downloads.clear()
+    assert sync_topic(FORUM_LINK, forum.args) == html
+    assert forum.downloads == [1, 2, 3]
+    text = read_html_text(html)
+    assert [text.count(chapter_text(number)) for number in (1, 2, 3)] == [
+        1, 1, 1
+    ]
+    # An edited chapter gets the html file rebuilt
+    forum.pages[0][0] = ("auteur", chapter_text(1).replace("suite", "fin"))
+    forum.downloads.clear()
+    assert sync_topic(FORUM_LINK, forum.args) == html
+    assert forum.downloads == [1, 2, 3]
+    assert "Chapitre 1 la fin" in read_html_text(html)
+    assert database.read_db(FORUM_LINK)[4] == 3
+    # The rebuilt html file is indexed again
+    assert [row[3] for row in database.search_chapters("fin")] == [
+        str(html)
+    ]
+
+
+def test_sync_new_chapter_on_last_page(forum, monkeypatch):
+    forum.add_page(("auteur", chapter_text(1)), ("lecteur", "Pas mal"))
+    forum.add_page(("auteur", chapter_text(2)))
+    html = download_topic(FORUM_LINK, forum.args)
+    forum.pages[1].append(("auteur", chapter_text(3)))
+    rebuilt = []
+    rebuild_html = risiparse.rebuild_html
+
+    def check_rebuild_html(*args):
+        rebuilt.append(args)
+        return rebuild_html(*args)
+
+    monkeypatch.setattr(risiparse, "rebuild_html", check_rebuild_html)
+    # The new chapter is appended, the file is not rebuilt
+    assert sync_topic(FORUM_LINK, forum.args) == html
+    assert not rebuilt
+    assert count_chapters(html, (1, 2, 3)) == [1, 1, 1]
+    assert len(list(database.read_chapters("74793440"))) == 3
+    assert len(database.search_chapters("3")) == 1
+
+
+def test_sync_edited_chapter(forum):
+    forum.add_page(("auteur", chapter_text(1)), ("lecteur", "Pas mal"))
+    forum.add_page(("auteur", chapter_text(2)))
+    html = download_topic(FORUM_LINK, forum.args)
+    forum.pages[1][0] = (
+        "auteur", chapter_text(2).replace("suite", "zzzedited")
+    )
+    assert sync_topic(FORUM_LINK, forum.args) == html
+    assert "zzzedited" in read_html_text(html)
+    assert count_chapters(html, (1, 2)) == [1, 0]
+    assert [row[3] for row in database.search_chapters("zzzedited")] == [
+        str(html)
+    ]
+    assert not database.search_chapters('"Chapitre 2 la suite"')
+
+
+def test_sync_jsonl(forum, tmp_path):
+    jsonl = tmp_path / "chapters.jsonl"
+    forum.args.jsonl = str(jsonl)
+    forum.args.links = [FORUM_LINK]
+    forum.add_page(("auteur", chapter_text(1)), ("lecteur", "Pas mal"))
+    forum.add_page(("auteur", chapter_text(2)))
+    download_risitas(forum.args)
+    forum.args.sync = True
+    forum.pages[0][0] = (
+        "auteur", chapter_text(1).replace("suite", "fin")
+    )
+    forum.pages[1].append(("auteur", chapter_text(3)))
+    download_risitas(forum.args)
+    records = [
+        json.loads(line)
+        for line in jsonl.read_text(encoding="utf-8").splitlines()
+    ]
+    # Only the new chapter of the sync is written, the edited one isn't
+    assert [(record["page"], record["post_cursor"]) for record in records] == [
+        (1, 0), (2, 0), (2, 1)
+    ]
+    assert records[-1]["text"] == chapter_text(3)
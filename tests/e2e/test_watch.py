@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+import risiparse.risiparse as risiparse
+from risiparse.utils.utils import get_parser, read_html_text
+import risiparse.utils.database as database
+
+import pytest
+import sys
+import pathlib
+
+from tests.conftest import FORUM_LINK, chapter_text
+
+SCRIPT = pathlib.Path(__file__).parent / "risiparse" / "risiparse.py"
+
+
+LINK = "https://www.jeuxvideo.com/forums/42-51-74793440-1-0-1-0-risitas.htm"
+
+
+def test_watch(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', tmp_path / "risiparse.db")
+    database.update_db("Titre", LINK, tmp_path / "titre.html", 3, 2)
+    database.update_page("74793440", 3, "hash", '"etag"', None, 4)
+    validators = []
+
+    def download_topic_page(self, link, page_number=1, validators_=None):
+        validators.append((page_number, validators_))
+        self.not_modified = True
+
+    downloads = []
+    monkeypatch.setattr(
+        risiparse.PageDownloader,
+        "download_topic_page",
+        download_topic_page
+    )
+    monkeypatch.setattr(
+        risiparse,
+        "download_locked",
+        lambda link, *args: downloads.append(link)
+    )
+    args = get_parser().parse_args([
+        "-o", f"{tmp_path}",
+        "--watch-min-interval", "10",
+        "--watch-max-interval", "20",
+    ])
+    scheduler = risiparse.WatchScheduler(args)
+    scheduler.add("74793440", LINK)
+    for _ in range(3):
+        scheduler.run_due(scheduler.heap[0][0])
+    assert validators == [(3, ('"etag"', None))] * 3
+    assert not downloads
+    assert database.read_watch("74793440")[0] == 20
+    scheduler.add(
+        "68123456",
+        "https://www.jeuxvideo.com/forums/42-51-68123456-1-0-1-0-autre.htm"
+    )
+    scheduler.run_due(scheduler.heap[0][0])
+    assert len(downloads) == 1
+    assert database.read_watch("68123456")[0] == 10
+
+
+def test_watch_changed(forum):
+    forum.add_page(("auteur", chapter_text(1)), ("lecteur", "Pas mal"))
+    forum.add_page(("auteur", chapter_text(2)))
+    html = risiparse.download_topic(FORUM_LINK, forum.args)
+    forum.args.watch_min_interval = 10
+    forum.args.watch_max_interval = 100
+    scheduler = risiparse.WatchScheduler(forum.args)
+    scheduler.add("74793440", FORUM_LINK)
+    for _ in range(2):
+        scheduler.run_due(scheduler.heap[0][0])
+    assert database.read_watch("74793440")[0] == 22.5
+    # A new page, the risitas is downloaded and checked more often
+    forum.pages[1].append(("lecteur", "La suite ?"))
+    forum.add_page(("auteur", chapter_text(3)))
+    assert scheduler.run_due(scheduler.heap[0][0]) == [html]
+    assert chapter_text(3) in read_html_text(html)
+    assert database.read_watch("74793440")[0] == 11.25
+    # The posts of the last page changed
+    forum.pages[2].append(("lecteur", "Merci"))
+    forum.downloads.clear()
+    assert scheduler.run_due(scheduler.heap[0][0]) == []
+    # Checked, then downloaded again
+    assert forum.downloads == [3, 1, 3]
+    assert database.read_watch("74793440")[0] == 10
+
+
+def test_watch_no_database(monkeypatch, tmp_path, capsys):
+    testargs = [f"{SCRIPT}", "-o", f"{tmp_path}", "--watch", "--no-database"]
+    monkeypatch.setattr(sys, 'argv', testargs)
+    with pytest.raises(SystemExit) as exit_info:
+        risiparse.main()
+    assert exit_info.value.code == 2
+    error = capsys.readouterr().err
+    assert "--watch can't be used with --no-database" in error